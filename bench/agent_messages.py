@@ -0,0 +1,101 @@
+"""
+Size and parse cost of agent messages per framing.
+
+Builds typical hardware_info, usage_info (protocol 1) and usage_delta
+(protocol 2) messages and reports, for JSON and MessagePack frames, the
+bytes per message on the wire with and without permessage-deflate (a
+raw deflate stream kept across messages, flushed after each one, as the
+extension does with context takeover) and the best time to parse one
+frame with protocol.decode_message and the plain json module.
+"""
+import argparse
+import json
+import time
+import zlib
+
+from fleet import make_system
+
+import protocol
+from util import JSON_BACKEND, dataclass_to_primitive
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def messages(index: int) -> dict[str, dict]:
+    system = dataclass_to_primitive(make_system(index, events=0))
+    network = {k: v for k, v in system["network"].items() if k != "__type__"}
+    disks = [{"device": d["device"], "used_gib": d["used_gib"]} for d in system["disks"]]
+    return {
+        "hardware_info": {
+            "type": "hardware_info", "system_id": system["id"], "timestamp": time.time(),
+            "hardware": {
+                "network": network,
+                "os": {k: v for k, v in system["os"].items() if k != "__type__"},
+                "cpu": {"physical_cores": 8, "logical_cores": 16, "max_frequency_mhz": 3600},
+                "mem_total_gib": 64.0,
+                "disks": [{"device": d["device"], "mountpoint": d["mountpoint"], "fstype": d["fstype"], "total_gib": d["total_gib"]} for d in system["disks"]],
+            },
+        },
+        "usage_info": {
+            "type": "usage_info", "system_id": system["id"], "timestamp": time.time(),
+            "usage": {"cpu_pct": system["cpu"]["usage_pct"], "mem_used_gib": system["memory"]["used_gib"], "disks": disks, "network": network},
+            "watched_services": [{"name": s["name"], "running": s["running"], "status": s["status"]} for s in system["services"]],
+        },
+        "usage_delta": {
+            "type": "usage_delta", "system_id": system["id"], "timestamp": time.time(), "seq": 2,
+            "usage": {"cpu_pct": system["cpu"]["usage_pct"], "mem_used_gib": system["memory"]["used_gib"], "disks": {d["device"]: d["used_gib"] for d in disks}},
+        },
+    }
+
+
+def deflated_size(frames: list[bytes]) -> float:
+    """Average compressed bytes per frame over one permessage-deflate stream."""
+    compressor = zlib.compressobj(wbits=-15)
+    total = 0
+    for frame in frames:
+        # the extension strips the trailing 00 00 ff ff of every flush
+        total += len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return total / len(frames)
+
+
+def best_us(func, arg, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(1000):
+            func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=200, help="messages per stream for the deflate sizes")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    encoders = {"json": lambda m: json.dumps(m).encode()}
+    if msgpack is not None:
+        encoders["msgpack"] = msgpack.packb
+    parsers = {"json": [(f"decode_message ({JSON_BACKEND})", protocol.decode_message), ("json.loads", json.loads)]}
+    if msgpack is not None:
+        parsers["msgpack"] = [("decode_message", protocol.decode_message)]
+
+    print(f"bytes per message over {args.samples} messages of one agent, parse time best of {args.repeat}\n")
+    print(f"  {'message':<14} {'framing':<8} {'bytes':>6} {'deflate':>8}   parse")
+    for kind in ("hardware_info", "usage_info", "usage_delta"):
+        stream = [messages(1)[kind] for _ in range(args.samples)]
+        for framing, encode in encoders.items():
+            frames = [encode(m) for m in stream]
+            # text frames arrive as str
+            frame = frames[0].decode() if framing == "json" else frames[0]
+            timings = ", ".join(f"{name} {best_us(parse, frame, args.repeat):.1f} us" for name, parse in parsers[framing])
+            size = sum(map(len, frames)) / len(frames)
+            print(f"  {kind:<14} {framing:<8} {size:6.0f} {deflated_size(frames):8.0f}   {timings}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Synthetic fleets for the benchmarks in this folder.
+
+Run the benchmarks from the repository root, e.g. ``python bench/loop_blocking.py``.
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "core"))
+
+from models import Event, EventLevel, EventType, Provider, Site, System, SystemCPU, SystemDisk, SystemMemory, SystemNetwork, SystemOS, SystemService
+
+
+def make_system(index: int, events: int = 5) -> System:
+    return System(
+        id=f"system-{index}",
+        name=f"System {index}",
+        type="server",
+        os=SystemOS("Linux", "6.1.0", "#1 SMP Debian", "x86_64", "x86_64"),
+        cpu=SystemCPU(8, 16, 3600, usage_pct=random.uniform(0, 100)),
+        memory=SystemMemory(64.0, used_gib=random.uniform(0, 64)),
+        network=SystemNetwork(
+            hostname=f"host-{index}",
+            fqdn=f"host-{index}.example.com",
+            public_ip=f"203.0.113.{index % 256}",
+            interfaces={"eth0": [f"10.0.{index // 256 % 256}.{index % 256}", "fe80::1"], "lo": ["127.0.0.1", "::1"]},
+        ),
+        disks=[
+            SystemDisk("/dev/sda1", "/", "ext4", 512.0, used_gib=random.uniform(0, 512)),
+            SystemDisk("/dev/sdb1", "/data", "xfs", 4096.0, used_gib=random.uniform(0, 4096)),
+        ],
+        services=[SystemService("nginx", True, "active"), SystemService("postgres", True, "active")],
+        events=[
+            Event(
+                level=EventLevel.WARNING,
+                type=EventType.CPU,
+                timestamp=time.time(),
+                clearable=True,
+                cleared=bool(i % 2),
+                description=f"CPU usage is at {80 + i}%.",
+            )
+            for i in range(events)
+        ],
+        last_seen=int(time.time()),
+        connected=True,
+        group=f"group-{index % 10}",
+    )
+
+
+def make_fleet(systems: int, providers: int = 5, sites_per_provider: int = 4, events: int = 5) -> list[Provider]:
+    random.seed(0)
+    sites = [
+        Site(name=f"site-{p}-{s}", type="datacenter", geoname="", systems=[])
+        for p in range(providers)
+        for s in range(sites_per_provider)
+    ]
+    for i in range(systems):
+        sites[i % len(sites)].systems.append(make_system(i, events))
+
+    return [
+        Provider(name=f"provider-{p}", sites=sites[p * sites_per_provider:(p + 1) * sites_per_provider])
+        for p in range(providers)
+    ]
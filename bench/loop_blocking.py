@@ -0,0 +1,81 @@
+"""
+Event-loop blocking caused by SystemDB persistence.
+
+A probe task sleeps for 1 ms in a loop and records how late it wakes up,
+while the database is persisted repeatedly, once with the synchronous
+``save_to_file()`` on the loop (the old behaviour) and once through the
+writer thread (``flush_async()``, which only snapshots on the loop).
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from fleet import make_fleet
+
+from db import SystemDB
+
+BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+
+def histogram(samples: list[float]) -> str:
+    counts = [0] * (len(BUCKETS_MS) + 1)
+    for sample in samples:
+        for i, bound in enumerate(BUCKETS_MS):
+            if sample <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+
+    lines = []
+    labels = [f"<= {b} ms" for b in BUCKETS_MS] + [f"> {BUCKETS_MS[-1]} ms"]
+    for label, count in zip(labels, counts):
+        lines.append(f"  {label:>12} {count:6d} {'#' * min(count, 60)}")
+    lines.append(f"  {'max':>12} {max(samples):9.2f} ms")
+    return "\n".join(lines)
+
+
+async def probe(samples: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        samples.append((time.perf_counter() - start) * 1000 - 1)
+
+
+async def run(db: SystemDB, flushes: int, threaded: bool) -> list[float]:
+    samples: list[float] = []
+    stop = asyncio.Event()
+    task = asyncio.create_task(probe(samples, stop))
+    for _ in range(flushes):
+        db.mark_dirty(compact=True)
+        if threaded:
+            await db.flush_async()
+        else:
+            db.save_to_file()
+        await asyncio.sleep(0.01)
+    stop.set()
+    await task
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--systems", type=int, default=2000)
+    parser.add_argument("--flushes", type=int, default=20)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    db = SystemDB(flush_interval=1)
+    db.providers = make_fleet(args.systems)
+
+    for name, threaded in (("before: save_to_file() on the loop", False), ("after: snapshot + writer thread", True)):
+        samples = asyncio.run(run(db, args.flushes, threaded))
+        print(f"{name} ({args.systems} systems, {args.flushes} flushes)")
+        print(histogram(samples))
+        print(f"  last snapshot {db.last_snapshot_ms:.1f} ms, last write {db.last_write_ms:.1f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
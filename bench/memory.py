@@ -0,0 +1,79 @@
+"""
+Resident memory per system.
+
+Loads the same synthetic fleet from JSON twice: once into copies of the
+model classes without ``__slots__`` through a plain ``cls(**obj)`` object
+hook, like DataclassJSONDecoder did before, and once through the compiled
+decoders into the slotted models with interned strings. Reports the
+memory still allocated (tracemalloc) per system after each load.
+"""
+import argparse
+import dataclasses
+import gc
+import json
+import tracemalloc
+
+from fleet import make_fleet
+
+from models import model_registry
+from util import dataclass_to_primitive, gc_paused, primitive_to_dataclass
+
+
+def unslotted_registry() -> dict[str, type]:
+    """Copies of the registered models as plain dataclasses with a ``__dict__``."""
+    registry = {}
+    for name, cls in model_registry.items():
+        fields = [
+            (f.name, f.type, dataclasses.field(default=f.default, default_factory=f.default_factory))
+            for f in dataclasses.fields(cls)
+        ]
+        registry[name] = dataclasses.make_dataclass(name, fields)
+    return registry
+
+
+def retained(load, data: str) -> tuple[float, object]:
+    """Bytes still allocated after *load*, keeping its result alive."""
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = load(data)
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return after - before, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--systems", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=5, help="events per system")
+    args = parser.parse_args()
+
+    data = json.dumps(dataclass_to_primitive(make_fleet(args.systems, events=args.events)))
+    registry = unslotted_registry()
+
+    def hook(obj: dict):
+        cls_name = obj.pop("__type__", None)
+        return registry[cls_name](**obj) if cls_name else obj
+
+    def load_before(data: str):
+        return json.loads(data, object_hook=hook)
+
+    def load_after(data: str):
+        with gc_paused():
+            return primitive_to_dataclass(json.loads(data))
+
+    print(f"{args.systems} systems with {args.events} events each\n")
+    results = {}
+    for name, load in (("before: __dict__, no interning", load_before), ("after: __slots__, interned", load_after)):
+        size, fleet = retained(load, data)
+        results[name] = size
+        print(f"  {name:<32} {size / 1024 / 1024:8.1f} MiB {size / args.systems:9.0f} bytes/system")
+        del fleet
+
+    before, after = results.values()
+    print(f"\n  {1 - after / before:.0%} less memory per system")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Encode/decode cost of the provider tree.
+
+Compares the reflective DataclassJSONEncoder/DataclassJSONDecoder classes
+with the per-class codecs compiled from model_registry
+(dataclass_to_primitive/primitive_to_dataclass), on top of every JSON
+backend that is installed. Times are the best of *--repeat* runs, peak
+memory is measured separately with tracemalloc. SystemDB also pauses the
+cyclic GC while it builds the trees, shown separately.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from fleet import make_fleet
+
+from util import DataclassJSONDecoder, DataclassJSONEncoder, dataclass_to_primitive, gc_paused, primitive_to_dataclass
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def backends() -> dict:
+    """name -> (dumps, loads) over plain lists/dicts."""
+    result = {"json": (lambda v: json.dumps(v, separators=(",", ":")), json.loads)}
+    if orjson is not None:
+        result["orjson"] = (orjson.dumps, orjson.loads)
+    if msgspec is not None:
+        result["msgspec"] = (msgspec.json.Encoder().encode, msgspec.json.Decoder().decode)
+    return result
+
+
+def measure(func, arg, repeat: int) -> tuple[float, float]:
+    """Best wall time in ms and peak traced allocation in MiB."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best * 1000, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--systems", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    fleet = make_fleet(args.systems)
+    reference = json.dumps(fleet, cls=DataclassJSONEncoder)
+
+    cases = [(
+        "classes + json",
+        lambda tree: json.dumps(tree, cls=DataclassJSONEncoder),
+        lambda data: json.loads(data, cls=DataclassJSONDecoder),
+    )]
+    for name, (dumps, loads) in backends().items():
+        cases.append((
+            f"compiled + {name}",
+            lambda tree, dumps=dumps: dumps(dataclass_to_primitive(tree)),
+            lambda data, loads=loads: primitive_to_dataclass(loads(data)),
+        ))
+
+        # how SystemDB calls them
+        def encode(tree, dumps=dumps):
+            with gc_paused():
+                primitive = dataclass_to_primitive(tree)
+            return dumps(primitive)
+
+        def decode(data, loads=loads):
+            with gc_paused():
+                return primitive_to_dataclass(loads(data))
+
+        cases.append(("  ... gc paused", encode, decode))
+
+    print(f"{args.systems} systems, {len(reference) / 1024 / 1024:.1f} MiB of JSON, best of {args.repeat}\n")
+    print(f"  {'':<22} {'encode ms':>10} {'peak MiB':>9} {'decode ms':>10} {'peak MiB':>9}")
+    for name, encode, decode in cases:
+        # every variant has to read back the same tree
+        assert decode(encode(fleet)) == fleet, name
+        encode_ms, encode_peak = measure(encode, fleet, args.repeat)
+        decode_ms, decode_peak = measure(decode, encode(fleet), args.repeat)
+        print(f"  {name:<22} {encode_ms:10.1f} {encode_peak:9.1f} {decode_ms:10.1f} {decode_peak:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
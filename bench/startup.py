@@ -0,0 +1,58 @@
+"""
+Startup cost of SystemDB with a large data file.
+
+Writes the same synthetic fleet as data.json and as data.bin and times
+SystemDB() on each: the time until the tree is loaded and the server could
+start serving, and for data.bin also the time until the deferred events of
+every system are decoded.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from fleet import make_fleet
+
+from db import SystemDB
+from snapshot import write_snapshot
+from util import dataclass_to_primitive
+
+
+async def materialize(db: SystemDB) -> float:
+    start = time.perf_counter()
+    db.start()
+    while db._lazy_events:
+        await asyncio.sleep(0)
+    elapsed = (time.perf_counter() - start) * 1000
+    await db.stop()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--systems", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=20, help="events per system")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    providers = dataclass_to_primitive(make_fleet(args.systems, events=args.events))
+
+    print(f"{args.systems} systems with {args.events} events each\n")
+    print(f"  {'format':<8} {'file MiB':>9} {'load ms':>9} {'events ms':>10}")
+    for format in ("json", "msgpack"):
+        db_path = "data.json" if format == "json" else "data.bin"
+        write_snapshot(db_path, format, 1, providers)
+
+        start = time.perf_counter()
+        db = SystemDB(data_path=db_path, snapshot_format=format)
+        load_ms = (time.perf_counter() - start) * 1000
+        events_ms = asyncio.run(materialize(db)) if format == "msgpack" else 0.0
+
+        size = os.path.getsize(db_path) / 1024 / 1024
+        print(f"  {format:<8} {size:9.1f} {load_ms:9.0f} {events_ms:10.0f}")
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
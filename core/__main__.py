@@ -1,10 +1,15 @@
 
 import asyncio
+import os
+import uuid
 import web
-from util import Config
+from atlas import atlas_current, build_atlas
+from snapshot import convert
+from util import SYSTEM_IMAGES, Config
 
 from hypercorn.asyncio import serve
 from hypercorn.config import Config as HyperConfig
+from hypercorn.run import run as run_workers
 
 import signal
 import sys
@@ -15,18 +20,48 @@ def handle_sigint(sig, frame):
 
 signal.signal(signal.SIGINT, handle_sigint)
 
-async def main():
-    cfg = Config.from_toml()
-
+async def main(cfg: Config):
     # Start dashboard (which sets up the Quart app)
     dashboard = web.Dashboard(cfg)
 
     # Run Quart using Hypercorn (production-ready)
     hyper_cfg = HyperConfig()
     hyper_cfg.bind = [f"{cfg.dashboard_host}:{cfg.dashboard_port}"]
-    hyper_cfg.workers = 1  # Set >1 if using multiprocessing
+    hyper_cfg.workers = 1
 
     await serve(dashboard.app, hyper_cfg)
 
+def main_workers(cfg: Config):
+    if cfg.cluster_backend != "redis":
+        raise ValueError("Running more than one worker needs cluster.backend = \"redis\".")
+
+    # build it once here instead of racing in every worker
+    if not atlas_current(SYSTEM_IMAGES):
+        build_atlas(SYSTEM_IMAGES)
+    # the spawned workers inherit it, so a session is valid on all of them
+    os.environ.setdefault("SYSMON_SECRET_KEY", uuid.uuid4().hex)
+
+    hyper_cfg = HyperConfig()
+    hyper_cfg.bind = [f"{cfg.dashboard_host}:{cfg.dashboard_port}"]
+    hyper_cfg.workers = cfg.cluster_workers
+    # every worker process builds its own Dashboard through this factory
+    hyper_cfg.application_path = f"{os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web.py')}:create_app()"
+
+    return run_workers(hyper_cfg)
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    if sys.argv[1:] == ["build-atlas"]:
+        index = build_atlas(SYSTEM_IMAGES)
+        print(f"Built icon atlas with {len(index['tiles'])} tiles ({index['width']}x{index['height']} px)")
+        sys.exit(0)
+
+    if sys.argv[1:2] == ["convert-data"] and len(sys.argv) == 4:
+        format = convert(sys.argv[2], sys.argv[3])
+        print(f"Converted {sys.argv[2]} to {sys.argv[3]} ({format})")
+        sys.exit(0)
+
+    cfg = Config.from_toml()
+    if cfg.cluster_workers > 1:
+        sys.exit(main_workers(cfg))
+
+    asyncio.run(main(cfg))
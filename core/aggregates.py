@@ -0,0 +1,122 @@
+import numpy as np
+
+from models import Provider, System
+
+
+class FleetAggregates:
+    """
+    Columnar snapshot of the current usage of every system: one NumPy array
+    per metric, indexed by a row per system, plus integer codes for the
+    provider, site and group each row belongs to.
+
+    Usage is updated in place per sample; the row layout is only rebuilt
+    when the provider tree changes structurally.
+    """
+
+    METRICS = ("cpu", "memory")
+    GROUPINGS = ("provider", "site", "group")
+
+    def __init__(self):
+        self.structure_version = -1
+        self._rows: dict[str, int] = {}
+        self._ids: list[str] = []
+        self._names: list[str] = []
+        self._labels: dict[str, list[str]] = {g: [] for g in self.GROUPINGS}
+        self._codes: dict[str, np.ndarray] = {g: np.zeros(0, dtype=np.int32) for g in self.GROUPINGS}
+        self._values: dict[str, np.ndarray] = {m: np.zeros(0) for m in self.METRICS}
+        self._valid = np.zeros(0, dtype=bool)
+
+    def rebuild(self, providers: list[Provider], structure_version: int):
+        systems: list[System] = []
+        labels = {g: {} for g in self.GROUPINGS}
+        codes = {g: [] for g in self.GROUPINGS}
+
+        for provider in providers:
+            for site in provider.sites:
+                for system in site.systems:
+                    systems.append(system)
+                    for grouping, label in (
+                        ("provider", provider.name),
+                        ("site", site.name),
+                        ("group", f"{site.name}/{system.group or 'ungrouped'}"),
+                    ):
+                        codes[grouping].append(labels[grouping].setdefault(label, len(labels[grouping])))
+
+        n = len(systems)
+        self._rows = {system.id: row for row, system in enumerate(systems)}
+        self._ids = [system.id for system in systems]
+        self._names = [system.name for system in systems]
+        self._labels = {g: list(labels[g]) for g in self.GROUPINGS}
+        self._codes = {g: np.array(codes[g], dtype=np.int32) for g in self.GROUPINGS}
+        self._values = {m: np.zeros(n) for m in self.METRICS}
+        self._valid = np.zeros(n, dtype=bool)
+        for system in systems:
+            if system.last_seen:
+                self.update(system)
+
+        self.structure_version = structure_version
+
+    def update(self, system: System):
+        """O(1) refresh of a single system's row."""
+        row = self._rows.get(system.id)
+        if row is None:
+            return  # not laid out yet, picked up by the next rebuild
+
+        self._values["cpu"][row] = system.cpu.usage_pct
+        if system.memory.total_gib:
+            self._values["memory"][row] = system.memory.used_gib / system.memory.total_gib * 100
+        self._valid[row] = True
+
+    def compute(self, metric: str, by: str, percentiles: list[float], top: int) -> dict:
+        """Per-group count/mean/max/percentiles and the fleet-wide top-k, all vectorized."""
+        if metric not in self.METRICS:
+            raise ValueError(f"Unknown metric {metric}.")
+        if by not in self.GROUPINGS:
+            raise ValueError(f"Unknown grouping {by}.")
+        # out of range, the positions below would run into the neighbouring groups
+        if not all(0 <= p <= 100 for p in percentiles):
+            raise ValueError("Percentiles must be between 0 and 100.")
+
+        values = self._values[metric][self._valid]
+        codes = self._codes[by][self._valid]
+        labels = self._labels[by]
+
+        # sort by group, then value, so each group is a sorted contiguous run
+        order = np.lexsort((values, codes))
+        sorted_values = values[order]
+        counts = np.bincount(codes, minlength=len(labels))
+        starts = np.cumsum(counts) - counts
+        present = counts > 0
+        safe_counts = np.maximum(counts, 1)
+
+        # empty groups are dropped below, their indexes only need to be in range
+        last = max(len(values) - 1, 0)
+        padded = sorted_values if len(values) else np.zeros(1)
+
+        stats = {
+            "count": counts,
+            "mean": np.bincount(codes, weights=values, minlength=len(labels)) / safe_counts,
+            "max": padded[np.clip(starts + counts - 1, 0, last)],
+        }
+        for p in percentiles:
+            # linear interpolation between the two closest ranks, like np.percentile
+            position = starts + (p / 100) * (safe_counts - 1)
+            lo = np.clip(np.floor(position).astype(np.int64), 0, last)
+            hi = np.clip(np.ceil(position).astype(np.int64), 0, last)
+            stats[f"p{p:g}"] = padded[lo] + (padded[hi] - padded[lo]) * (position - lo)
+
+        groups = [
+            {"name": labels[code], **{key: column[code].item() for key, column in stats.items()}}
+            for code in np.flatnonzero(present)
+        ]
+
+        rows = np.flatnonzero(self._valid)
+        top = min(top, len(values))
+        busiest = []
+        if top > 0:
+            candidates = np.argpartition(-values, top - 1)[:top]
+            for i in candidates[np.argsort(-values[candidates])]:
+                row = rows[i]
+                busiest.append({"id": self._ids[row], "name": self._names[row], "value": values[i].item()})
+
+        return {"metric": metric, "by": by, "groups": groups, "top": busiest}
@@ -0,0 +1,198 @@
+from dataclasses import dataclass
+import dataclasses
+from typing import Callable
+
+from models import EventLevel, EventType, System
+
+
+def _cpu(system: System) -> float:
+    return system.cpu.usage_pct
+
+
+def _memory(system: System) -> float:
+    total = system.memory.total_gib
+    return system.memory.used_gib / total * 100 if total else 0.0
+
+
+def _disk(system: System) -> float:
+    # the fullest disk
+    highest = 0.0
+    for disk in system.disks:
+        if disk.total_gib and disk.used_gib / disk.total_gib * 100 > highest:
+            highest = disk.used_gib / disk.total_gib * 100
+    return highest
+
+
+def _services(system: System) -> float:
+    stopped = 0
+    for service in system.services:
+        if not service.running:
+            stopped += 1
+    return stopped
+
+
+# metric name: (value of a system, event type, default description)
+METRICS: dict[str, tuple[Callable[[System], float], str, str]] = {
+    "cpu": (_cpu, EventType.CPU, "CPU usage is at {value:.0f}%."),
+    "memory": (_memory, EventType.MEMORY, "Memory usage is at {value:.0f}%."),
+    "disk": (_disk, EventType.MISC, "A disk is {value:.0f}% full."),
+    "services": (_services, EventType.SERVICE, "{value:.0f} watched service(s) not running."),
+}
+LEVELS = (EventLevel.INFO, EventLevel.WARNING, EventLevel.CRITICAL)
+
+
+@dataclass(slots=True)
+class AlertRule:
+    """
+    Raise an event of *level* once *metric* stays above *above* for
+    *sustained* seconds, and again with every sample above it (another
+    occurrence of the same event). The rule stays active until the value
+    falls to *clear_below* (defaults to *above*) or lower, only then does
+    it wait *sustained* seconds again. Empty *groups*/*sites* apply the
+    rule to every system.
+    """
+    metric: str
+    level: str
+    above: float
+    clear_below: float | None = None
+    sustained: float = 0
+    groups: list[str] = dataclasses.field(default_factory=list)
+    sites: list[str] = dataclasses.field(default_factory=list)
+    description: str = ""
+
+    @staticmethod
+    def from_dict(data: dict) -> 'AlertRule':
+        rule = AlertRule(**data)
+        if rule.metric not in METRICS:
+            raise ValueError(f"Unknown alert metric {rule.metric}, expected one of {', '.join(METRICS)}.")
+        if rule.level not in LEVELS:
+            raise ValueError(f"Unknown alert level {rule.level}, expected one of {', '.join(LEVELS)}.")
+        if rule.clear_below is None:
+            rule.clear_below = rule.above
+        if rule.clear_below > rule.above:
+            raise ValueError(f"clear_below of an alert rule on {rule.metric} must not exceed above.")
+        if not rule.description:
+            rule.description = METRICS[rule.metric][2]
+        return rule
+
+    def applies_to(self, group: str, site: str) -> bool:
+        return (not self.groups or group in self.groups) and (not self.sites or site in self.sites)
+
+
+# what the thresholds in _handle_ws_message used to be
+DEFAULT_RULES = [
+    {"metric": "cpu", "level": EventLevel.CRITICAL, "above": 90},
+    {"metric": "cpu", "level": EventLevel.WARNING, "above": 75},
+    {"metric": "memory", "level": EventLevel.CRITICAL, "above": 90},
+    {"metric": "memory", "level": EventLevel.WARNING, "above": 75},
+    {"metric": "services", "level": EventLevel.WARNING, "above": 0},
+]
+
+# a compiled check: (system, per-system state, rule slot, now) -> value if it fires, else None
+Check = Callable[[System, list[float], int, float], float | None]
+
+
+def compile_rule(rule: AlertRule) -> Check:
+    """
+    Turn *rule* into a closure over its constants. State per system and
+    rule is two floats in a preallocated list: since when the value has
+    been above the threshold (-1 if it isn't) and whether the rule is
+    active. The check doesn't activate the rule, AlertEngine does for the
+    rules it emits, so a rule suppressed by a higher level of the same
+    metric still fires once that one clears.
+    """
+    get = METRICS[rule.metric][0]
+    above = rule.above
+    clear_below = rule.clear_below
+    sustained = rule.sustained
+
+    def check(system: System, state: list[float], slot: int, now: float) -> float | None:
+        value = get(system)
+        if value > above:
+            if state[slot] < 0:
+                state[slot] = now
+            if state[slot + 1] or now - state[slot] >= sustained:
+                return value
+        elif state[slot + 1]:
+            if value <= clear_below:
+                state[slot] = -1.0
+                state[slot + 1] = 0.0
+        elif state[slot] >= 0:
+            state[slot] = -1.0
+        return None
+
+    return check
+
+
+class AlertEngine:
+    """
+    Evaluates the alert rules against each usage sample of a system.
+
+    Rules are compiled once; the rules that apply to a system (by group and
+    site) are selected on its first sample and again only when its group
+    or site changes. A sample that fires nothing allocates no events or
+    containers.
+    """
+
+    def __init__(self, rules: list[dict] | None = None):
+        self.rules = [AlertRule.from_dict(data) for data in (DEFAULT_RULES if rules is None else rules)]
+        self._checks = [compile_rule(rule) for rule in self.rules]
+        # system ID: (group, site, rule indexes, state)
+        self._systems: dict[str, tuple[str, str, tuple[int, ...], list[float]]] = {}
+
+        self.evaluated = 0
+        self.fired = 0
+
+    def _bind(self, system: System, site: str) -> tuple[str, str, tuple[int, ...], list[float]]:
+        indexes = tuple(i for i, rule in enumerate(self.rules) if rule.applies_to(system.group, site))
+        bound = (system.group, site, indexes, [-1.0, 0.0] * len(indexes))
+        self._systems[system.id] = bound
+        return bound
+
+    def evaluate(self, system: System, site: str, now: float) -> list[tuple[AlertRule, float]] | None:
+        """The rules that fired with their values, None if none did."""
+        bound = self._systems.get(system.id)
+        if bound is None or bound[0] != system.group or bound[1] != site:
+            bound = self._bind(system, site)
+
+        self.evaluated += 1
+        fired = None
+        state = bound[3]
+        checks = self._checks
+        slot = 0
+        for i in bound[2]:
+            value = checks[i](system, state, slot, now)
+            if value is not None:
+                if fired is None:
+                    fired = []
+                fired.append((self.rules[i], value, slot))
+            slot += 2
+        if not fired:
+            return None
+
+        if len(fired) > 1:
+            # a metric above several thresholds at once raises the highest level only
+            highest = {}
+            for entry in fired:
+                rule = entry[0]
+                if rule.metric not in highest or LEVELS.index(rule.level) > LEVELS.index(highest[rule.metric][0].level):
+                    highest[rule.metric] = entry
+            fired = list(highest.values())
+        for _, _, slot in fired:
+            state[slot + 1] = 1.0
+        self.fired += len(fired)
+        return [(rule, value) for rule, value, _ in fired]
+
+    def forget(self, system_id: str):
+        self._systems.pop(system_id, None)
+
+    def tracked(self) -> list[str]:
+        return list(self._systems)
+
+    def stats(self) -> dict:
+        return {
+            "rules": len(self.rules),
+            "systems": len(self._systems),
+            "evaluated": self.evaluated,
+            "fired": self.fired,
+        }
@@ -0,0 +1,108 @@
+import hashlib
+from io import BytesIO
+import json
+from pathlib import Path
+
+from PIL import Image
+
+from util import SystemImageRegistry, atomic_write
+
+
+ATLAS_SIZES = (64, 128, 256)
+ATLAS_COLUMNS = 16
+ATLAS_DIR = Path(__file__).parent / "static" / "atlas"
+
+
+def atlas_key(base_name: str, variation: str, depth: int, size: int) -> str:
+    return f"{base_name}/{variation}/{depth}@{size}"
+
+
+def source_hash(registry: SystemImageRegistry, sizes: tuple[int, ...], format: str) -> str:
+    """Hash of everything the atlas is rendered from: the layer files, stacking parameters and output options."""
+    digest = hashlib.sha256(json.dumps([sorted(sizes), format, ATLAS_COLUMNS]).encode())
+    for image in sorted(registry.images(), key=lambda i: i.base_name):
+        digest.update(json.dumps([image.base_name, image.max_stack, image.stack_shift_x, image.stack_shift_y, image.stackable]).encode())
+        for path in sorted(Path(image.base_folder).glob(f"{image.base_name}_*.png")):
+            digest.update(path.name.encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def build_atlas(
+    registry: SystemImageRegistry,
+    out_dir: str | Path = ATLAS_DIR,
+    sizes: tuple[int, ...] = ATLAS_SIZES,
+    format: str = "webp",
+) -> dict:
+    """
+    Render every base name x variation x stack depth at every size into one
+    sprite sheet, with a JSON index of tile offsets next to it.
+
+    Tiles are ``size`` x ``size`` cells (icons centred in them), grouped in
+    bands of ``ATLAS_COLUMNS`` per row, one band per size, largest first.
+    """
+    pil_format, _ = registry.FORMATS[format]
+    combinations = [
+        (image, variation, depth)
+        for image in registry.images()
+        for variation in image.variations()
+        for depth in image.stack_depths()
+    ]
+
+    rows_per_size = -(-len(combinations) // ATLAS_COLUMNS)
+    sizes = tuple(sorted(sizes, reverse=True))
+    width = ATLAS_COLUMNS * sizes[0]
+    height = sum(rows_per_size * size for size in sizes)
+    sheet = Image.new("RGBA", (width, max(height, 1)), (0, 0, 0, 0))
+
+    band_offsets = {}
+    band_y = 0
+    for size in sizes:
+        band_offsets[size] = band_y
+        band_y += rows_per_size * size
+
+    tiles = {}
+    for i, (image, variation, depth) in enumerate(combinations):
+        # compose once at full resolution, then scale down for every size
+        full = image.compose([variation] * depth)
+        for size in sizes:
+            icon = full.copy()
+            icon.thumbnail((size, size), Image.LANCZOS)
+            x = (i % ATLAS_COLUMNS) * size
+            y = band_offsets[size] + (i // ATLAS_COLUMNS) * size
+            sheet.paste(icon, (x + (size - icon.width) // 2, y + (size - icon.height) // 2), icon)
+            tiles[atlas_key(image.base_name, variation, depth, size)] = {"x": x, "y": y, "w": size, "h": size}
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    image_name = f"icons.{format}"
+    save_args = {"lossless": True} if format == "webp" else {}
+    buf = BytesIO()
+    sheet.save(buf, format=pil_format, **save_args)
+    # the sheet first, so the index never points at a partly written one
+    atomic_write(str(out / image_name), buf.getvalue())
+
+    index = {
+        "image": image_name,
+        "width": width,
+        "height": height,
+        "sizes": list(sizes),
+        "source": source_hash(registry, sizes, format),
+        "tiles": tiles,
+    }
+    atomic_write(str(out / "icons.json"), json.dumps(index))
+    return index
+
+
+def atlas_current(
+    registry: SystemImageRegistry,
+    out_dir: str | Path = ATLAS_DIR,
+    sizes: tuple[int, ...] = ATLAS_SIZES,
+    format: str = "webp",
+) -> bool:
+    """Whether the atlas in *out_dir* was built from the current icon layers and options."""
+    try:
+        index = json.loads((Path(out_dir) / "icons.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    return index.get("source") == source_hash(registry, sizes, format) and (Path(out_dir) / index["image"]).exists()
@@ -1,21 +1,120 @@
+import asyncio
+import atexit
+import dataclasses
+import itertools
 import os
 import json
-from models import Event, EventLevel, EventType, Provider, Site, System
-from util import DataclassJSONDecoder, DataclassJSONEncoder
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from events import EventStore
+from instrument import INSTRUMENTS
+from log import get_logger
+from models import Event, Provider, Site, System
+from snapshot import EXTENSIONS, FORMATS, decode_events, read_snapshot, require_format, write_snapshot
+from util import atomic_write, dataclass_to_primitive, gc_paused, json_dumps, json_loads, primitive_to_dataclass
+
+logger = get_logger("db")
 
 
 class SystemDB:
-    def __init__(self, structure_path: str = "structure.json", data_path: str = "data.json"):
+    EVENT_SWEEP_INTERVAL = 60  # seconds between age-based event retention sweeps
+
+    def __init__(
+        self,
+        structure_path: str = "structure.json",
+        data_path: str | None = None,
+        journal_path: str = "data.journal",
+        flush_interval: float = 0,
+        journal_max_bytes: int = 4 * 1024 * 1024,
+        compact_interval: float = 300,
+        event_archive_path: str = "events.archive.jsonl",
+        event_max_count: int = 200,
+        event_max_age: float = 30 * 24 * 3600,
+        snapshot_format: str = "json",
+    ):
+        require_format(snapshot_format)
+        self.snapshot_format = snapshot_format
         self.structure_path = structure_path
-        self.data_path = data_path
+        self.data_path = data_path or f"data{EXTENSIONS[snapshot_format]}"
+        self.journal_path = journal_path
+        self.event_archive_path = event_archive_path
         self.providers: list[Provider] = []
 
+        # lookup indexes over the provider tree, kept in sync by the mutators
+        self._systems: dict[str, System] = {}
+        self._system_sites: dict[str, Site] = {}
+        self._sites: dict[str, Site] = {}
+        self._providers: dict[str, Provider] = {}
+
+        # active event index and retention, cleared events end up in the archive
+        self.events = EventStore(max_count=event_max_count, max_age=event_max_age)
+        self.archived_events = 0
+        # raw event frames of a binary snapshot, decoded on first use or
+        # in the background after start(), so that loading stays fast
+        self._lazy_events: dict[str, bytes] = {}
+        self._materializer: asyncio.Task | None = None
+        # plain copies for snapshots: per system until it changes, the rest
+        # of the tree until the next structural change
+        self._primitives: dict[str, tuple[System, dict]] = {}
+        self._skeleton: list[tuple[dict, list[tuple[dict, list[System]]]]] = []
+        self._structure: dict = {}
+        self._skeleton_version = -1
+        self.load_ms = 0.0
+        self._sweeper: asyncio.Task | None = None
+
+        # write-behind: with flush_interval > 0 mutations only mark the db
+        # dirty and a background task writes everything out once per interval
+        self.flush_interval = flush_interval
+        self.dirty = False
+        self.flush_count = 0
+        self.coalesced_writes = 0
+        self._flusher: asyncio.Task | None = None
+
+        # a single writer thread keeps writes ordered and off the event loop
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self.last_snapshot_ms = 0.0
+        self.last_write_ms = 0.0
+
+        # mutations are appended to the journal and compacted into a full
+        # data.json snapshot once it grows too large or too old
+        self.journal_max_bytes = journal_max_bytes
+        self.compact_interval = compact_interval
+        self.generation = 0
+        # bumped on every structural change, for views that cache the layout
+        self.structure_version = 0
+
+        # revision of the whole tree and of every system's last change. It
+        # starts from the clock so revisions keep increasing across restarts.
+        self.revision = time.time_ns() // 1_000_000
+        self.structure_revision = self.revision
+        # revisions are only comparable within one epoch, i.e. one process
+        self.epoch = uuid.uuid4().hex[:12]
+        self._stamps: dict[str, int] = {}  # ordered oldest -> newest change
+        # called with the ID of every changed system, None for structural changes
+        self.listeners: list[Callable[[str | None], None]] = []
+
+        # with several workers only the primary writes to disk, and every
+        # journal line is handed to *replicate* for the other workers
+        self.persist = True
+        self.replicate: Callable[[str], None] | None = None
+        self._applying_remote = False
+
+        self.compaction_count = 0
+        self._pending: list[str] = []
+        self._batch_depth = 0
+        self._journal_bytes = 0
+        self._compact_requested = False
+        self._last_compaction = time.monotonic()
+
         self.load_from_file()
 
     def create_structure(self):
         self.providers = []
         if not os.path.exists(self.structure_path):
-            print(f"Structure file {self.structure_path} does not exist.")
+            logger.warning("Structure file %s does not exist.", self.structure_path)
         else:
             with open(self.structure_path, 'r') as f:
                 structure = json.load(f)
@@ -45,7 +144,7 @@ class SystemDB:
             with open("template_hash.txt", 'w') as f:
                 f.write(str(file_hash))
 
-    def generate_structure_file(self):
+    def _structure_snapshot(self) -> dict:
         structure = {
             "providers": []
         }
@@ -78,40 +177,493 @@ class SystemDB:
 
             structure["providers"].append(provider_data)
 
-        with open(self.structure_path, "w", encoding="utf-8") as f:
-            import json
-            json.dump(structure, f, indent=4, ensure_ascii=False)
+        return structure
 
+    def generate_structure_file(self):
+        atomic_write(self.structure_path, json.dumps(self._structure_snapshot(), indent=4, ensure_ascii=False))
+
+
+    def _find_snapshot(self) -> str | None:
+        """The configured data file, or one in the other format to migrate from."""
+        if os.path.exists(self.data_path):
+            return self.data_path
+        stem = os.path.splitext(self.data_path)[0]
+        for format in FORMATS:
+            path = stem + EXTENSIONS[format]
+            if format != self.snapshot_format and os.path.exists(path):
+                logger.info("Loading %s, it is rewritten as %s by the next compaction.", path, self.data_path)
+                return path
+        return None
 
     def load_from_file(self):
-        if not os.path.exists(self.data_path):
+        start = time.perf_counter()
+        journal_valid = False
+        path = self._find_snapshot()
+        if path is None:
             self.create_structure()
+            self._reindex()
+        else:
+            self.generation, self.providers = read_snapshot(path, self._lazy_events)
+            self._reindex()
+            journal_valid = self._replay_journal() and path == self.data_path
+
+        # a missing, stale or torn journal is replaced by the next compaction
+        self._compact_requested = not journal_valid
+        self.load_ms = (time.perf_counter() - start) * 1000
+        logger.info(
+            "Loaded %d systems in %.0f ms", len(self._systems), self.load_ms,
+            extra={"deferred_events": len(self._lazy_events)},
+        )
+
+    def ensure_events(self, system: System):
+        """Decode the events of *system* if loading the snapshot deferred them."""
+        frame = self._lazy_events.pop(system.id, None)
+        if frame is not None:
+            system.events = decode_events(frame) + system.events
+            self.events.index(system)
+            self._primitives.pop(system.id, None)
+
+    def ensure_all_events(self):
+        for system_id in list(self._lazy_events):
+            system = self.get_system(system_id)
+            if system:
+                self.ensure_events(system)
+        self._lazy_events.clear()
+
+    async def _materialize_loop(self, chunk: int = 200):
+        start = time.perf_counter()
+        while self._lazy_events:
+            with gc_paused():
+                for system_id in list(itertools.islice(self._lazy_events, chunk)):
+                    system = self.get_system(system_id)
+                    if system:
+                        self.ensure_events(system)
+                    else:
+                        self._lazy_events.pop(system_id, None)
+            await asyncio.sleep(0)
+        logger.info("Loaded deferred events in %.0f ms", (time.perf_counter() - start) * 1000)
+
+    def _replay_journal(self) -> bool:
+        """
+        Apply the journal on top of the loaded snapshot. Returns False if
+        the journal can't simply be appended to any more.
+        """
+        if not os.path.exists(self.journal_path):
+            return False
+
+        with open(self.journal_path, 'r', encoding="utf-8") as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                return False
+            if header.get("op") != "generation" or header.get("gen") != self.generation:
+                # written before the snapshot we loaded, already part of it
+                return False
+
+            self._journal_bytes = 0
+            for number, line in enumerate(f, start=2):
+                try:
+                    record = primitive_to_dataclass(json_loads(line))
+                except ValueError:
+                    logger.warning("Journal %s ends in a torn record, ignoring the rest.", self.journal_path)
+                    return False
+                try:
+                    self._apply(record)
+                except Exception as e:
+                    # valid JSON, but not a record this version can apply
+                    logger.error("Journal %s has a bad record on line %d (%r), ignoring the rest.", self.journal_path, number, e)
+                    return False
+                self._journal_bytes += len(line)
+
+        return True
+
+    def _apply(self, record: dict):
+        system = self.get_system(record["id"])
+        if not system:
             return
 
-        with open(self.data_path, 'r') as f:
-            self.providers = json.load(f, cls=DataclassJSONDecoder)
+        op = record["op"]
+        if op in ("event", "clear", "prune"):
+            self.ensure_events(system)
+        if op == "set":
+            for key, value in record["fields"].items():
+                setattr(system, key, value)
+        elif op == "usage":
+            self._apply_usage(system, record["cpu"], record["mem"], record["disks"])
+        elif op == "event":
+            self.events.store(system, record["event"])
+            self.events.update_level(system)
+        elif op == "clear":
+            self.events.clear(system, record["event"])
+            self.events.update_level(system)
+        elif op == "prune":
+            self.events.remove(system, record["events"])
+        else:
+            raise ValueError(f"Unknown journal op {op!r}.")
 
 
-    def save_to_file(self):
-        sorted_providers = sorted(self.providers, key=lambda p: p.name.lower())
-        for provider in sorted_providers:
-            provider.sites = sorted(provider.sites, key=lambda s: s.name.lower())
+    def _build_skeleton(self):
+        """Sort the tree and copy everything but the systems, after structural changes."""
+        self.providers.sort(key=lambda p: p.name.lower())
+        for provider in self.providers:
+            provider.sites.sort(key=lambda s: s.name.lower())
             for site in provider.sites:
-                site.systems = sorted(site.systems, key=lambda sys: sys.name.lower())
+                site.systems.sort(key=lambda sys: sys.name.lower())
+
+        self._skeleton = [
+            (
+                dataclass_to_primitive(dataclasses.replace(provider, sites=[])),
+                [(dataclass_to_primitive(dataclasses.replace(site, systems=[])), site.systems) for site in provider.sites],
+            )
+            for provider in self.providers
+        ]
+        self._structure = self._structure_snapshot()
+        self._skeleton_version = self.structure_version
+
+    def _system_primitive(self, system: System) -> dict:
+        cached = self._primitives.get(system.id)
+        # the identity check covers systems that share an ID in the tree
+        if cached is None or cached[0] is not system:
+            cached = self._primitives[system.id] = (system, dataclass_to_primitive(system))
+        return cached[1]
+
+    def snapshot(self) -> tuple[list, dict, dict[str, bytes]]:
+        """
+        Copy the tree into plain lists/dicts for the writer thread, which
+        serializes it while the live dataclasses keep changing on the event
+        loop. Only systems changed since the last snapshot are converted,
+        the rest are shared, never mutated, copies. Events still deferred
+        by a binary snapshot are handed over as raw frames and decoded on
+        the writer thread.
+        """
+        if self._skeleton_version != self.structure_version:
+            self._build_skeleton()
+
+        with gc_paused():
+            providers = [
+                {**provider, "sites": [
+                    {**site, "systems": [self._system_primitive(system) for system in systems]}
+                    for site, systems in sites
+                ]}
+                for provider, sites in self._skeleton
+            ]
+        return providers, self._structure, dict(self._lazy_events)
+
+    def _take_snapshot(self) -> tuple[int, list, dict, dict[str, bytes]]:
+        start = time.perf_counter()
+        providers, structure, deferred_events = self.snapshot()
+        # everything journaled so far is part of this snapshot
+        self.generation += 1
+        self._pending = []
+        self._journal_bytes = 0
+        self._compact_requested = False
+        self._last_compaction = time.monotonic()
+        self.dirty = False
+        self.last_snapshot_ms = (time.perf_counter() - start) * 1000
+        return self.generation, providers, structure, deferred_events
+
+    def _write_snapshot(self, snapshot: tuple[int, list, dict, dict[str, bytes]]):
+        """
+        Compaction: write a full snapshot, then start a fresh journal for
+        its generation. A crash in between leaves a journal of the previous
+        generation, which load_from_file ignores.
+        """
+        start = time.perf_counter()
+        generation, providers, structure, deferred_events = snapshot
+        write_snapshot(self.data_path, self.snapshot_format, generation, providers, deferred_events)
+        atomic_write(self.journal_path, json.dumps({"op": "generation", "gen": generation}) + "\n")
+        atomic_write(self.structure_path, json.dumps(structure, indent=4, ensure_ascii=False))
+        self.last_write_ms = (time.perf_counter() - start) * 1000
+        INSTRUMENTS.observe("persistence_write_seconds", self.last_write_ms / 1000, ("kind", "snapshot"))
+        self.compaction_count += 1
+        self.flush_count += 1
+
+    def _append_journal(self, lines: list[str]):
+        start = time.perf_counter()
+        with open(self.journal_path, 'a', encoding="utf-8") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        self.last_write_ms = (time.perf_counter() - start) * 1000
+        INSTRUMENTS.observe("persistence_write_seconds", self.last_write_ms / 1000, ("kind", "journal"))
+        self.flush_count += 1
+
+    def save_to_file(self):
+        """Snapshot and write the database synchronously in the calling thread."""
+        self._write_snapshot(self._take_snapshot())
+
+    def _needs_compaction(self) -> bool:
+        if self._compact_requested:
+            return True
+        if self._journal_bytes == 0:
+            return False
+        return (
+            self._journal_bytes >= self.journal_max_bytes
+            or (self.compact_interval > 0 and time.monotonic() - self._last_compaction >= self.compact_interval)
+        )
+
+    def _prepare_write(self) -> tuple:
+        """Returns the writer call for everything pending, taken on the caller's thread."""
+        if self._needs_compaction():
+            return self._write_snapshot, self._take_snapshot()
+        lines, self._pending = self._pending, []
+        self.dirty = False
+        return self._append_journal, lines
+
+    def _submit(self) -> Future:
+        return self._writer.submit(*self._prepare_write())
+
+    @staticmethod
+    def _report_write_error(future: Future):
+        if future.exception():
+            logger.error("Error writing database: %s", future.exception())
+
+    def journal(self, record: dict):
+        """Persist a single mutation as a compact journal record."""
+        line = json_dumps(dataclass_to_primitive(record)) + "\n"
+        INSTRUMENTS.observe("json_encode_bytes", len(line), ("kind", "journal"))
+        if self.persist:
+            self._pending.append(line)
+            self._journal_bytes += len(line)
+        if self.replicate:
+            self.replicate(line)
+        self._touch(record["id"])
+        self.mark_dirty()
+
+    def apply_remote(self, line: str) -> dict | None:
+        """
+        Apply a journal line replicated from another worker, without
+        replicating it again. Returns the decoded record, None if it was
+        for an unknown system.
+        """
+        record = primitive_to_dataclass(json_loads(line))
+        self._applying_remote = True
+        try:
+            if record["op"] == "structure":
+                self._lazy_events.clear()
+                self.providers = record["providers"]
+                self._reindex()
+                self.mark_dirty(compact=True)
+                return record
+
+            if not self.get_system(record["id"]):
+                return None
+            self._apply(record)
+            if self.persist:
+                self._pending.append(line)
+                self._journal_bytes += len(line)
+                if record["op"] in ("event", "clear"):
+                    # count-based retention for events changed on other workers
+                    self._expire_events(self.get_system(record["id"]))
+            self._touch(record["id"])
+            self.mark_dirty()
+            return record
+        finally:
+            self._applying_remote = False
+
+    def state_record(self) -> str:
+        """The whole tree as a structure record, which replaces the tree of a replica that applies it."""
+        self.ensure_all_events()
+        return json_dumps({"op": "structure", "providers": dataclass_to_primitive(self.providers)}) + "\n"
+
+    def set_persist(self, persist: bool):
+        """Start or stop writing to disk, e.g. when this worker becomes or stops being the primary."""
+        if persist == self.persist:
+            return
+        self.persist = persist
+        if persist:
+            # whatever the previous primary wrote may lag behind this replica
+            self._compact_requested = True
+            self.mark_dirty()
+        else:
+            self._pending = []
+            self.dirty = False
+
+    def _touch(self, system_id: str):
+        self._primitives.pop(system_id, None)
+        self.revision += 1
+        # re-insert so that _stamps stays ordered by revision
+        self._stamps.pop(system_id, None)
+        self._stamps[system_id] = self.revision
+        for listener in self.listeners:
+            listener(system_id)
+
+    def stamp(self, system_id: str) -> int:
+        """Revision of the last change to a system."""
+        return self._stamps.get(system_id, self.structure_revision)
+
+    def changed_since(self, revision: int) -> list[System] | None:
+        """
+        Systems changed after *revision*, newest last, in O(changed). Returns
+        None if the tree changed structurally since then and the caller
+        needs everything.
+        """
+        if revision < self.structure_revision:
+            return None
+
+        changed = []
+        for system_id, stamp in reversed(self._stamps.items()):
+            if stamp <= revision:
+                break
+            system = self.get_system(system_id)
+            if system:
+                changed.append(system)
+        changed.reverse()
+        return changed
+
+    def mark_dirty(self, compact: bool = False):
+        """
+        Schedule a write. Structural changes (*compact*) aren't journaled and
+        need a full snapshot instead.
+        """
+        if compact:
+            self._compact_requested = True
+            self.structure_version += 1
+            self.revision += 1
+            self.structure_revision = self.revision
+            for listener in self.listeners:
+                listener(None)
+            if self.replicate and not self._applying_remote:
+                self.replicate(self.state_record())
+
+        if not self.persist:
+            return
 
-        with open(self.data_path, 'w') as f:
-            json.dump(sorted_providers, f, cls=DataclassJSONEncoder)
+        if self.flush_interval <= 0 and not self._batch_depth:
+            self._submit().add_done_callback(self._report_write_error)
+            return
 
-        self.generate_structure_file()
+        if self.dirty:
+            self.coalesced_writes += 1
+        self.dirty = True
+
+    @contextmanager
+    def batch(self):
+        """Group mutations so that they are committed by a single write."""
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self.persist and self.flush_interval <= 0 and (self.dirty or self._needs_compaction()):
+                self._submit().add_done_callback(self._report_write_error)
+
+    def flush(self):
+        if self.persist and (self.dirty or self._needs_compaction()):
+            writer, arg = self._prepare_write()
+            writer(arg)
+
+    async def flush_async(self):
+        if self.persist and (self.dirty or self._needs_compaction()):
+            await asyncio.wrap_future(self._submit())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_async()
+            except Exception as e:
+                logger.error("Error flushing database: %s", e)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.EVENT_SWEEP_INTERVAL)
+            try:
+                self.expire_events()
+            except Exception as e:
+                logger.error("Error expiring events: %s", e)
+
+    def start(self):
+        if self._lazy_events and self._materializer is None:
+            self._materializer = asyncio.get_running_loop().create_task(self._materialize_loop())
+        if self._sweeper is None:
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+        if self.flush_interval > 0 and self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+            # the SIGINT handler exits without running after_serving hooks
+            atexit.register(self.flush)
+
+    async def stop(self):
+        if self._materializer is not None:
+            self._materializer.cancel()
+            self._materializer = None
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush_async()
+
+    def stats(self) -> dict:
+        return {
+            "snapshot_format": self.snapshot_format,
+            "load_ms": self.load_ms,
+            "deferred_events": len(self._lazy_events),
+            "write_behind": self.flush_interval > 0,
+            "flush_interval": self.flush_interval,
+            "dirty": self.dirty,
+            "flushes": self.flush_count,
+            "coalesced_writes": self.coalesced_writes,
+            "compactions": self.compaction_count,
+            "generation": self.generation,
+            "journal_bytes": self._journal_bytes,
+            "archived_events": self.archived_events,
+            "last_snapshot_ms": self.last_snapshot_ms,
+            "last_write_ms": self.last_write_ms,
+        }
 
 
-    def get_system(self, system_id: str) -> System | None:
+    def _reindex(self):
+        """Rebuild all lookup indexes from the provider tree."""
+        self._systems = {}
+        self._system_sites = {}
+        self._primitives = {}
         for provider in self.providers:
             for site in provider.sites:
                 for system in site.systems:
-                    if system.id == system_id:
-                        return system
-        return None
+                    # first match wins, like the linear scans used to
+                    if system.id not in self._systems:
+                        self._systems[system.id] = system
+                        self._system_sites[system.id] = site
+                        self.events.index(system)
+        self._reindex_names()
+
+    def _reindex_names(self):
+        """Rebuild the name indexes only, O(providers + sites)."""
+        self._providers = {}
+        self._sites = {}
+        for provider in self.providers:
+            self._providers.setdefault(provider.name, provider)
+            for site in provider.sites:
+                self._sites.setdefault(site.name, site)
+
+    def _unindex_site(self, site: Site):
+        for system in site.systems:
+            if self._system_sites.get(system.id) is site:
+                del self._systems[system.id]
+                del self._system_sites[system.id]
+                self._primitives.pop(system.id, None)
+                self.events.forget(system.id)
+
+    def get_system(self, system_id: str) -> System | None:
+        return self._systems.get(system_id)
+
+    def get_system_site(self, system_id: str) -> Site | None:
+        return self._system_sites.get(system_id)
+
+    def systems(self) -> list[System]:
+        return list(self._systems.values())
+
+    def get_site(self, site_name: str) -> Site | None:
+        return self._sites.get(site_name)
+
+    def get_provider(self, provider_name: str) -> Provider | None:
+        return self._providers.get(provider_name)
     
     def update_system(self, system_id: str, **kwargs):
         system = self.get_system(system_id)
@@ -124,60 +676,98 @@ class SystemDB:
             else:
                 raise ValueError(f"Invalid attribute {key} for System.")
 
-        self.save_to_file()
+        self.journal({"op": "set", "id": system_id, "fields": kwargs})
+
+    def record_usage(self, system_id: str, cpu_pct: float, mem_used_gib: float, disks: dict[str, float]):
+        """Apply a usage sample; *disks* maps device to used GiB."""
+        system = self.get_system(system_id)
+        if not system:
+            raise ValueError(f"System with ID {system_id} not found.")
+
+        self._apply_usage(system, cpu_pct, mem_used_gib, disks)
+        self.journal({"op": "usage", "id": system_id, "cpu": cpu_pct, "mem": mem_used_gib, "disks": disks})
+
+    @staticmethod
+    def _apply_usage(system: System, cpu_pct: float, mem_used_gib: float, disks: dict[str, float]):
+        system.cpu.usage_pct = cpu_pct
+        system.memory.used_gib = mem_used_gib
+        for disk in system.disks:
+            if disk.device in disks:
+                disk.used_gib = disks[disk.device]
 
     def add_provider(self, provider: Provider):
         self.providers.append(provider)
+        self._reindex()
 
-        self.save_to_file()
+        self.mark_dirty(compact=True)
 
     def add_site(self, provider_name: str, site: Site):
-        for provider in self.providers:
-            if provider.name == provider_name:
-                provider.sites.append(site)
-                self.save_to_file()
-                return site
-        raise ValueError(f"Provider {provider_name} not found.")
+        provider = self.get_provider(provider_name)
+        if not provider:
+            raise ValueError(f"Provider {provider_name} not found.")
+
+        provider.sites.append(site)
+        self._sites.setdefault(site.name, site)
+        for system in site.systems:
+            if system.id not in self._systems:
+                self._systems[system.id] = system
+                self._system_sites[system.id] = site
+                self.events.index(system)
+        self.mark_dirty(compact=True)
+        return site
     
     def add_system(self, site_name: str, system: System):
         if self.get_system(system.id):
             raise ValueError(f"System with ID {system.id} already exists.")
 
-        for provider in self.providers:
-            for site in provider.sites:
-                if site.name == site_name:
-                    site.systems.append(system)
-                    self.save_to_file()
-                    return system
-        raise ValueError(f"Site {site_name} not found.")
+        site = self.get_site(site_name)
+        if not site:
+            raise ValueError(f"Site {site_name} not found.")
+
+        site.systems.append(system)
+        self._systems[system.id] = system
+        self._system_sites[system.id] = site
+        self.events.index(system)
+        self.mark_dirty(compact=True)
+        return system
     
     def remove_system(self, system_id: str):
-        for provider in self.providers:
-            for site in provider.sites:
-                for system in site.systems:
-                    if system.id == system_id:
-                        site.systems.remove(system)
-                        self.save_to_file()
-                        return system
-        raise ValueError(f"System with ID {system_id} not found.")
+        system = self.get_system(system_id)
+        if not system:
+            raise ValueError(f"System with ID {system_id} not found.")
+
+        self._system_sites.pop(system_id).systems.remove(system)
+        del self._systems[system_id]
+        self._stamps.pop(system_id, None)
+        self._primitives.pop(system_id, None)
+        self._lazy_events.pop(system_id, None)
+        self.events.forget(system_id)
+        self.mark_dirty(compact=True)
+        return system
     
     def remove_site(self, provider_name: str, site_name: str):
-        for provider in self.providers:
-            if provider.name == provider_name:
-                for site in provider.sites:
-                    if site.name == site_name:
-                        provider.sites.remove(site)
-                        self.save_to_file()
-                        return site
+        provider = self.get_provider(provider_name)
+        if provider:
+            for site in provider.sites:
+                if site.name == site_name:
+                    provider.sites.remove(site)
+                    self._unindex_site(site)
+                    self._reindex_names()
+                    self.mark_dirty(compact=True)
+                    return site
         raise ValueError(f"Site {site_name} not found in provider {provider_name}.")
     
     def remove_provider(self, provider_name: str):
-        for provider in self.providers:
-            if provider.name == provider_name:
-                self.providers.remove(provider)
-                self.save_to_file()
-                return provider
-        raise ValueError(f"Provider {provider_name} not found.")
+        provider = self.get_provider(provider_name)
+        if not provider:
+            raise ValueError(f"Provider {provider_name} not found.")
+
+        self.providers.remove(provider)
+        for site in provider.sites:
+            self._unindex_site(site)
+        self._reindex_names()
+        self.mark_dirty(compact=True)
+        return provider
     
     def edit_system(self, system_id: str, **kwargs):
         system = self.get_system(system_id)
@@ -190,7 +780,9 @@ class SystemDB:
             else:
                 raise ValueError(f"Invalid attribute {key} for System.")
 
-        self.save_to_file()
+        self._primitives.pop(system_id, None)
+        # name, type and group end up in structure.json as well
+        self.mark_dirty(compact=True)
 
     def edit_system_id(self, old_id: str, new_id: str):
         system = self.get_system(old_id)
@@ -201,67 +793,105 @@ class SystemDB:
         if self.get_system(new_id):
             raise ValueError(f"System with ID {new_id} already exists.")
         system.id = new_id
-        self.save_to_file()
+        self._systems[new_id] = self._systems.pop(old_id)
+        self._system_sites[new_id] = self._system_sites.pop(old_id)
+        self._stamps.pop(old_id, None)
+        self._primitives.pop(old_id, None)
+        if old_id in self._lazy_events:
+            self._lazy_events[new_id] = self._lazy_events.pop(old_id)
+        self.events.rename(old_id, new_id)
+        self.mark_dirty(compact=True)
 
     def edit_site(self, provider_name: str, site_name: str, **kwargs):
-        for provider in self.providers:
-            if provider.name == provider_name:
-                for site in provider.sites:
-                    if site.name == site_name:
-                        for key, value in kwargs.items():
-                            if hasattr(site, key):
-                                setattr(site, key, value)
-                            else:
-                                raise ValueError(f"Invalid attribute {key} for Site.")
-                        self.save_to_file()
-                        return site
+        provider = self.get_provider(provider_name)
+        if provider:
+            for site in provider.sites:
+                if site.name == site_name:
+                    for key, value in kwargs.items():
+                        if hasattr(site, key):
+                            setattr(site, key, value)
+                        else:
+                            raise ValueError(f"Invalid attribute {key} for Site.")
+                    self._reindex_names()
+                    self.mark_dirty(compact=True)
+                    return site
         raise ValueError(f"Site {site_name} not found in provider {provider_name}.")
     
     def edit_provider(self, provider_name: str, **kwargs):
-        for provider in self.providers:
-            if provider.name == provider_name:
-                for key, value in kwargs.items():
-                    if hasattr(provider, key):
-                        setattr(provider, key, value)
-                    else:
-                        raise ValueError(f"Invalid attribute {key} for Provider.")
-                self.save_to_file()
-                return provider
-        raise ValueError(f"Provider {provider_name} not found.")
+        provider = self.get_provider(provider_name)
+        if not provider:
+            raise ValueError(f"Provider {provider_name} not found.")
+
+        for key, value in kwargs.items():
+            if hasattr(provider, key):
+                setattr(provider, key, value)
+            else:
+                raise ValueError(f"Invalid attribute {key} for Provider.")
+        self._reindex_names()
+        self.mark_dirty(compact=True)
+        return provider
     
     def check_event_level(self, system_id: str):
         system = self.get_system(system_id)
         if not system:
             raise ValueError(f"System with ID {system_id} not found.")
+        self.ensure_events(system)
 
-        system.critical = any(e.level == EventLevel.CRITICAL and not e.cleared for e in system.events)
-        system.warning = any(e.level == EventLevel.WARNING and not e.cleared for e in system.events)
-
-        self.save_to_file()
+        self.events.update_level(system)
+        self.journal({"op": "set", "id": system_id, "fields": {"critical": system.critical, "warning": system.warning}})
     
     def add_event(self, system_id: str, event: Event):
         system = self.get_system(system_id)
         if not system:
             raise ValueError(f"System with ID {system_id} not found.")
-        
-        existing = system.uncleared_event_exists(event.level, event.type)
-        if existing:
-            existing.occurrances += 1
-            existing.timestamp = event.timestamp
-            existing.description = event.description
-        else:
-            system.events.append(event)
+        self.ensure_events(system)
 
-        self.check_event_level(system_id)
+        stored, appended = self.events.add(system, event)
+        INSTRUMENTS.count("events_total", ("level", event.level), ("type", event.type))
+        self.events.update_level(system)
+        # the full event state, so that replaying it twice is harmless
+        self.journal({"op": "event", "id": system_id, "event": stored})
+        if appended:
+            self._expire_events(system)
 
     def clear_event(self, system_id: str, event_id: int):
         system = self.get_system(system_id)
         if not system:
             raise ValueError(f"System with ID {system_id} not found.")
+        self.ensure_events(system)
+
+        event = self.events.clear(system, event_id)
+        if not event:
+            raise ValueError(f"Event with ID {event_id} not found in system {system_id}.")
+        self.events.update_level(system)
+        self.journal({"op": "clear", "id": system_id, "event": event_id})
+        self._expire_events(system)
+        return event
+
+    def _expire_events(self, system: System):
+        # only the persisting worker applies retention and archives, its
+        # prune records reach the others
+        if not self.persist:
+            return
+        self.ensure_events(system)
+        expired = self.events.expire(system)
+        if not expired:
+            return
+
+        self.journal({"op": "prune", "id": system.id, "events": [e.id for e in expired]})
+        lines = [json_dumps({"system_id": system.id, "event": dataclass_to_primitive(e)}) + "\n" for e in expired]
+        self.archived_events += len(expired)
+        self._writer.submit(self._append_archive, lines).add_done_callback(self._report_write_error)
 
-        for event in system.events:
-            if event.id == event_id:
-                event.clear()
-                self.check_event_level(system_id)
-                return event
-        raise ValueError(f"Event with ID {event_id} not found in system {system_id}.")
\ No newline at end of file
+    def _append_archive(self, lines: list[str]):
+        with open(self.event_archive_path, 'a', encoding="utf-8") as f:
+            f.write("".join(lines))
+
+    def expire_events(self):
+        """Apply event retention to the systems that have events which aged out."""
+        if not self.persist:
+            return
+        for system_id in self.events.aged():
+            system = self.get_system(system_id)
+            if system:
+                self._expire_events(system)
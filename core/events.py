@@ -0,0 +1,192 @@
+import heapq
+import itertools
+import time
+
+from models import Event, EventLevel, System
+
+
+class EventStore:
+    """
+    Index over the events of every system. Active (uncleared) events are
+    kept in a map keyed by (level, type), which holds at most one event per
+    key, so deduplication and the warning/critical flags cost O(1).
+
+    Cleared events are subject to retention: beyond ``max_count`` events
+    per system, or once older than ``max_age`` seconds, the oldest cleared
+    ones are handed back to the caller for archiving. They are kept in a
+    heap by timestamp per system, plus one across all systems for the age
+    limit, so retention costs O(expired) instead of a scan of every event.
+    Heap entries of events removed otherwise are skipped when they surface.
+    """
+
+    def __init__(self, max_count: int = 200, max_age: float = 30 * 24 * 3600):
+        self.max_count = max_count
+        self.max_age = max_age
+        self._active: dict[str, dict[tuple[str, str], Event]] = {}
+        # cleared events still in each system's list, by ID
+        self._cleared: dict[str, dict[str, Event]] = {}
+        self._cleared_heap: dict[str, list[tuple[float, int, Event]]] = {}
+        # (timestamp, seq, system ID, event) of every cleared event, for the age sweep
+        self._aging: list[tuple[float, int, str, Event]] = []
+        self._aging_limit = 1024
+        self._seq = itertools.count()
+
+    def index(self, system: System):
+        """(Re)build the active map and retention heaps of a single system."""
+        self._active[system.id] = {(e.level, e.type): e for e in system.events if not e.cleared}
+        self._cleared[system.id] = {}
+        self._cleared_heap[system.id] = []
+        for event in system.events:
+            if event.cleared:
+                self._track(system.id, event)
+
+    def forget(self, system_id: str):
+        self._active.pop(system_id, None)
+        self._cleared.pop(system_id, None)
+        self._cleared_heap.pop(system_id, None)
+
+    def rename(self, old_id: str, new_id: str):
+        if old_id in self._active:
+            self._active[new_id] = self._active.pop(old_id)
+        if old_id in self._cleared:
+            self._cleared[new_id] = self._cleared.pop(old_id)
+            self._cleared_heap[new_id] = self._cleared_heap.pop(old_id)
+            self._rebuild_aging()
+
+    def _track(self, system_id: str, event: Event):
+        seq = next(self._seq)
+        self._cleared.setdefault(system_id, {})[event.id] = event
+        heapq.heappush(self._cleared_heap.setdefault(system_id, []), (event.timestamp, seq, event))
+        if self.max_age > 0:
+            heapq.heappush(self._aging, (event.timestamp, seq, system_id, event))
+            if len(self._aging) > self._aging_limit:
+                self._rebuild_aging()
+
+    def _rebuild_aging(self):
+        """Drop the entries of events that are gone, e.g. after re-indexing or renames."""
+        if self.max_age <= 0:
+            return
+        self._aging = [
+            (timestamp, seq, system_id, event)
+            for system_id, heap in self._cleared_heap.items()
+            for timestamp, seq, event in heap
+            if self._cleared[system_id].get(event.id) is event
+        ]
+        heapq.heapify(self._aging)
+        self._aging_limit = max(1024, 2 * len(self._aging))
+
+    def active(self, system_id: str, level: EventLevel, type: str) -> Event | None:
+        return self._active.get(system_id, {}).get((level, type))
+
+    def add(self, system: System, event: Event) -> tuple[Event, bool]:
+        """
+        Merge *event* into the active event of the same level and type, or
+        append it. Returns the stored event and whether it was appended.
+        """
+        active = self._active.setdefault(system.id, {})
+        existing = active.get((event.level, event.type))
+        if existing:
+            existing.occurrances += 1
+            existing.timestamp = event.timestamp
+            existing.description = event.description
+            return existing, False
+
+        system.events.append(event)
+        if event.cleared:
+            self._track(system.id, event)
+        else:
+            active[(event.level, event.type)] = event
+        return event, True
+
+    def store(self, system: System, event: Event):
+        """Insert *event*, or replace the stored event with the same ID (journal replay)."""
+        for i, stored in enumerate(system.events):
+            if stored.id == event.id:
+                system.events[i] = event
+                break
+        else:
+            system.events.append(event)
+
+        cleared = self._cleared.get(system.id, {})
+        cleared.pop(event.id, None)
+        active = self._active.setdefault(system.id, {})
+        key = (event.level, event.type)
+        if not event.cleared:
+            active[key] = event
+        else:
+            if key in active and active[key].id == event.id:
+                del active[key]
+            self._track(system.id, event)
+
+    def clear(self, system: System, event_id: str) -> Event | None:
+        for event in system.events:
+            if event.id == event_id:
+                already = event.cleared
+                event.clear()
+                active = self._active.get(system.id, {})
+                if active.get((event.level, event.type)) is event:
+                    del active[(event.level, event.type)]
+                if not already:
+                    self._track(system.id, event)
+                return event
+        return None
+
+    def update_level(self, system: System):
+        levels = {level for level, _ in self._active.get(system.id, {})}
+        system.critical = EventLevel.CRITICAL in levels
+        system.warning = EventLevel.WARNING in levels
+
+    def remove(self, system: System, event_ids: list[str]):
+        ids = set(event_ids)
+        cleared = self._cleared.get(system.id, {})
+        for event_id in ids:
+            cleared.pop(event_id, None)
+        system.events = [e for e in system.events if e.id not in ids]
+
+    def expire(self, system: System, now: float | None = None) -> list[Event]:
+        """
+        Remove and return the cleared events that fall out of retention,
+        oldest first. Uncleared events are never removed.
+        """
+        heap = self._cleared_heap.get(system.id)
+        if not heap:
+            return []
+        if now is None:
+            now = time.time()
+
+        cleared = self._cleared[system.id]
+        excess = len(system.events) - self.max_count
+        expired = []
+        while heap:
+            timestamp, _, event = heap[0]
+            if cleared.get(event.id) is not event:
+                heapq.heappop(heap)  # removed or replaced since
+            elif excess > 0 or (self.max_age > 0 and now - timestamp > self.max_age):
+                heapq.heappop(heap)
+                del cleared[event.id]
+                expired.append(event)
+                excess -= 1
+            else:
+                break
+
+        if expired:
+            drop = {e.id for e in expired}
+            system.events = [e for e in system.events if e.id not in drop]
+        return expired
+
+    def aged(self, now: float | None = None) -> list[str]:
+        """
+        IDs of the systems that may hold cleared events older than
+        ``max_age``, in O(aged) rather than a scan of every system.
+        """
+        if self.max_age <= 0:
+            return []
+        if now is None:
+            now = time.time()
+
+        system_ids = {}
+        while self._aging and now - self._aging[0][0] > self.max_age:
+            _, _, system_id, event = heapq.heappop(self._aging)
+            if self._cleared.get(system_id, {}).get(event.id) is event:
+                system_ids[system_id] = None
+        return list(system_ids)
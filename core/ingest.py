@@ -0,0 +1,132 @@
+import asyncio
+import time
+from typing import Callable
+
+from log import get_logger
+
+logger = get_logger("ingest")
+
+
+class IngestQueue:
+    """
+    Bounded queue between the agent WebSocket receivers and a single worker
+    that applies their messages in micro-batches.
+
+    The worker waits for the first message, gives the batch ``batch_window_ms``
+    to fill up and then hands at most ``batch_size`` messages to *handler* in
+    one synchronous call, so a burst costs one persistence commit and one
+    dashboard broadcast per batch instead of per message. A full queue makes
+    ``put`` wait, which pushes back on the agents' sockets.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[list], None],
+        queue_size: int = 10000,
+        batch_size: int = 256,
+        batch_window_ms: float = 20,
+        observe: Callable[[object, float], None] | None = None,
+    ):
+        self.handler = handler
+        # called per item with the seconds from put() until it was handled
+        self.observe = observe
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window_ms / 1000
+        self._queue: asyncio.Queue[tuple[float, object]] = asyncio.Queue(maxsize=queue_size)
+        self._worker: asyncio.Task | None = None
+        # taken off the queue but not handled yet, so stop() can still apply it
+        self._batch: list = []
+
+        self.enqueued = 0
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+        self.blocked_puts = 0
+        self.max_depth = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.max_wait_ms = 0.0
+        self._wait_total = 0.0
+
+    async def put(self, item):
+        if self._queue.full():
+            self.blocked_puts += 1
+        await self._queue.put((time.monotonic(), item))
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def _drain(self, batch: list):
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+    async def _run(self):
+        while True:
+            self._batch.append(await self._queue.get())
+            self._drain(self._batch)
+            if len(self._batch) < self.batch_size and self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+                self._drain(self._batch)
+            batch, self._batch = self._batch, []
+            self._process(batch)
+
+    def _process(self, batch: list):
+        now = time.monotonic()
+        for enqueued_at, _ in batch:
+            wait = now - enqueued_at
+            self._wait_total += wait
+            self.max_wait_ms = max(self.max_wait_ms, wait * 1000)
+
+        try:
+            self.handler([item for _, item in batch])
+        except Exception as e:
+            self.errors += 1
+            logger.error("Error processing ingest batch: %s", e, extra={"batch": len(batch)})
+
+        if self.observe:
+            done = time.monotonic()
+            for enqueued_at, item in batch:
+                self.observe(item, done - enqueued_at)
+
+        self.batches += 1
+        self.processed += len(batch)
+        self.last_batch_size = len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        # apply the batch the worker was filling and whatever was still
+        # queued before persistence shuts down
+        batch, self._batch = self._batch, []
+        self._drain(batch)
+        while batch:
+            self._process(batch)
+            batch = []
+            self._drain(batch)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._queue.qsize(),
+            "max_depth": self.max_depth,
+            "capacity": self._queue.maxsize,
+            "blocked_puts": self.blocked_puts,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": self.processed / self.batches if self.batches else 0,
+            "avg_wait_ms": self._wait_total / self.processed * 1000 if self.processed else 0,
+            "max_wait_ms": self.max_wait_ms,
+        }
@@ -0,0 +1,217 @@
+import asyncio
+import bisect
+from collections import Counter
+import sys
+import threading
+import time
+
+# upper bounds, seconds and bytes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram as Prometheus exposes it. Each histogram is only
+    observed from one thread (the loop, or SystemDB's writer), so there's
+    no lock.
+    """
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the *q* quantile."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+def _labels(labels: tuple[tuple[str, str], ...]) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+
+class Instruments:
+    """
+    The server's own hot-path metrics: histograms and counters keyed by a
+    name and a tuple of label pairs, created on first use. Rendered at the
+    end of /metrics and summarized in /stats.json.
+
+    SystemDB's writer thread creates histograms too, so creation and the
+    copies that render() and stats() iterate over are taken under a lock.
+    """
+
+    HISTOGRAMS = {
+        "ingest_latency_seconds": ("Time from receiving an agent message to applying it.", LATENCY_BUCKETS),
+        "persistence_write_seconds": ("Duration of journal appends and snapshot writes.", LATENCY_BUCKETS),
+        "json_encode_bytes": ("Size of JSON encoded for journal lines, streams and providers.json.", SIZE_BUCKETS),
+        "loop_lag_seconds": ("Delay of the event loop in waking up a sleeping task.", LATENCY_BUCKETS),
+    }
+    COUNTERS = {
+        "messages_total": "Agent messages received.",
+        "events_total": "Events raised.",
+        "reconnects_total": "Agent connections for systems that were connected to this worker before.",
+    }
+
+    def __init__(self):
+        self._histograms: dict[str, dict[tuple, Histogram]] = {name: {} for name in self.HISTOGRAMS}
+        self._counters: dict[str, Counter] = {name: Counter() for name in self.COUNTERS}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, *labels: tuple[str, str]) -> Histogram:
+        histograms = self._histograms[name]
+        histogram = histograms.get(labels)
+        if histogram is None:
+            with self._lock:
+                histogram = histograms.setdefault(labels, Histogram(self.HISTOGRAMS[name][1]))
+        return histogram
+
+    def _items(self) -> tuple[dict[str, list[tuple[tuple, Histogram]]], dict[str, list[tuple[tuple, int]]]]:
+        with self._lock:
+            return (
+                {name: list(histograms.items()) for name, histograms in self._histograms.items()},
+                {name: list(counter.items()) for name, counter in self._counters.items()},
+            )
+
+    def observe(self, name: str, value: float, *labels: tuple[str, str]):
+        self.histogram(name, *labels).observe(value)
+
+    def count(self, name: str, *labels: tuple[str, str], n: int = 1):
+        self._counters[name][labels] += n
+
+    def render(self) -> bytes:
+        histograms, counters = self._items()
+        parts = []
+        for name, (help, _) in self.HISTOGRAMS.items():
+            full = f"sysmon_server_{name}"
+            parts.append(f"# HELP {full} {help}\n# TYPE {full} histogram\n")
+            for labels, histogram in histograms[name]:
+                prefix = _labels(labels) + "," if labels else ""
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    parts.append(f'{full}_bucket{{{prefix}le="{bound:g}"}} {cumulative}\n')
+                parts.append(f'{full}_bucket{{{prefix}le="+Inf"}} {histogram.count}\n')
+                label_part = f"{{{_labels(labels)}}}" if labels else ""
+                parts.append(f"{full}_sum{label_part} {histogram.sum}\n{full}_count{label_part} {histogram.count}\n")
+        for name, help in self.COUNTERS.items():
+            full = f"sysmon_server_{name}"
+            parts.append(f"# HELP {full} {help}\n# TYPE {full} counter\n")
+            for labels, value in counters[name]:
+                label_part = f"{{{_labels(labels)}}}" if labels else ""
+                parts.append(f"{full}{label_part} {value}\n")
+        return "".join(parts).encode()
+
+    def stats(self) -> dict:
+        all_histograms, counters = self._items()
+        result = {}
+        for name, histograms in all_histograms.items():
+            result[name] = {
+                _labels(labels) or "all": {
+                    "count": h.count,
+                    "mean": h.sum / h.count if h.count else 0,
+                    "p50": h.quantile(0.5),
+                    "p99": h.quantile(0.99),
+                }
+                for labels, h in histograms
+            }
+        for name, counter in counters.items():
+            result[name] = {_labels(labels) or "all": value for labels, value in counter}
+        return result
+
+
+INSTRUMENTS: Instruments = Instruments()
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a task that sleeps *interval* seconds."""
+
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            INSTRUMENTS.observe("loop_lag_seconds", max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread (the event loop's) from a helper
+    thread every *interval* seconds, and reports how often each stack was
+    seen, as folded stacks ("outer;inner count", the input of flamegraph
+    tools) or as the functions most often on top of the stack.
+
+    The helper thread needs the GIL to take a sample, so samples land when
+    the loop thread releases it: in I/O waits, or every switch interval
+    (5 ms) during long stretches of Python code. Those long stretches are
+    what blocks the loop, short ones are under-represented.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    def sample(self, seconds: float) -> tuple[Counter, int]:
+        """Blocks the calling (helper) thread for *seconds*; returns stack counts and the number of samples."""
+        stacks = Counter()
+        samples = 0
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stacks[";".join(reversed(stack))] += 1
+                samples += 1
+            time.sleep(self.interval)
+        return stacks, samples
+
+    @staticmethod
+    def folded(stacks: Counter) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    @staticmethod
+    def top(stacks: Counter, samples: int, limit: int = 40) -> str:
+        if not samples:
+            return "0 samples\n"
+        own = Counter()
+        total = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        lines = [f"{samples} samples\n\n{'own':>7} {'total':>7}  function\n"]
+        for function, count in own.most_common(limit):
+            lines.append(f"{count / samples:7.1%} {total[function] / samples:7.1%}  {function}\n")
+        return "".join(lines)
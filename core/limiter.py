@@ -0,0 +1,116 @@
+import time
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+from log import get_logger
+
+logger = get_logger("auth")
+
+
+class TokenBucket:
+    """
+    In-process failure budget per key: *capacity* tokens that refill at
+    *capacity* per *window* seconds, every failure takes one.
+    """
+
+    def __init__(self, capacity: int, window: float, max_keys: int = 10000):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.max_keys = max_keys
+        self._buckets: dict[str, tuple[float, float]] = {}  # key: (tokens, updated)
+
+    def _tokens(self, key: str, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def blocked(self, key: str) -> bool:
+        return self._tokens(key, time.monotonic()) < 1
+
+    def take(self, key: str):
+        now = time.monotonic()
+        if len(self._buckets) >= self.max_keys:
+            # forget the keys that have refilled completely anyway
+            self._buckets = {k: v for k, v in self._buckets.items() if self._tokens(k, now) < self.capacity}
+        self._buckets[key] = (self._tokens(key, now) - 1, now)
+
+    def reset(self, key: str):
+        self._buckets.pop(key, None)
+
+
+class LoginLimiter:
+    """
+    Throttles failed logins per client: once *max_failures* failed attempts
+    were counted within *window* seconds, further attempts are refused.
+
+    The counters live in Redis, shared by all workers, and are updated with
+    one pipelined INCR/EXPIRE round trip. While Redis can't be reached the
+    limiter falls back to an in-process TokenBucket and only retries Redis
+    after *retry_interval* seconds, so a Redis outage neither blocks logins
+    nor makes every attempt wait for a connect timeout.
+    """
+
+    PREFIX = "sysmon:"
+
+    def __init__(self, redis: aioredis.Redis, max_failures: int = 5, window: int = 900, retry_interval: float = 30):
+        self.redis = redis
+        self.max_failures = max_failures
+        self.window = window
+        self.retry_interval = retry_interval
+        self.fallback = TokenBucket(max_failures, window)
+        self._redis_down_until = 0.0
+
+        self.refused = 0
+        self.failures = 0
+        self.redis_errors = 0
+
+    def _use_redis(self) -> bool:
+        return time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, e: Exception):
+        self.redis_errors += 1
+        self._redis_down_until = time.monotonic() + self.retry_interval
+        logger.warning("Redis unavailable for login throttling, using in-process limits for %ss: %s", self.retry_interval, e)
+
+    async def blocked(self, key: str) -> bool:
+        blocked = None
+        if self._use_redis():
+            try:
+                blocked = int(await self.redis.get(self.PREFIX + key) or 0) >= self.max_failures
+            except RedisError as e:
+                self._redis_failed(e)
+        if blocked is None:
+            blocked = self.fallback.blocked(key)
+
+        if blocked:
+            self.refused += 1
+        return blocked
+
+    async def failed(self, key: str):
+        self.failures += 1
+        if self._use_redis():
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.incr(self.PREFIX + key)
+                    pipe.expire(self.PREFIX + key, self.window)
+                    await pipe.execute()
+                return
+            except RedisError as e:
+                self._redis_failed(e)
+        self.fallback.take(key)
+
+    async def reset(self, key: str):
+        self.fallback.reset(key)
+        if self._use_redis():
+            try:
+                await self.redis.delete(self.PREFIX + key)
+            except RedisError as e:
+                self._redis_failed(e)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis" if self._use_redis() else "in-process",
+            "failures": self.failures,
+            "refused": self.refused,
+            "redis_errors": self.redis_errors,
+        }
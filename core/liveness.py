@@ -0,0 +1,97 @@
+import asyncio
+import heapq
+import time
+from typing import Callable
+
+from log import get_logger
+
+logger = get_logger("agent")
+
+
+class LivenessSweeper:
+    """
+    Finds agents that went silent for ``timeout`` seconds.
+
+    Every message from an agent moves its deadline (``touch``), which only
+    updates a dict. The deadlines are also kept in a min-heap with one
+    entry per system; an entry that comes due is either expired or, if the
+    system was touched since it was pushed, pushed again with the current
+    deadline. A tick therefore only looks at the systems whose heap entry
+    is due, not at every system.
+    """
+
+    def __init__(self, on_expired: Callable[[list[str]], None], timeout: float = 60, interval: float = 1):
+        self.on_expired = on_expired
+        self.timeout = timeout
+        self.interval = interval
+        self._deadlines: dict[str, float] = {}
+        self._heap: list[tuple[float, str]] = []
+        self._task: asyncio.Task | None = None
+
+        self.expired = 0
+        self.rescheduled = 0
+
+    def __contains__(self, system_id: str) -> bool:
+        return system_id in self._deadlines
+
+    def touch(self, system_id: str):
+        deadline = time.monotonic() + self.timeout
+        if system_id not in self._deadlines:
+            heapq.heappush(self._heap, (deadline, system_id))
+        self._deadlines[system_id] = deadline
+
+    def forget(self, system_id: str):
+        # the heap entry is skipped once it comes due
+        self._deadlines.pop(system_id, None)
+
+    def rename(self, system_id: str, new_id: str):
+        deadline = self._deadlines.pop(system_id, None)
+        if deadline is not None:
+            self._deadlines[new_id] = deadline
+            heapq.heappush(self._heap, (deadline, new_id))
+
+    def sweep(self, now: float | None = None) -> list[str]:
+        """Pop the systems whose deadline has passed."""
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, system_id = heapq.heappop(self._heap)
+            current = self._deadlines.get(system_id)
+            if current is None:
+                continue
+            if current > deadline:
+                heapq.heappush(self._heap, (current, system_id))
+                self.rescheduled += 1
+                continue
+            del self._deadlines[system_id]
+            expired.append(system_id)
+        self.expired += len(expired)
+        return expired
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            expired = self.sweep()
+            if expired:
+                try:
+                    self.on_expired(expired)
+                except Exception as e:
+                    logger.error("Error expiring agents: %s", e)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self._deadlines),
+            "heap": len(self._heap),
+            "expired": self.expired,
+            "rescheduled": self.rescheduled,
+        }
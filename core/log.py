@@ -0,0 +1,169 @@
+import atexit
+import copy
+import datetime
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+from util import Config, json_dumps
+
+# loggers are "sysmon.<category>"
+ROOT = "sysmon"
+CATEGORIES = ("agent", "auth", "cluster", "db", "history", "ingest", "util", "web")
+
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+_EXC_FORMATTER = logging.Formatter()
+
+
+def get_logger(category: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT}.{category}")
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, category, message and any ``extra`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "category": record.name.removeprefix(ROOT + "."),
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED:
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json_dumps(entry)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        extra = " ".join(f"{k}={v}" for k, v in record.__dict__.items() if k not in _RESERVED)
+        return super().format(record) + (f" [{extra}]" if extra else "")
+
+
+class CategoryLimiter(logging.Filter):
+    """
+    Sampling and rate limiting per category. As a filter of the queue
+    handler it runs in the thread that logs, usually the event loop,
+    before a record is copied and queued, so dropped records cost no
+    more than this check. Warnings and errors are never sampled, only
+    rate limited. The next record of a category that gets through
+    carries how many were suppressed before it.
+    """
+
+    def __init__(self, sample: dict[str, float], rate: dict[str, float]):
+        super().__init__()
+        self.sample = sample
+        self.rate = rate
+        self._tokens: dict[str, tuple[float, float]] = {}
+        self._suppressed: dict[str, int] = {}
+        self.suppressed_total = 0
+
+    def _allow(self, category: str, record: logging.LogRecord) -> bool:
+        sample = self.sample.get(category, 1.0)
+        if sample < 1.0 and record.levelno < logging.WARNING and random.random() >= sample:
+            return False
+
+        rate = self.rate.get(category)
+        if not rate:
+            return True
+        now = time.monotonic()
+        tokens, updated = self._tokens.get(category, (rate, now))
+        tokens = min(rate, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self._tokens[category] = (tokens, now)
+            return False
+        self._tokens[category] = (tokens - 1, now)
+        return True
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = record.name.removeprefix(ROOT + ".")
+        if not self._allow(category, record):
+            self._suppressed[category] = self._suppressed.get(category, 0) + 1
+            self.suppressed_total += 1
+            return False
+        suppressed = self._suppressed.pop(category, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: records that don't fit into the queue are counted and dropped."""
+
+    def __init__(self, queue: queue.Queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only resolve what can't cross to the listener thread, formatting happens there
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_handler: DroppingQueueHandler | None = None
+_limiter: CategoryLimiter | None = None
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging(config: Config):
+    """
+    Route the sysmon loggers through a bounded queue to a listener thread
+    that formats and writes them to stdout, so logging never does I/O on
+    the event loop.
+    """
+    global _handler, _limiter, _listener
+    root = logging.getLogger(ROOT)
+    if _handler is not None:
+        root.removeHandler(_handler)
+        _listener.stop()
+        atexit.unregister(_listener.stop)
+
+    categories = config.logging_categories or {}
+    root.setLevel(config.logging_level.upper())
+    for category in CATEGORIES:
+        level = categories.get(category, {}).get("level")
+        get_logger(category).setLevel(level.upper() if level else logging.NOTSET)
+
+    _limiter = CategoryLimiter(
+        sample={c: s["sample"] for c, s in categories.items() if "sample" in s},
+        rate={c: s["rate"] for c, s in categories.items() if "rate" in s},
+    )
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=config.logging_queue_size))
+    _handler.addFilter(_limiter)
+    root.addHandler(_handler)
+    root.propagate = False
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter() if config.logging_format == "json" else TextFormatter())
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+    # writes out what is still queued
+    atexit.register(_listener.stop)
+
+
+def stats() -> dict:
+    return {
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+        "suppressed": _limiter.suppressed_total if _limiter else 0,
+    }
@@ -0,0 +1,155 @@
+from db import SystemDB
+from models import System
+
+GIB = 1024 ** 3
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# name: (help, type)
+FAMILIES = {
+    "sysmon_system_up": ("Whether the system's agent is connected.", "gauge"),
+    "sysmon_system_last_seen_timestamp_seconds": ("Time of the last message from the system's agent.", "gauge"),
+    "sysmon_system_cpu_usage_percent": ("CPU usage.", "gauge"),
+    "sysmon_system_memory_used_bytes": ("Memory in use.", "gauge"),
+    "sysmon_system_memory_total_bytes": ("Total memory.", "gauge"),
+    "sysmon_system_disk_used_bytes": ("Disk space in use, per disk.", "gauge"),
+    "sysmon_system_disk_total_bytes": ("Disk size, per disk.", "gauge"),
+    "sysmon_system_service_up": ("Whether a watched service is running.", "gauge"),
+    "sysmon_system_warning": ("Whether the system has an uncleared warning event.", "gauge"),
+    "sysmon_system_critical": ("Whether the system has an uncleared critical event.", "gauge"),
+}
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsExporter:
+    """
+    Prometheus text exposition of every system's current state.
+
+    The samples of each system are rendered into one string per metric
+    family and kept, and the systems are laid out in blocks whose lines
+    per family are kept joined as bytes. SystemDB reports every changed
+    system, which is only marked stale; a scrape re-renders the stale
+    systems, re-joins their blocks and concatenates the blocks, or
+    returns the previous output if nothing changed. Structural changes
+    (systems added, moved, renamed or regrouped) recompute the labels and
+    re-render everything once.
+    """
+
+    BLOCK = 256
+
+    def __init__(self, db: SystemDB):
+        self.db = db
+        self._labels: dict[str, str] = {}
+        # escaped label pairs of disks and services, few distinct ones per fleet
+        self._item_labels: dict[tuple, str] = {}
+        # family: system ID: rendered lines
+        self._lines: dict[str, dict[str, str]] = {name: {} for name in FAMILIES}
+        self._order: list[str] = []
+        self._block_of: dict[str, int] = {}
+        # family: joined lines per block
+        self._blocks: dict[str, list[bytes]] = {name: [] for name in FAMILIES}
+        self._stale: set[str] = set()
+        self._structure_stale = True
+        self._output: bytes | None = None
+
+        self.scrapes = 0
+        self.rendered = 0
+
+        db.listeners.append(self.system_changed)
+
+    def system_changed(self, system_id: str | None):
+        """SystemDB listener, *system_id* is None for structural changes."""
+        if system_id is None:
+            self._structure_stale = True
+        else:
+            self._stale.add(system_id)
+        self._output = None
+
+    def _item_label(self, key: tuple) -> str:
+        label = self._item_labels.get(key)
+        if label is None:
+            if key[0] == "disk":
+                label = f',device="{escape(key[1])}",mountpoint="{escape(key[2])}"'
+            else:
+                label = f',service="{escape(key[1])}"'
+            self._item_labels[key] = label
+        return label
+
+    def _relabel(self):
+        self._labels = {}
+        self._item_labels = {}
+        for provider in self.db.providers:
+            for site in provider.sites:
+                for system in site.systems:
+                    self._labels.setdefault(system.id, (
+                        f'system="{escape(system.id)}",name="{escape(system.name)}",provider="{escape(provider.name)}",'
+                        f'site="{escape(site.name)}",group="{escape(system.group)}"'
+                    ))
+        for lines in self._lines.values():
+            lines.clear()
+        self._order = list(self._labels)
+        self._block_of = {system_id: i // self.BLOCK for i, system_id in enumerate(self._order)}
+        block_count = -(-len(self._order) // self.BLOCK)
+        self._blocks = {name: [b""] * block_count for name in FAMILIES}
+        self._stale = set(self._labels)
+        self._structure_stale = False
+
+    def _render(self, system: System, labels: str):
+        lines = self._lines
+        lines["sysmon_system_up"][system.id] = f"sysmon_system_up{{{labels}}} {int(system.connected)}\n"
+        lines["sysmon_system_last_seen_timestamp_seconds"][system.id] = f"sysmon_system_last_seen_timestamp_seconds{{{labels}}} {system.last_seen}\n"
+        lines["sysmon_system_cpu_usage_percent"][system.id] = f"sysmon_system_cpu_usage_percent{{{labels}}} {system.cpu.usage_pct}\n"
+        lines["sysmon_system_memory_used_bytes"][system.id] = f"sysmon_system_memory_used_bytes{{{labels}}} {system.memory.used_gib * GIB:.0f}\n"
+        lines["sysmon_system_memory_total_bytes"][system.id] = f"sysmon_system_memory_total_bytes{{{labels}}} {system.memory.total_gib * GIB:.0f}\n"
+        used, total = [], []
+        for disk in system.disks:
+            disk_labels = labels + self._item_label(("disk", disk.device, disk.mountpoint))
+            used.append(f"sysmon_system_disk_used_bytes{{{disk_labels}}} {disk.used_gib * GIB:.0f}\n")
+            total.append(f"sysmon_system_disk_total_bytes{{{disk_labels}}} {disk.total_gib * GIB:.0f}\n")
+        lines["sysmon_system_disk_used_bytes"][system.id] = "".join(used)
+        lines["sysmon_system_disk_total_bytes"][system.id] = "".join(total)
+        lines["sysmon_system_service_up"][system.id] = "".join(
+            f"sysmon_system_service_up{{{labels}{self._item_label(('service', service.name))}}} {int(service.running)}\n"
+            for service in system.services
+        )
+        lines["sysmon_system_warning"][system.id] = f"sysmon_system_warning{{{labels}}} {int(system.warning)}\n"
+        lines["sysmon_system_critical"][system.id] = f"sysmon_system_critical{{{labels}}} {int(system.critical)}\n"
+
+    def render(self) -> bytes:
+        self.scrapes += 1
+        if self._output is not None:
+            return self._output
+
+        if self._structure_stale:
+            self._relabel()
+        stale_blocks = set()
+        for system_id in self._stale:
+            system = self.db.get_system(system_id)
+            labels = self._labels.get(system_id)
+            if system and labels:
+                self._render(system, labels)
+                stale_blocks.add(self._block_of[system_id])
+                self.rendered += 1
+        self._stale.clear()
+
+        for block in stale_blocks:
+            system_ids = self._order[block * self.BLOCK:(block + 1) * self.BLOCK]
+            for name, lines in self._lines.items():
+                self._blocks[name][block] = "".join([lines[i] for i in system_ids if i in lines]).encode()
+
+        parts = []
+        for name, (help, type) in FAMILIES.items():
+            parts.append(f"# HELP {name} {help}\n# TYPE {name} {type}\n".encode())
+            parts.extend(self._blocks[name])
+        self._output = b"".join(parts)
+        return self._output
+
+    def stats(self) -> dict:
+        return {
+            "systems": len(self._labels),
+            "stale": len(self._stale),
+            "scrapes": self.scrapes,
+            "rendered": self.rendered,
+        }
@@ -3,7 +3,7 @@ import dataclasses
 import uuid
 
 
-@dataclass
+@dataclass(slots=True)
 class SystemOS:
     system: str
     release: str
@@ -11,26 +11,26 @@ class SystemOS:
     machine: str
     processor: str
 
-@dataclass
+@dataclass(slots=True)
 class SystemCPU:
     physical_cores: int
     logical_cores: int
     max_frequency_mhz: int
     usage_pct: float = 0.0
 
-@dataclass
+@dataclass(slots=True)
 class SystemMemory:
     total_gib: float
     used_gib: float = 0.0
 
-@dataclass
+@dataclass(slots=True)
 class SystemNetwork:
     hostname: str
     fqdn: str
     public_ip: str
     interfaces: dict[str, list[str]]  # if_name: list of ip’s
 
-@dataclass
+@dataclass(slots=True)
 class SystemDisk:
     device: str
     mountpoint: str
@@ -38,7 +38,7 @@ class SystemDisk:
     total_gib: float
     used_gib: float = 0.0
 
-@dataclass
+@dataclass(slots=True)
 class SystemService:
     name: str
     running: bool = False
@@ -57,7 +57,7 @@ class EventType:
     MEMORY = "memory"
     CPU = "cpu"
 
-@dataclass
+@dataclass(slots=True)
 class Event:
     level: EventLevel
     type: EventType
@@ -84,7 +84,7 @@ class SystemType:
     LAPTOP = "laptop"
     MOBILE = "mobile"
 
-@dataclass
+@dataclass(slots=True)
 class System:
     id: str
     name: str
@@ -115,14 +115,14 @@ class SiteType:
     DATACENTER = "datacenter"
     CLOUD = "cloud"
 
-@dataclass
+@dataclass(slots=True)
 class Site:
     name: str
     type: SiteType
     geoname: str
     systems: list[System]
 
-@dataclass
+@dataclass(slots=True)
 class Provider:
     name: str
     sites: list[Site]
@@ -135,8 +135,20 @@ model_registry = {
     "SystemMemory": SystemMemory,
     "SystemNetwork": SystemNetwork,
     "SystemDisk": SystemDisk,
+    "SystemService": SystemService,
     "Event": Event,
     "System": System,
     "Site": Site,
     "Provider": Provider,
-}
\ No newline at end of file
+}
+
+# low-cardinality string fields: interned when decoded or received from an
+# agent, so that thousands of systems share one copy of each value
+interned_fields = {
+    SystemOS: ("system", "release", "version", "machine", "processor"),
+    SystemDisk: ("device", "mountpoint", "fstype"),
+    SystemService: ("name", "status"),
+    Event: ("level", "type"),
+    System: ("type", "group"),
+    Site: ("type",),
+}
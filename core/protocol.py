@@ -0,0 +1,104 @@
+import json
+
+from models import SystemNetwork, SystemService
+from util import intern_str, intern_strings, json_loads
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# ---------------------------------------------------------------------- #
+#  Agent protocol versions                                               #
+# ---------------------------------------------------------------------- #
+#
+#   1  every usage_info carries the full network block and the full
+#      watched_services list.
+#   2  negotiated with {"type": "hello", "protocol": [1, 2]}, answered with
+#      {"type": "hello", "protocol": 2}. The agent sends a full usage_info
+#      with a "seq" as the baseline, then usage_delta messages with the
+#      following sequence numbers:
+#
+#        {"type": "usage_delta", "system_id": ..., "timestamp": ..., "seq": n,
+#         "usage": {"cpu_pct": ..., "mem_used_gib": ..., "disks": {device: used_gib},
+#                   "network": {changed fields, "interfaces": {name: value or null}}},
+#         "services": {name: {"running": ..., "status": ...} or null}}
+#
+#      network and services hold only what changed since the previous
+#      message and may be left out, null removes an interface or service.
+#      A delta that doesn't follow the last sequence number is dropped and
+#      answered with {"type": "resync", "seq": n}, after which the agent
+#      sends a full usage_info again.
+
+# Framing: an agent sends either text frames of JSON or binary frames of
+# MessagePack holding the same messages, and gets its replies in the
+# framing of its first message. Either can be compressed with
+# permessage-deflate, which Hypercorn negotiates when the agent offers it.
+
+VERSIONS = (1, 2)
+_NETWORK_FIELDS = ("hostname", "fqdn", "public_ip")
+
+
+def negotiate(offered) -> int:
+    """The highest version both sides support, 1 if the agent offers nothing usable."""
+    common = [v for v in offered if v in VERSIONS] if isinstance(offered, list) else []
+    return max(common, default=1)
+
+
+def decode_message(frame: str | bytes) -> dict:
+    if isinstance(frame, str):
+        return json_loads(frame)
+    if msgpack is None:
+        raise ValueError("Binary agent messages need the msgpack package.")
+    return msgpack.unpackb(frame)
+
+
+def encode_message(message: dict, binary: bool) -> str | bytes:
+    return msgpack.packb(message) if binary else json.dumps(message)
+
+
+def apply_network(network: SystemNetwork, delta: dict) -> bool:
+    """Apply a network delta in place, returns whether anything changed."""
+    changed = False
+    for field in _NETWORK_FIELDS:
+        if field in delta and getattr(network, field) != delta[field]:
+            setattr(network, field, delta[field])
+            changed = True
+
+    interfaces = delta.get("interfaces")
+    if interfaces:
+        for name, value in interfaces.items():
+            if value is None:
+                if network.interfaces.pop(name, None) is not None:
+                    changed = True
+            elif network.interfaces.get(name) != value:
+                network.interfaces[intern_str(name)] = value
+                changed = True
+    return changed
+
+
+def apply_services(services: list[SystemService], delta: dict) -> bool:
+    """Apply a watched-services delta in place, returns whether anything changed."""
+    changed = False
+    for name, fields in delta.items():
+        index = next((i for i, service in enumerate(services) if service.name == name), None)
+        if fields is None:
+            if index is not None:
+                del services[index]
+                changed = True
+        elif index is None:
+            services.append(intern_strings(SystemService(
+                name=name,
+                running=fields.get("running", False),
+                status=fields.get("status", ""),
+            )))
+            changed = True
+        else:
+            service = services[index]
+            running = fields.get("running", service.running)
+            status = fields.get("status", service.status)
+            if running != service.running or status != service.status:
+                service.running = running
+                service.status = intern_str(status)
+                changed = True
+    return changed
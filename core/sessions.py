@@ -0,0 +1,192 @@
+import asyncio
+
+from instrument import INSTRUMENTS
+from log import get_logger
+from protocol import encode_message
+
+logger = get_logger("agent")
+
+
+class AgentSession:
+    """
+    One agent WebSocket connection: the system it reported itself as, and
+    the outbound queue its sender task drains into the socket.
+    """
+
+    def __init__(self, ws, queue_size: int):
+        self.ws = ws
+        self.remote_addr = ws.remote_addr
+        self.system_id: str | None = None
+        self.closed = False
+        self.received = 0
+        # agent protocol version and the sequence number of its last usage message
+        self.protocol = 1
+        self.seq: int | None = None
+        self.resync_requested = False
+        # framing, set from the first message
+        self.binary: bool | None = None
+        self.deflate = "permessage-deflate" in ws.headers.get("Sec-WebSocket-Extensions", "")
+        self._queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self._sender: asyncio.Task | None = None
+
+
+class SessionRegistry:
+    """
+    The agent sessions of this worker, indexed both ways: session to system
+    ID through ``AgentSession.system_id`` and system ID to session here.
+
+    Messages for an agent are put into its session's bounded queue and
+    written by a sender task per session, so sending never waits for a
+    slow socket. A message that doesn't fit into the queue, or is still
+    queued when the socket closes, is dropped and counted.
+    """
+
+    def __init__(self, queue_size: int = 32):
+        self.queue_size = queue_size
+        self._sessions: set[AgentSession] = set()
+        self.frames = {"json": 0, "msgpack": 0}
+        self._by_system: dict[str, AgentSession] = {}
+        # systems that had a session here before, to count reconnects
+        self._seen: set[str] = set()
+
+        self.sent = 0
+        self.dropped = 0
+        self.send_errors = 0
+        self.replaced = 0
+        self.resyncs = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def open(self, ws) -> AgentSession:
+        session = AgentSession(ws, self.queue_size)
+        session._sender = asyncio.get_running_loop().create_task(self._send_loop(session))
+        self._sessions.add(session)
+        return session
+
+    async def close(self, session: AgentSession) -> str | None:
+        """Forget *session*, returns the system ID it still stood for, if any."""
+        session.closed = True
+        self._sessions.discard(session)
+        session._sender.cancel()
+        await asyncio.gather(session._sender, return_exceptions=True)
+        self.dropped += session._queue.qsize()
+
+        system_id, session.system_id = session.system_id, None
+        if system_id is not None and self._by_system.get(system_id) is session:
+            del self._by_system[system_id]
+            return system_id
+        return None
+
+    def bind(self, session: AgentSession, system_id: str) -> bool:
+        """Map *system_id* to *session*, returns False if it already was."""
+        if session.system_id == system_id and self._by_system.get(system_id) is session:
+            return False
+
+        if session.system_id is not None and self._by_system.get(session.system_id) is session:
+            del self._by_system[session.system_id]
+
+        previous = self._by_system.get(system_id)
+        if previous is not None:
+            # the agent reconnected before its old socket was closed, which
+            # then must not mark the system as disconnected
+            previous.system_id = None
+            self.replaced += 1
+
+        session.system_id = system_id
+        self._by_system[system_id] = session
+        if system_id in self._seen:
+            INSTRUMENTS.count("reconnects_total")
+        self._seen.add(system_id)
+        return True
+
+    def rename(self, system_id: str, new_id: str) -> bool:
+        """Follow a system ID change, returns whether an agent session had it."""
+        session = self._by_system.pop(system_id, None)
+        if session is None:
+            return False
+        session.system_id = new_id
+        self._by_system[new_id] = session
+        return True
+
+    def get(self, system_id: str) -> AgentSession | None:
+        return self._by_system.get(system_id)
+
+    def send(self, session: AgentSession, message: dict) -> bool:
+        if session.closed:
+            self.dropped += 1
+            return False
+        try:
+            session._queue.put_nowait(encode_message(message, bool(session.binary)))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    def send_to(self, system_id: str, message: dict) -> bool:
+        """Queue *message* for the agent of *system_id* if it is connected here."""
+        session = self._by_system.get(system_id)
+        if session is None:
+            return False
+        return self.send(session, message)
+
+    def check_sequence(self, session: AgentSession, type: str, seq: int | None) -> bool:
+        """
+        Follow the sequence numbers of an agent's usage messages, in the
+        order the socket delivered them. Returns False for a delta that
+        doesn't follow the last one, or arrives while a resync is pending,
+        and must be dropped, and asks the agent for a full usage_info
+        instead.
+        """
+        if type == "usage_delta":
+            if session.protocol < 2 or session.seq is None or session.resync_requested or seq != session.seq + 1:
+                self.request_resync(session)
+                return False
+            session.seq = seq
+        elif type == "usage_info" and seq is not None:
+            session.seq = seq
+            session.resync_requested = False
+        return True
+
+    def apply_failed(self, session: AgentSession, type: str):
+        """
+        A usage message was accepted but couldn't be applied, so the
+        server's base for the following deltas is off: ask for a full
+        usage_info and drop deltas until it arrives.
+        """
+        if session.protocol >= 2 and type in ("usage_info", "usage_delta"):
+            self.request_resync(session)
+
+    def request_resync(self, session: AgentSession):
+        """Ask the agent for a full usage_info, once per gap in its sequence."""
+        if not session.resync_requested:
+            session.resync_requested = True
+            self.resyncs += 1
+            self.send(session, {"type": "resync", "seq": session.seq})
+
+    async def _send_loop(self, session: AgentSession):
+        while True:
+            message = await session._queue.get()
+            try:
+                await session.ws.send(message)
+            except Exception as e:
+                # the receive loop notices the closed socket and closes the session
+                self.send_errors += 1
+                logger.warning("Error sending to agent: %s", e, extra={"system_id": session.system_id, "remote_addr": session.remote_addr})
+                return
+            self.sent += 1
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "bound": len(self._by_system),
+            "queued": sum(session._queue.qsize() for session in self._sessions),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "send_errors": self.send_errors,
+            "replaced": self.replaced,
+            "resyncs": self.resyncs,
+            "deflate": sum(session.deflate for session in self._sessions),
+            "binary": sum(bool(session.binary) for session in self._sessions),
+            "frames": self.frames,
+        }
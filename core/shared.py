@@ -0,0 +1,345 @@
+from abc import ABC, abstractmethod
+import asyncio
+import json
+import uuid
+from typing import Awaitable, Callable
+
+import redis.asyncio as aioredis
+
+from log import get_logger
+
+logger = get_logger("cluster")
+
+
+class SharedState(ABC):
+    """
+    Coordination between dashboard worker processes. It
+
+    * replicates the journal lines of every mutation to the other workers,
+      so that each one keeps a complete replica of the system state,
+    * tracks which worker holds the socket of each agent and routes
+      commands for that agent there,
+    * elects the single primary worker that persists data.json, the
+      journal and the history.
+
+    Replication is fire-and-forget, so a worker that starts late or
+    reconnects asks the primary for its full state (``on_snapshot``) and
+    applies that before the records that follow.
+
+    Subclasses provide the transport: LocalState within one process, for a
+    single worker or tests, and RedisState across processes.
+    """
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.primary = False
+
+        # set by the Dashboard
+        self.on_records: Callable[[list[str]], None] | None = None
+        self.on_command: Callable[[str, dict], Awaitable[None]] | None = None
+        self.on_primary: Callable[[bool], None] | None = None
+        self.on_snapshot: Callable[[], str] | None = None
+
+        self._agents: set[str] = set()
+        self._outbox: list[str] = []
+        self._scheduled = False
+
+        self.published = 0
+        self.received = 0
+        self.routed = 0
+        self.syncs = 0
+
+    def publish(self, line: str):
+        """Queue a journal line for the other workers, sent once the current handler yields."""
+        self._outbox.append(line)
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush_outbox)
+
+    def _flush_outbox(self):
+        self._scheduled = False
+        lines, self._outbox = self._outbox, []
+        if lines:
+            self.published += len(lines)
+            self._send(lines)
+
+    def _receive(self, lines: list[str]):
+        self.received += len(lines)
+        if self.on_records:
+            self.on_records(lines)
+
+    def _set_primary(self, primary: bool):
+        if primary != self.primary:
+            self.primary = primary
+            logger.info("Worker %s %s the primary", self.worker_id, "is now" if primary else "is no longer")
+            if self.on_primary:
+                self.on_primary(primary)
+
+    async def _deliver(self, system_id: str, command: dict):
+        if self.on_command:
+            await self.on_command(system_id, command)
+
+    def _snapshot(self) -> list[str]:
+        """The full state as records, for a worker that (re)joins."""
+        self.syncs += 1
+        return [self.on_snapshot()] if self.on_snapshot else []
+
+    @abstractmethod
+    def _send(self, lines: list[str]):
+        ...
+
+    @abstractmethod
+    async def start(self):
+        ...
+
+    @abstractmethod
+    async def stop(self):
+        ...
+
+    @abstractmethod
+    async def claim_agent(self, system_id: str):
+        """Record that this worker holds the socket of *system_id*."""
+
+    @abstractmethod
+    async def release_agent(self, system_id: str):
+        ...
+
+    @abstractmethod
+    async def send_command(self, system_id: str, command: dict) -> bool:
+        """Forward *command* to the agent of *system_id*, wherever it is connected."""
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "worker_id": self.worker_id,
+            "primary": self.primary,
+            "agents": len(self._agents),
+            "published": self.published,
+            "received": self.received,
+            "routed": self.routed,
+            "syncs": self.syncs,
+        }
+
+
+class LocalHub:
+    """The in-process stand-in for Redis that LocalState workers share."""
+
+    def __init__(self):
+        self.workers: dict[str, "LocalState"] = {}
+        self.agents: dict[str, str] = {}
+        self.primary: str | None = None
+
+
+class LocalState(SharedState):
+    def __init__(self, hub: LocalHub | None = None):
+        super().__init__()
+        self.hub = hub or LocalHub()
+
+    def _send(self, lines: list[str]):
+        for worker_id, worker in self.hub.workers.items():
+            if worker_id != self.worker_id:
+                asyncio.get_running_loop().call_soon(worker._receive, lines)
+
+    async def start(self):
+        self.hub.workers[self.worker_id] = self
+        if self.hub.primary is None:
+            self.hub.primary = self.worker_id
+            self._set_primary(True)
+        else:
+            lines = self.hub.workers[self.hub.primary]._snapshot()
+            if lines:
+                self._receive(lines)
+
+    async def stop(self):
+        self.hub.workers.pop(self.worker_id, None)
+        for system_id in list(self._agents):
+            await self.release_agent(system_id)
+        if self.hub.primary == self.worker_id:
+            self._set_primary(False)
+            self.hub.primary = next(iter(self.hub.workers), None)
+            if self.hub.primary:
+                self.hub.workers[self.hub.primary]._set_primary(True)
+
+    async def claim_agent(self, system_id: str):
+        self._agents.add(system_id)
+        self.hub.agents[system_id] = self.worker_id
+
+    async def release_agent(self, system_id: str):
+        self._agents.discard(system_id)
+        if self.hub.agents.get(system_id) == self.worker_id:
+            del self.hub.agents[system_id]
+
+    async def send_command(self, system_id: str, command: dict) -> bool:
+        worker = self.hub.workers.get(self.hub.agents.get(system_id))
+        if worker is None:
+            return False
+        if worker is not self:
+            self.routed += 1
+        await worker._deliver(system_id, command)
+        return True
+
+
+class RedisState(SharedState):
+    """
+    Redis transport: journal lines go out on one pub/sub channel, commands
+    and sync requests on a channel per worker, and the primary answers a
+    sync request on the requester's sync channel. Agent ownership and the
+    primary lease are keys with a TTL, refreshed while the worker is alive,
+    so that a crashed worker's claims expire by themselves.
+
+    A lost subscription is retried with exponential backoff, and every
+    (re)subscription requests a sync, since whatever was published in
+    between is gone.
+    """
+
+    PREFIX = "sysmon:"
+    RECORDS = PREFIX + "records"
+    RETRY_MIN = 0.5
+    RETRY_MAX = 30
+
+    # delete a key only while it still belongs to this worker
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    # extend the lease if this worker holds it, take it if nobody does; returns the holder
+    _CLAIM = (
+        "local owner = redis.call('get', KEYS[1]) "
+        "if owner == ARGV[1] then redis.call('expire', KEYS[1], ARGV[2]) return owner end "
+        "if not owner then redis.call('set', KEYS[1], ARGV[1], 'EX', ARGV[2]) return ARGV[1] end "
+        "return owner"
+    )
+
+    def __init__(self, redis: aioredis.Redis, lease: int = 15):
+        super().__init__()
+        self.redis = redis
+        self.lease = lease
+        self._channel = f"{self.PREFIX}worker:{self.worker_id}"
+        self._sync_channel = self._channel + ":sync"
+        self._primary_key = self.PREFIX + "primary"
+        self._sends: asyncio.Queue[str] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self.reconnects = 0
+
+    def _agent_key(self, system_id: str) -> str:
+        return f"{self.PREFIX}agent:{system_id}"
+
+    def _send(self, lines: list[str]):
+        # first line names the sender, the rest are journal lines
+        self._sends.put_nowait(self.worker_id + "\n" + "".join(lines))
+
+    async def _send_loop(self):
+        while True:
+            payload = await self._sends.get()
+            try:
+                await self.redis.publish(self.RECORDS, payload)
+            except Exception as e:
+                logger.error("Error publishing records: %s", e)
+
+    async def _listen_loop(self):
+        delay = self.RETRY_MIN
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.RECORDS, self._channel, self._sync_channel)
+                delay = self.RETRY_MIN
+                await self._request_sync()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        await self._handle(message)
+                raise ConnectionError("subscription ended")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.reconnects += 1
+                logger.error("Replication subscription lost, retrying in %.1fs: %s", delay, e)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.RETRY_MAX)
+
+    async def _handle(self, message: dict):
+        try:
+            if message["channel"] in (self.RECORDS, self._sync_channel):
+                sender, _, body = message["data"].partition("\n")
+                if sender != self.worker_id:
+                    self._receive(body.splitlines(keepends=True))
+                return
+            data = json.loads(message["data"])
+            if "sync" in data:
+                lines = self._snapshot()
+                if lines:
+                    await self.redis.publish(f"{self.PREFIX}worker:{data['sync']}:sync", self.worker_id + "\n" + "".join(lines))
+            else:
+                await self._deliver(data["system_id"], data["command"])
+        except Exception as e:
+            logger.error("Error handling message on %s: %s", message["channel"], e)
+
+    async def _request_sync(self):
+        """Ask the primary for its state, unless there is none yet or it's this worker."""
+        primary = await self.redis.get(self._primary_key)
+        if primary and primary != self.worker_id:
+            await self.redis.publish(f"{self.PREFIX}worker:{primary}", json.dumps({"sync": self.worker_id}))
+
+    async def _lease_loop(self):
+        while True:
+            try:
+                await self._renew()
+            except Exception as e:
+                logger.error("Error renewing leases: %s", e)
+            await asyncio.sleep(self.lease / 3)
+
+    async def _renew(self):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for system_id in self._agents:
+                pipe.set(self._agent_key(system_id), self.worker_id, ex=self.lease)
+            # compare and extend in one step, so a lease that expired in
+            # between is never extended on behalf of another worker
+            pipe.eval(self._CLAIM, 1, self._primary_key, self.worker_id, self.lease)
+            results = await pipe.execute()
+
+        self._set_primary(results[-1] == self.worker_id)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self._send_loop()),
+            loop.create_task(self._listen_loop()),
+            loop.create_task(self._lease_loop()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        try:
+            for system_id in list(self._agents):
+                await self.release_agent(system_id)
+            await self.redis.eval(self._RELEASE, 1, self._primary_key, self.worker_id)
+        except Exception as e:
+            logger.error("Error releasing leases: %s", e)
+        self._set_primary(False)
+
+    async def claim_agent(self, system_id: str):
+        self._agents.add(system_id)
+        await self.redis.set(self._agent_key(system_id), self.worker_id, ex=self.lease)
+
+    async def release_agent(self, system_id: str):
+        self._agents.discard(system_id)
+        await self.redis.eval(self._RELEASE, 1, self._agent_key(system_id), self.worker_id)
+
+    def stats(self) -> dict:
+        return super().stats() | {"reconnects": self.reconnects}
+
+    async def send_command(self, system_id: str, command: dict) -> bool:
+        owner = await self.redis.get(self._agent_key(system_id))
+        if owner is None:
+            return False
+        if owner == self.worker_id:
+            await self._deliver(system_id, command)
+        else:
+            self.routed += 1
+            await self.redis.publish(f"{self.PREFIX}worker:{owner}", json.dumps({"system_id": system_id, "command": command}))
+        return True
@@ -0,0 +1,207 @@
+import json
+import os
+import struct
+from typing import BinaryIO
+
+from models import Event, Provider
+from util import JSON_BACKEND, atomic_write, dataclass_to_primitive, gc_paused, json_dumps, json_loads, primitive_to_dataclass
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+FORMATS = ("json", "msgpack")
+EXTENSIONS = {"json": ".json", "msgpack": ".bin"}
+
+# ---------------------------------------------------------------------- #
+#  Binary snapshot layout                                                #
+# ---------------------------------------------------------------------- #
+#
+#   magic "SMDB", u16 version, u64 generation, u32 provider count, then
+#   per provider: frame(provider without sites), u32 site count,
+#     per site: frame(site without systems), u32 system count,
+#       per system: frame(system without events), frame(events)
+#
+# a frame is a u32 length followed by that many bytes of MessagePack of
+# the same plain dicts/lists the JSON snapshot holds, all little-endian.
+# Events come in their own frame, so a load can keep them as raw bytes
+# and decode them only when the system's events are first needed.
+
+MAGIC = b"SMDB"
+VERSION = 1
+_HEADER = struct.Struct("<4sHQ")
+_U32 = struct.Struct("<I")
+_EMPTY_EVENTS = b"\x90"  # MessagePack of []
+
+
+def dumps_chunked(value, depth: int) -> str:
+    """
+    Same output as ``json.dumps(value)``, but the outer *depth* levels of
+    lists/dicts are assembled in Python so the GIL is released between
+    chunks instead of being held for one long C call.
+    """
+    if depth > 0 and isinstance(value, list):
+        return "[" + ", ".join(dumps_chunked(v, depth - 1) for v in value) + "]"
+    if depth > 0 and isinstance(value, dict):
+        return "{" + ", ".join(f"{json.dumps(k)}: {dumps_chunked(v, depth - 1)}" for k, v in value.items()) + "}"
+    return json.dumps(value)
+
+
+def require_format(format: str):
+    if format not in FORMATS:
+        raise ValueError(f"Unknown snapshot format {format}, expected one of {', '.join(FORMATS)}.")
+    if format == "msgpack" and msgpack is None:
+        raise ValueError("The msgpack snapshot format needs the msgpack package.")
+
+
+def detect_format(path: str) -> str:
+    with open(path, 'rb') as f:
+        return "msgpack" if f.read(len(MAGIC)) == MAGIC else "json"
+
+
+def _frame(data: bytes) -> bytes:
+    return _U32.pack(len(data)) + data
+
+
+def dump_binary(generation: int, providers: list[dict]) -> bytes:
+    """Encode a snapshot of plain providers (as taken by SystemDB.snapshot())."""
+    pack = msgpack.Packer().pack
+    parts = [_HEADER.pack(MAGIC, VERSION, generation), _U32.pack(len(providers))]
+    for provider in providers:
+        sites = provider["sites"]
+        parts.append(_frame(pack({k: v for k, v in provider.items() if k != "sites"})))
+        parts.append(_U32.pack(len(sites)))
+        for site in sites:
+            systems = site["systems"]
+            parts.append(_frame(pack({k: v for k, v in site.items() if k != "systems"})))
+            parts.append(_U32.pack(len(systems)))
+            for system in systems:
+                parts.append(_frame(pack({k: v for k, v in system.items() if k != "events"})))
+                parts.append(_frame(pack(system.get("events", []))))
+    return b"".join(parts)
+
+
+def _read_exact(f: BinaryIO, n: int) -> bytes:
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError("Snapshot file is truncated.")
+    return data
+
+
+def _read_u32(f: BinaryIO) -> int:
+    return _U32.unpack(_read_exact(f, 4))[0]
+
+
+def _read_frame(f: BinaryIO) -> bytes:
+    return _read_exact(f, _read_u32(f))
+
+
+def load_binary(f: BinaryIO, lazy_events: dict[str, bytes] | None = None) -> tuple[int, list[Provider]]:
+    """
+    Read a binary snapshot frame by frame. With *lazy_events*, each
+    system's events are not decoded but stored there as raw frames by
+    system ID, for decode_events().
+    """
+    magic, version, generation = _HEADER.unpack(_read_exact(f, _HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("Not a binary snapshot.")
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary snapshot version {version}.")
+
+    unpackb = msgpack.unpackb
+    providers = []
+    for _ in range(_read_u32(f)):
+        provider_data = unpackb(_read_frame(f))
+        provider_data["sites"] = []
+        provider = primitive_to_dataclass(provider_data)
+        for _ in range(_read_u32(f)):
+            site_data = unpackb(_read_frame(f))
+            site_data["systems"] = []
+            site = primitive_to_dataclass(site_data)
+            for _ in range(_read_u32(f)):
+                system = primitive_to_dataclass(unpackb(_read_frame(f)))
+                events = _read_frame(f)
+                if lazy_events is None:
+                    system.events = decode_events(events)
+                elif events != _EMPTY_EVENTS:
+                    lazy_events[system.id] = events
+                site.systems.append(system)
+            provider.sites.append(site)
+        providers.append(provider)
+    return generation, providers
+
+
+def decode_events(frame: bytes) -> list[Event]:
+    return primitive_to_dataclass(msgpack.unpackb(frame))
+
+
+def read_snapshot(path: str, lazy_events: dict[str, bytes] | None = None) -> tuple[int, list[Provider]]:
+    """Load a snapshot in either format, returns its generation and providers."""
+    format = detect_format(path)
+    with open(path, 'rb') as f, gc_paused():
+        if format == "msgpack":
+            require_format(format)
+            return load_binary(f, lazy_events)
+
+        data = primitive_to_dataclass(json_loads(f.read()))
+    if isinstance(data, list):
+        # written before snapshots carried a generation
+        return 0, data
+    return data["generation"], data["providers"]
+
+
+def merge_deferred_events(providers: list[dict], frames: dict[str, bytes]) -> list[dict]:
+    """
+    Plain providers with the events still held as raw frames by
+    load_binary() put in front of each system's own, copying only the
+    dicts on the way to the systems it changes.
+    """
+    def merged(system: dict) -> dict:
+        frame = frames.get(system["id"])
+        if frame is None:
+            return system
+        return {**system, "events": msgpack.unpackb(frame) + system.get("events", [])}
+
+    return [
+        {**provider, "sites": [
+            {**site, "systems": [merged(system) for system in site["systems"]]}
+            for site in provider["sites"]
+        ]}
+        for provider in providers
+    ]
+
+
+def write_snapshot(path: str, format: str, generation: int, providers: list[dict], deferred_events: dict[str, bytes] | None = None):
+    """
+    Write plain providers (as taken by SystemDB.snapshot()) atomically,
+    with the *deferred_events* frames of systems that haven't decoded them.
+    """
+    if deferred_events:
+        providers = merge_deferred_events(providers, deferred_events)
+    if format == "msgpack":
+        atomic_write(path, dump_binary(generation, providers))
+        return
+
+    if JSON_BACKEND == "json":
+        # chunked down to single systems: providers > provider > sites > site > systems
+        providers_json = dumps_chunked(providers, 5)
+    else:
+        # the faster backends get through the whole tree in a few ms
+        providers_json = json_dumps(providers)
+    atomic_write(path, f'{{"generation": {generation}, "providers": {providers_json}}}')
+
+
+def convert(src: str, dst: str, format: str | None = None) -> str:
+    """
+    Rewrite the snapshot *src* as *dst*, in *format* or the one implied by
+    the extension of *dst*. Returns the format written.
+    """
+    if format is None:
+        format = "msgpack" if os.path.splitext(dst)[1] == EXTENSIONS["msgpack"] else "json"
+    require_format(format)
+
+    generation, providers = read_snapshot(src)
+    write_snapshot(dst, format, generation, dataclass_to_primitive(providers))
+    return format
@@ -1,14 +1,64 @@
 const CACHE = {};
-const PATH  = `${window.APP_ROOT || ''}/static/system_images/`;   // set APP_ROOT in Jinja if you use one
+const PATH  = `${window.APP_ROOT || ''}/icon/`;   // set APP_ROOT in Jinja if you use one
 
-export function loadIcon(type, variation='on') {
-    const key = `${type}_${variation}`;
+// variation may be a comma separated stack (bottom → top), e.g. "on,off"
+export function loadIcon(type, variation='on', size=128, format='webp') {
+    const key = `${type}_${variation}_${size}_${format}`;
     if (!CACHE[key]) {
         CACHE[key] = new Promise(res => {
             const img = new Image();
-            img.src  = `${PATH}${key}.png`;
+            img.src  = `${PATH}${type}?v=${encodeURIComponent(variation)}&size=${size}&format=${format}`;
             img.onload = () => res(img);
         });
     }
     return CACHE[key];
 }
+
+// ------------------------------------------------------------------ //
+//  Sprite atlas (built by `python core build-atlas` or on startup)   //
+// ------------------------------------------------------------------ //
+const ATLAS_PATH = `${window.APP_ROOT || ''}/static/atlas/`;
+let ATLAS = null;
+
+// resolves to null while the server hasn't built the atlas yet
+export function loadAtlas() {
+    if (!ATLAS) {
+        ATLAS = fetch(`${ATLAS_PATH}icons.json`)
+            .then(res => res.ok ? res.json() : null)
+            .then(index => index && new Promise(res => {
+                const img = new Image();
+                img.src = `${ATLAS_PATH}${index.image}`;
+                img.onload = () => res({ index, img });
+                img.onerror = () => res(null);
+            }))
+            .catch(() => null)
+            .then(atlas => {
+                if (!atlas) ATLAS = null;  // try again next time
+                return atlas;
+            });
+    }
+    return ATLAS;
+}
+
+// a stack of `depth` identical `variation` layers, as in SystemImage
+export async function atlasTile(type, variation='on', depth=1, size=128) {
+    const atlas = await loadAtlas();
+    const tile = atlas && atlas.index.tiles[`${type}/${variation}/${depth}@${size}`];
+    return tile ? { img: atlas.img, width: atlas.index.width, height: atlas.index.height, ...tile } : null;
+}
+
+export async function drawIcon(ctx, x, y, type, variation='on', depth=1, size=128) {
+    const tile = await atlasTile(type, variation, depth, size);
+    if (tile) ctx.drawImage(tile.img, tile.x, tile.y, tile.w, tile.h, x, y, tile.w, tile.h);
+}
+
+// CSS for an element showing the tile as its background, scaled to `display`
+// px, so a whole fleet needs one image request instead of one per system
+export async function iconStyle(type, variation='on', depth=1, size=128, display=size) {
+    const tile = await atlasTile(type, variation, depth, size);
+    if (!tile) return '';
+    const scale = display / size;
+    return `width:${display}px;height:${display}px;` +
+        `background:url(${tile.img.src}) -${tile.x * scale}px -${tile.y * scale}px / ` +
+        `${tile.width * scale}px ${tile.height * scale}px no-repeat;`;
+}
@@ -0,0 +1,149 @@
+import asyncio
+import dataclasses
+import json
+
+from db import SystemDB
+from instrument import INSTRUMENTS
+from models import System
+
+
+DASHBOARD = None  # topic of the fleet-wide dashboard stream
+
+
+class Broadcaster:
+    """
+    Pushes system changes to browser subscribers (``/ws/dashboard`` and
+    ``/ws/system``).
+
+    SystemDB reports every changed system; changes are coalesced until the
+    current handler yields to the loop, serialized once and then put into
+    a bounded queue per subscriber. A subscriber whose queue is full gets
+    its backlog replaced by a single resync message instead of blocking
+    agent ingestion.
+    """
+
+    RESYNC = json.dumps({"type": "resync"})
+
+    def __init__(self, db: SystemDB, queue_size: int = 64):
+        self.db = db
+        self.queue_size = queue_size
+        self._subscribers: dict[str | None, set[asyncio.Queue]] = {}
+        self._topic_of: dict[asyncio.Queue, str | None] = {}
+        self._changed: set[str] = set()
+        self._structure_changed = False
+        self._scheduled = False
+        # last summary sent to dashboards per system, to send only what changed
+        self._sent: dict[str, dict] = {}
+
+        self.published = 0
+        self.dropped = 0
+
+        db.listeners.append(self.system_changed)
+
+    def subscribe(self, topic: str | None = DASHBOARD) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(topic, set()).add(queue)
+        self._topic_of[queue] = topic
+        if topic is DASHBOARD:
+            # changes made while nobody listened never updated _sent
+            self._sent.clear()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        # by the queue, its topic may have been renamed since it subscribed
+        topic = self._topic_of.pop(queue, DASHBOARD)
+        subscribers = self._subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[topic]
+
+    def rename(self, old_id: str, new_id: str):
+        """Move the subscribers of a renamed system to its new ID and tell them."""
+        subscribers = self._subscribers.pop(old_id, None)
+        if not subscribers:
+            return
+        self._subscribers.setdefault(new_id, set()).update(subscribers)
+        for queue in subscribers:
+            self._topic_of[queue] = new_id
+        self._publish(new_id, json.dumps({"type": "renamed", "id": new_id}))
+
+    def system_changed(self, system_id: str | None):
+        """SystemDB listener, *system_id* is None for structural changes."""
+        if not self._subscribers:
+            return
+
+        if system_id is None:
+            self._structure_changed = True
+        else:
+            self._changed.add(system_id)
+
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    @staticmethod
+    def summary(system: System) -> dict:
+        """The fields the dashboard tables show."""
+        return {
+            "cpu": system.cpu.usage_pct,
+            "mem_used": system.memory.used_gib,
+            "mem_total": system.memory.total_gib,
+            "connected": system.connected,
+            "warning": system.warning,
+            "critical": system.critical,
+        }
+
+    def _flush(self):
+        self._scheduled = False
+        changed, self._changed = self._changed, set()
+
+        if self._structure_changed:
+            self._structure_changed = False
+            self._sent.clear()
+            self._publish(DASHBOARD, self.RESYNC)
+            # edits, removals and trees replaced by another worker come without system IDs
+            changed = {topic for topic in self._subscribers if topic is not DASHBOARD}
+        elif DASHBOARD in self._subscribers:
+            diffs = []
+            for system_id in changed:
+                system = self.db.get_system(system_id)
+                if not system:
+                    continue
+                summary = self.summary(system)
+                last = self._sent.get(system_id, {})
+                diff = {key: value for key, value in summary.items() if last.get(key) != value}
+                if diff:
+                    self._sent[system_id] = summary
+                    diffs.append({"id": system_id, **diff})
+            if diffs:
+                self._publish(DASHBOARD, json.dumps({"type": "update", "epoch": self.db.epoch, "revision": self.db.revision, "systems": diffs}))
+
+        for system_id in changed:
+            if system_id in self._subscribers:
+                system = self.db.get_system(system_id)
+                if system:
+                    self.db.ensure_events(system)
+                    self._publish(system_id, json.dumps({"type": "system", "system": dataclasses.asdict(system)}))
+                else:
+                    self._publish(system_id, json.dumps({"type": "removed"}))
+
+    def _publish(self, topic: str | None, message: str):
+        INSTRUMENTS.observe("json_encode_bytes", len(message), ("kind", "stream"))
+        for queue in self._subscribers.get(topic, ()):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # too slow to keep up: drop the backlog, let it reload once
+                self.dropped += queue.qsize()
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.RESYNC)
+            self.published += 1
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,453 @@
+import asyncio
+import atexit
+import os
+import struct
+import sys
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from log import get_logger
+from util import atomic_write
+
+logger = get_logger("history")
+
+
+class Ring:
+    """
+    Fixed-capacity ring buffer of samples, stored column-wise in arrays:
+    one ``uint32`` column of timestamps plus *columns* ``float32`` columns.
+    Memory per ring never exceeds ``capacity * (4 + 4 * columns)`` bytes.
+    """
+
+    def __init__(self, capacity: int, columns: int):
+        self.capacity = capacity
+        self.times = array('I')
+        self.columns = [array('f') for _ in range(columns)]
+        self.head = 0  # physical index of the oldest sample once the ring is full
+        # samples appended in total and as of the last save, for incremental saves
+        self.added = 0
+        self.saved = 0
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def append(self, timestamp: int, values: tuple[float, ...]):
+        self.added += 1
+        if len(self.times) < self.capacity:
+            self.times.append(timestamp)
+            for column, value in zip(self.columns, values):
+                column.append(value)
+        else:
+            self.times[self.head] = timestamp
+            for column, value in zip(self.columns, values):
+                column[self.head] = value
+            self.head = (self.head + 1) % self.capacity
+
+    def last_time(self) -> int | None:
+        if not self.times:
+            return None
+        return self.times[self.head - 1]
+
+    def _bisect(self, timestamp: float, right: bool) -> int:
+        """Binary search over the logical (oldest first) order."""
+        lo, hi = 0, len(self.times)
+        n = hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            t = self.times[(self.head + mid) % n]
+            if t < timestamp or (right and t == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def window(self, start: float, end: float) -> list[list]:
+        """Samples with ``start <= t <= end``, found in O(log n + k)."""
+        n = len(self.times)
+        if n == 0:
+            return []
+        lo = self._bisect(start, right=False)
+        hi = self._bisect(end, right=True)
+        points = []
+        for i in range(lo, hi):
+            p = (self.head + i) % n
+            points.append([self.times[p], *(column[p] for column in self.columns)])
+        return points
+
+    def ordered(self) -> tuple[array, list[array]]:
+        """Copies of the columns in logical order."""
+        h = self.head
+        return self.times[h:] + self.times[:h], [c[h:] + c[:h] for c in self.columns]
+
+    def unsaved(self) -> tuple[array, list[array]]:
+        """Copies of the samples appended since the last call, oldest first."""
+        n = min(self.added - self.saved, len(self.times))
+        self.saved = self.added
+        if n == 0:
+            return array('I'), [array('f') for _ in self.columns]
+        times, columns = self.ordered()
+        return times[-n:], [column[-n:] for column in columns]
+
+    def extend(self, times: array, columns: list[array]):
+        """Append samples in bulk, keeping the newest *capacity* of them."""
+        if not times:
+            return
+        own_times, own_columns = self.ordered()
+        own_times += times
+        keep = min(len(own_times), self.capacity)
+        self.times = own_times[len(own_times) - keep:]
+        self.columns = [(own + new)[len(own_times) - keep:] for own, new in zip(own_columns, columns)]
+        self.head = 0
+
+
+class Series:
+    """Raw samples of one metric plus their 1-minute and 1-hour min/avg/max rollups."""
+
+    ROLLUPS = {"1m": 60, "1h": 3600}
+
+    def __init__(self, raw_capacity: int, minute_capacity: int, hour_capacity: int):
+        self.raw = Ring(raw_capacity, 1)
+        self.rollups = {
+            "1m": Ring(minute_capacity, 3),
+            "1h": Ring(hour_capacity, 3),
+        }
+        # open bucket per rollup: [start, min, max, sum, count]
+        self.buckets: dict[str, list | None] = {name: None for name in self.ROLLUPS}
+
+    def add(self, timestamp: int, value: float):
+        last = self.raw.last_time()
+        if last is not None and timestamp < last:
+            return  # rings must stay sorted for the binary search
+
+        self.raw.append(timestamp, (value,))
+        for name, width in self.ROLLUPS.items():
+            start = timestamp - timestamp % width
+            bucket = self.buckets[name]
+            if bucket is None or bucket[0] != start:
+                if bucket is not None:
+                    self.rollups[name].append(bucket[0], self._close(bucket))
+                self.buckets[name] = [start, value, value, value, 1]
+            else:
+                bucket[1] = min(bucket[1], value)
+                bucket[2] = max(bucket[2], value)
+                bucket[3] += value
+                bucket[4] += 1
+
+    @staticmethod
+    def _close(bucket: list) -> tuple[float, float, float]:
+        return bucket[1], bucket[3] / bucket[4], bucket[2]
+
+    def window(self, resolution: str, start: float, end: float) -> list[list]:
+        if resolution == "raw":
+            return self.raw.window(start, end)
+
+        points = self.rollups[resolution].window(start, end)
+        bucket = self.buckets[resolution]
+        if bucket is not None and start <= bucket[0] <= end:
+            # the bucket that is still filling up
+            points.append([bucket[0], *self._close(bucket)])
+        return points
+
+
+class TimeSeriesStore:
+    """
+    In-memory history of usage samples per system and metric (``cpu``,
+    ``memory`` and ``disk:<device>``), persisted to a binary segment file.
+
+    Every save appends only the samples recorded since the previous one,
+    and the file is rewritten in full (compacted) once the appended part
+    outgrows the last full write, or after renames and removals. The
+    arrays are copied on the event loop, packing and writing happen on a
+    dedicated writer thread, as in SystemDB.
+    """
+
+    MAGIC = b"SMTS"
+    VERSION = 2
+
+    def __init__(
+        self,
+        path: str = "history.bin",
+        raw_samples: int = 720,
+        minute_samples: int = 1440,
+        hour_samples: int = 720,
+        save_interval: float = 60,
+    ):
+        self.path = path
+        self.raw_samples = raw_samples
+        self.minute_samples = minute_samples
+        self.hour_samples = hour_samples
+        self.save_interval = save_interval
+        self.series: dict[str, dict[str, Series]] = {}
+        # only one worker process writes the segment file
+        self.persist = True
+        self._saver: asyncio.Task | None = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-writer")
+        # series with samples since the last save
+        self._dirty: set[tuple[str, str]] = set()
+        self._compact_requested = True
+        self._full_bytes = 0
+        self._appended_bytes = 0
+
+        self.compactions = 0
+
+        self.load()
+
+    def _new_series(self) -> Series:
+        return Series(self.raw_samples, self.minute_samples, self.hour_samples)
+
+    def record(self, system_id: str, timestamp: float, metrics: dict[str, float]):
+        system_series = self.series.setdefault(system_id, {})
+        timestamp = int(timestamp)
+        for metric, value in metrics.items():
+            series = system_series.get(metric)
+            if series is None:
+                series = system_series[metric] = self._new_series()
+            series.add(timestamp, value)
+            self._dirty.add((system_id, metric))
+
+    def metrics(self, system_id: str) -> list[str]:
+        return sorted(self.series.get(system_id, {}))
+
+    def pick_resolution(self, system_id: str, metric: str, start: float) -> str:
+        """The finest resolution that still reaches back to *start*."""
+        series = self.series[system_id][metric]
+        for resolution, ring in (("raw", series.raw), ("1m", series.rollups["1m"]), ("1h", series.rollups["1h"])):
+            if len(ring) < ring.capacity or ring.times[ring.head] <= start:
+                return resolution
+        return "1h"
+
+    def query(self, system_id: str, metric: str, start: float, end: float, resolution: str | None = None) -> dict | None:
+        series = self.series.get(system_id, {}).get(metric)
+        if series is None:
+            return None
+        if resolution is None:
+            resolution = self.pick_resolution(system_id, metric, start)
+        if resolution != "raw" and resolution not in Series.ROLLUPS:
+            raise ValueError(f"Unknown resolution {resolution}.")
+
+        return {
+            "system_id": system_id,
+            "metric": metric,
+            "resolution": resolution,
+            "columns": ["t", "value"] if resolution == "raw" else ["t", "min", "avg", "max"],
+            "points": series.window(resolution, start, end),
+        }
+
+    def rename(self, old_id: str, new_id: str):
+        if old_id in self.series:
+            self.series[new_id] = self.series.pop(old_id)
+            # the file only ever appends, so a rename needs a full rewrite
+            self._compact_requested = True
+
+    def drop(self, system_id: str):
+        if self.series.pop(system_id, None) is not None:
+            self._compact_requested = True
+
+    def set_persist(self, persist: bool):
+        """Start or stop writing the file, e.g. when this worker becomes or stops being the primary."""
+        if persist and not self.persist:
+            # whatever the previous primary wrote may differ from this replica
+            self._compact_requested = True
+        self.persist = persist
+
+    # ------------------------------------------------------------------ #
+    #  Segment file                                                      #
+    # ------------------------------------------------------------------ #
+    #
+    #   magic "SMTS", u16 version, then records until the end of the file:
+    #     u16 key length, key (utf-8 "<system_id>\0<metric>"),
+    #     per ring (raw, 1m, 1h): u32 n, n*u32 times, n*f32 per column,
+    #     per rollup (1m, 1h): u8 open flag [, u32 start, f32 min, f32 max, f64 sum, u32 count]
+    #
+    # all little-endian, samples oldest first. A record appends its samples
+    # to the series (creating it) and replaces its open rollup buckets; a
+    # full write holds one record per series. Version 1 files have a u32
+    # series count after the version and are read the same way.
+
+    _BUCKET = struct.Struct("<IffdI")
+    _HEADER = MAGIC + struct.pack("<H", VERSION)
+
+    # a record as copied on the loop: key, per ring (times, columns), buckets
+    Record = tuple[bytes, list[tuple[array, list[array]]], list[list | None]]
+
+    @staticmethod
+    def _copy_buckets(series: Series) -> list[list | None]:
+        return [list(bucket) if bucket else None for bucket in series.buckets.values()]
+
+    def _take_full(self) -> list[Record]:
+        records = []
+        for system_id, system_series in self.series.items():
+            for metric, series in system_series.items():
+                rings = []
+                for ring in (series.raw, *series.rollups.values()):
+                    rings.append(ring.ordered())
+                    ring.saved = ring.added
+                records.append((f"{system_id}\0{metric}".encode(), rings, self._copy_buckets(series)))
+        self._dirty.clear()
+        self._compact_requested = False
+        return records
+
+    def _take_unsaved(self) -> list[Record]:
+        records = []
+        for system_id, metric in self._dirty:
+            series = self.series.get(system_id, {}).get(metric)
+            if series is not None:
+                rings = [ring.unsaved() for ring in (series.raw, *series.rollups.values())]
+                records.append((f"{system_id}\0{metric}".encode(), rings, self._copy_buckets(series)))
+        self._dirty.clear()
+        return records
+
+    @classmethod
+    def _pack(cls, records: list[Record]) -> bytes:
+        if sys.byteorder != "little" or array('I').itemsize != 4:
+            raise RuntimeError("Segment files need 32 bit little-endian arrays.")
+        parts = []
+        for key, rings, buckets in records:
+            parts.append(struct.pack("<H", len(key)))
+            parts.append(key)
+            for times, columns in rings:
+                parts.append(struct.pack("<I", len(times)))
+                parts.append(times.tobytes())
+                parts.extend(column.tobytes() for column in columns)
+            for bucket in buckets:
+                parts.append(b"\0" if bucket is None else b"\1" + cls._BUCKET.pack(*bucket))
+        return b"".join(parts)
+
+    def dump(self) -> bytes:
+        """The whole history as a segment file."""
+        return self._HEADER + self._pack(self._take_full())
+
+    def _write_full(self, records: list[Record]):
+        data = self._HEADER + self._pack(records)
+        try:
+            atomic_write(self.path, data)
+        except Exception:
+            self._compact_requested = True
+            raise
+        self._full_bytes = len(data)
+        self._appended_bytes = 0
+        self.compactions += 1
+
+    def _append(self, records: list[Record]):
+        data = self._pack(records)
+        try:
+            with open(self.path, 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception:
+            # these samples are no longer marked unsaved, only a full write has them again
+            self._compact_requested = True
+            raise
+        self._appended_bytes += len(data)
+
+    def _prepare_save(self) -> tuple:
+        """Returns the writer call for a save, with the arrays copied on the caller's thread."""
+        if self._compact_requested or self._appended_bytes >= self._full_bytes:
+            return self._write_full, self._take_full()
+        return self._append, self._take_unsaved()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if data[:4] != self.MAGIC:
+            logger.warning("History file %s is not a segment file, ignoring it.", self.path)
+            return
+
+        (version,) = struct.unpack_from("<H", data, 4)
+        if version == 1:
+            offset = 10
+        elif version == self.VERSION:
+            offset = 6
+        else:
+            logger.warning("History file %s has unsupported version %s, ignoring it.", self.path, version)
+            return
+
+        try:
+            while offset < len(data):
+                offset = self._load_record(data, offset)
+        except (struct.error, ValueError, IndexError):
+            logger.warning("History file %s ends in a torn record, ignoring the rest.", self.path)
+        else:
+            # a version 2 file that read cleanly can be appended to
+            self._compact_requested = version != self.VERSION
+        self._full_bytes = len(data)
+        for system_series in self.series.values():
+            for series in system_series.values():
+                for ring in (series.raw, *series.rollups.values()):
+                    ring.added = ring.saved = 0
+
+    def _load_record(self, data: bytes, offset: int) -> int:
+        (key_len,) = struct.unpack_from("<H", data, offset)
+        offset += 2
+        system_id, metric = data[offset:offset + key_len].decode().split("\0", 1)
+        offset += key_len
+
+        rings = []
+        series = self.series.get(system_id, {}).get(metric) or self._new_series()
+        for ring in (series.raw, *series.rollups.values()):
+            (n,) = struct.unpack_from("<I", data, offset)
+            offset += 4
+            if offset + 4 * n * (1 + len(ring.columns)) > len(data):
+                raise ValueError("truncated ring")
+            times = array('I', data[offset:offset + 4 * n])
+            offset += 4 * n
+            columns = []
+            for _ in ring.columns:
+                columns.append(array('f', data[offset:offset + 4 * n]))
+                offset += 4 * n
+            rings.append((ring, times, columns))
+        buckets = {}
+        for name in series.buckets:
+            flag = data[offset]
+            offset += 1
+            if flag:
+                buckets[name] = list(self._BUCKET.unpack_from(data, offset))
+                offset += self._BUCKET.size
+            else:
+                buckets[name] = None
+
+        # applied only once the record was read completely
+        for ring, times, columns in rings:
+            # keeps the newest samples if the configured capacity shrank
+            ring.extend(times, columns)
+        series.buckets.update(buckets)
+        self.series.setdefault(system_id, {})[metric] = series
+        return offset
+
+    def save(self):
+        """Save synchronously in the calling thread, e.g. at exit."""
+        if self.persist:
+            writer, records = self._prepare_save()
+            writer(records)
+
+    async def save_async(self):
+        if self.persist:
+            await asyncio.wrap_future(self._writer.submit(*self._prepare_save()))
+
+    async def _save_loop(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.save_async()
+            except Exception as e:
+                logger.error("Error saving history: %s", e)
+
+    def start(self):
+        if self._saver is None:
+            self._saver = asyncio.get_running_loop().create_task(self._save_loop())
+            atexit.register(self.save)
+
+    async def stop(self):
+        if self._saver is not None:
+            self._saver.cancel()
+            try:
+                await self._saver
+            except asyncio.CancelledError:
+                pass
+            self._saver = None
+        await self.save_async()
+        self._writer.shutdown()
@@ -1,16 +1,39 @@
 
+from collections import OrderedDict
+from contextlib import contextmanager
 import dataclasses
+import gc
+import hashlib
 from io import BytesIO
 import json
+import logging
+import os
 from pathlib import Path
 from PIL import Image
-from typing import Any, Final, Sequence, Type
+import tempfile
+import sys
+import threading
+import typing
+from typing import Any, Callable, Final, Sequence, Type
 
 from dataclasses import dataclass
 
 from flask import Response
 import toml
-from models import model_registry
+from models import interned_fields, model_registry
+
+# log.get_logger("util"), which can't be imported here since log imports util
+logger = logging.getLogger("sysmon.util")
+
+# optional faster JSON backends, the standard library is the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
 
 
 
@@ -21,6 +44,38 @@ class Config:
     dashboard_application_root: str = ""
     dashboard_username: str = "admin"
     dashboard_password: str = "admin"
+    persistence_flush_interval: float = 2.0
+    persistence_journal_max_bytes: int = 4 * 1024 * 1024
+    persistence_compact_interval: float = 300
+    persistence_format: str = "json"
+    history_path: str = "history.bin"
+    history_raw_samples: int = 720
+    history_minute_samples: int = 1440
+    history_hour_samples: int = 720
+    history_save_interval: float = 60
+    cluster_workers: int = 1
+    cluster_backend: str = "local"
+    redis_url: str = "redis://localhost:6379/0"
+    redis_max_connections: int = 32
+    redis_connect_timeout: float = 2.0
+    login_max_failures: int = 5
+    login_window: int = 900
+    agents_send_queue_size: int = 32
+    agents_offline_after: float = 60
+    agents_sweep_interval: float = 1
+    ingest_queue_size: int = 10000
+    ingest_batch_size: int = 256
+    ingest_batch_window_ms: float = 20
+    events_max_count: int = 200
+    events_max_age: float = 30 * 24 * 3600
+    events_archive_path: str = "events.archive.jsonl"
+    alerts_rules: list[dict] | None = None
+    metrics_enabled: bool = False
+    metrics_token: str = ""
+    logging_level: str = "info"
+    logging_format: str = "json"
+    logging_queue_size: int = 10000
+    logging_categories: dict[str, dict] | None = None
 
     def from_toml(path: str = 'config.toml') -> 'Config':
         cfg = Config()
@@ -32,16 +87,71 @@ class Config:
                 cfg.dashboard_username = config_data.get('dashboard', {}).get('username', cfg.dashboard_username)
                 cfg.dashboard_password = config_data.get('dashboard', {}).get('password', cfg.dashboard_password)
                 cfg.dashboard_application_root = config_data.get('dashboard', {}).get('application_root', cfg.dashboard_application_root)
+                cfg.persistence_flush_interval = config_data.get('persistence', {}).get('flush_interval', cfg.persistence_flush_interval)
+                cfg.persistence_journal_max_bytes = config_data.get('persistence', {}).get('journal_max_bytes', cfg.persistence_journal_max_bytes)
+                cfg.persistence_compact_interval = config_data.get('persistence', {}).get('compact_interval', cfg.persistence_compact_interval)
+                cfg.persistence_format = config_data.get('persistence', {}).get('format', cfg.persistence_format)
+                cfg.history_path = config_data.get('history', {}).get('path', cfg.history_path)
+                cfg.history_raw_samples = config_data.get('history', {}).get('raw_samples', cfg.history_raw_samples)
+                cfg.history_minute_samples = config_data.get('history', {}).get('minute_samples', cfg.history_minute_samples)
+                cfg.history_hour_samples = config_data.get('history', {}).get('hour_samples', cfg.history_hour_samples)
+                cfg.history_save_interval = config_data.get('history', {}).get('save_interval', cfg.history_save_interval)
+                cfg.cluster_workers = config_data.get('cluster', {}).get('workers', cfg.cluster_workers)
+                cfg.cluster_backend = config_data.get('cluster', {}).get('backend', cfg.cluster_backend)
+                # [cluster] redis_url predates the [redis] section
+                cfg.redis_url = config_data.get('redis', {}).get('url', config_data.get('cluster', {}).get('redis_url', cfg.redis_url))
+                cfg.redis_max_connections = config_data.get('redis', {}).get('max_connections', cfg.redis_max_connections)
+                cfg.redis_connect_timeout = config_data.get('redis', {}).get('connect_timeout', cfg.redis_connect_timeout)
+                cfg.login_max_failures = config_data.get('login', {}).get('max_failures', cfg.login_max_failures)
+                cfg.login_window = config_data.get('login', {}).get('window', cfg.login_window)
+                cfg.agents_send_queue_size = config_data.get('agents', {}).get('send_queue_size', cfg.agents_send_queue_size)
+                cfg.agents_offline_after = config_data.get('agents', {}).get('offline_after', cfg.agents_offline_after)
+                cfg.agents_sweep_interval = config_data.get('agents', {}).get('sweep_interval', cfg.agents_sweep_interval)
+                cfg.ingest_queue_size = config_data.get('ingest', {}).get('queue_size', cfg.ingest_queue_size)
+                cfg.ingest_batch_size = config_data.get('ingest', {}).get('batch_size', cfg.ingest_batch_size)
+                cfg.ingest_batch_window_ms = config_data.get('ingest', {}).get('batch_window_ms', cfg.ingest_batch_window_ms)
+                cfg.events_max_count = config_data.get('events', {}).get('max_count', cfg.events_max_count)
+                cfg.events_max_age = config_data.get('events', {}).get('max_age', cfg.events_max_age)
+                cfg.events_archive_path = config_data.get('events', {}).get('archive_path', cfg.events_archive_path)
+                cfg.alerts_rules = config_data.get('alerts', {}).get('rules', cfg.alerts_rules)
+                cfg.metrics_enabled = config_data.get('metrics', {}).get('enabled', cfg.metrics_enabled)
+                cfg.metrics_token = config_data.get('metrics', {}).get('token', cfg.metrics_token)
+                cfg.logging_level = config_data.get('logging', {}).get('level', cfg.logging_level)
+                cfg.logging_format = config_data.get('logging', {}).get('format', cfg.logging_format)
+                cfg.logging_queue_size = config_data.get('logging', {}).get('queue_size', cfg.logging_queue_size)
+                cfg.logging_categories = config_data.get('logging', {}).get('categories', cfg.logging_categories)
                 return cfg
 
         except FileNotFoundError:
-            print("config.toml not found, using default values.")
+            # logging isn't set up yet, Python's last resort handler writes this to stderr
+            logger.warning("%s not found, using default values.", path)
             
         return cfg
 
 
 
 
+def atomic_write(path: str, data: str | bytes):
+    """Write *data* to a temp file next to *path* and rename it into place."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        # mkstemp creates 0600 files, keep what a plain open() would give
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+        if isinstance(data, bytes):
+            f = os.fdopen(fd, 'wb')
+        else:
+            f = os.fdopen(fd, 'w', encoding="utf-8")
+        with f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
 class DataclassJSONEncoder(json.JSONEncoder):
     """
     Recursively adds a __type__ key to all dataclass instances
@@ -69,6 +179,227 @@ class DataclassJSONEncoder(json.JSONEncoder):
             return value
 
 
+def dataclass_to_primitive(value: Any) -> Any:
+    """
+    Convert *value* into the plain lists/dicts DataclassJSONEncoder would
+    emit, without serializing it to a string. Registered models go
+    through their compiled encoders, which are a lot cheaper than
+    ``dataclasses.fields()`` per object.
+    """
+    cls = type(value)
+    if cls is list:
+        return [dataclass_to_primitive(v) for v in value]
+    if cls is dict:
+        return {k: dataclass_to_primitive(v) for k, v in value.items()}
+    encoder = _ENCODERS.get(cls)
+    if encoder is not None:
+        return encoder(value)
+    if hasattr(cls, "__dataclass_fields__"):
+        result = {"__type__": cls.__name__}
+        for k in cls.__dataclass_fields__:
+            result[k] = dataclass_to_primitive(getattr(value, k))
+        return result
+    return value
+
+
+def intern_str(value: Any) -> Any:
+    return sys.intern(value) if type(value) is str else value
+
+
+def intern_strings(obj: Any) -> Any:
+    """Intern the low-cardinality string fields (models.interned_fields) of *obj* in place."""
+    for name in interned_fields.get(type(obj), ()):
+        setattr(obj, name, intern_str(getattr(obj, name)))
+    return obj
+
+
+@contextmanager
+def gc_paused():
+    """
+    Pause the cyclic garbage collector while a large tree is built. Every
+    collection triggered by the allocations would otherwise rescan the
+    whole (acyclic) tree that is still being built.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def primitive_to_dataclass(value: Any) -> Any:
+    """
+    Inverse of dataclass_to_primitive(): rebuild the dataclasses in plain
+    parsed JSON, like DataclassJSONDecoder but top-down with the compiled
+    per-class decoders.
+    """
+    cls = type(value)
+    if cls is dict:
+        name = value.get("__type__")
+        if name is None:
+            return {k: primitive_to_dataclass(v) for k, v in value.items()}
+        decoder = _DECODERS.get(name)
+        if decoder is None:
+            raise ValueError(f"Unknown dataclass type: {name}")
+        return decoder(value)
+    if cls is list:
+        return [primitive_to_dataclass(v) for v in value]
+    return value
+
+
+# ---------------------------------------------------------------------- #
+#  Per-class codecs, generated once from model_registry                  #
+# ---------------------------------------------------------------------- #
+#
+# For every registered dataclass a pair of functions is compiled that
+# reads/writes each field directly, e.g. for SystemMemory:
+#
+#   def encode(obj):
+#       return {"__type__": "SystemMemory", "total_gib": obj.total_gib, "used_gib": obj.used_gib}
+#
+#   def decode(d):
+#       return SystemMemory(total_gib=d["total_gib"], used_gib=(d["used_gib"] if "used_gib" in d else _default_used_gib))
+#
+# Nested dataclasses call each other's codec, containers of anything else
+# go through the generic walkers above. Fields in models.interned_fields
+# are interned while decoding.
+
+_SCALARS = (str, int, float, bool)
+_ENCODERS: dict[type, Callable[[Any], dict]] = {}
+_DECODERS: dict[str, Callable[[dict], Any]] = {}
+
+
+def _is_plain(annotation: Any) -> bool:
+    """True for scalars and lists/dicts that can't contain a dataclass."""
+    origin = typing.get_origin(annotation)
+    if origin in (list, dict):
+        return all(_is_plain(arg) for arg in typing.get_args(annotation))
+    # also the plain constant holders like SystemType and EventLevel
+    return (
+        origin is None
+        and isinstance(annotation, type)
+        and annotation not in (list, dict, object)
+        and not dataclasses.is_dataclass(annotation)
+    )
+
+
+def _field_kind(annotation: Any) -> tuple[str, type | None]:
+    """Classify a field annotation as scalar, container, dataclass, dataclass_list or other."""
+    if dataclasses.is_dataclass(annotation):
+        return "dataclass", annotation
+    if typing.get_origin(annotation) is list:
+        (item,) = typing.get_args(annotation) or (Any,)
+        if dataclasses.is_dataclass(item):
+            return "dataclass_list", item
+    if _is_plain(annotation):
+        if typing.get_origin(annotation) is None:
+            return "scalar", None
+        return "container", None
+    return "other", None
+
+
+def _compile_codec(cls: type):
+    if cls in _ENCODERS:
+        return
+
+    namespace = {
+        cls.__name__: cls,
+        "_primitive": dataclass_to_primitive,
+        "_dataclass": primitive_to_dataclass,
+        "_intern": intern_str,
+    }
+    encoded = [f'"__type__": {cls.__name__!r}']
+    decoded = []
+    hints = typing.get_type_hints(cls)
+    interned = interned_fields.get(cls, ())
+
+    for field in dataclasses.fields(cls):
+        name = field.name
+        kind, nested = _field_kind(hints[name])
+        if nested is not None:
+            _compile_codec(nested)
+            namespace[f"_{nested.__name__}"] = nested
+            namespace[f"_enc_{nested.__name__}"] = _ENCODERS[nested]
+            namespace[f"_dec_{nested.__name__}"] = _DECODERS[nested.__name__]
+
+        # values that don't match their annotation take the generic path
+        if kind == "scalar":
+            encode = f"obj.{name}"
+            decode = "_intern({})" if name in interned else "{}"
+        elif kind == "container":
+            # copied, snapshots must not share mutable state with the live tree
+            encode = f"_primitive(obj.{name})"
+            decode = "{}"
+        elif kind == "dataclass":
+            n = nested.__name__
+            encode = f"(_enc_{n}(obj.{name}) if obj.{name}.__class__ is _{n} else _primitive(obj.{name}))"
+            decode = f"_dec_{n}({{}})"
+        elif kind == "dataclass_list":
+            n = nested.__name__
+            encode = f"[_enc_{n}(v) if v.__class__ is _{n} else _primitive(v) for v in obj.{name}]"
+            decode = f"[_dec_{n}(v) if v.__class__ is dict else v for v in {{}}]"
+        else:
+            encode = f"_primitive(obj.{name})"
+            decode = "_dataclass({})"
+        encoded.append(f"{name!r}: {encode}")
+
+        if field.default is not dataclasses.MISSING:
+            namespace[f"_default_{name}"] = field.default
+            value = decode.format(f"d[{name!r}]")
+            decoded.append(f"{name}=({value} if {name!r} in d else _default_{name})")
+        elif field.default_factory is not dataclasses.MISSING:
+            namespace[f"_factory_{name}"] = field.default_factory
+            value = decode.format(f"d[{name!r}]")
+            decoded.append(f"{name}=({value} if {name!r} in d else _factory_{name}())")
+        else:
+            decoded.append(f"{name}={decode.format(f'd[{name!r}]')}")
+
+    source = (
+        f"def encode(obj):\n    return {{{', '.join(encoded)}}}\n"
+        f"def decode(d):\n    return {cls.__name__}({', '.join(decoded)})\n"
+    )
+    exec(compile(source, f"<codec {cls.__name__}>", "exec"), namespace)
+    _ENCODERS[cls] = namespace["encode"]
+    _DECODERS[cls.__name__] = namespace["decode"]
+
+
+for _cls in model_registry.values():
+    _compile_codec(_cls)
+
+
+if orjson is not None:
+    JSON_BACKEND = "orjson"
+elif msgspec is not None:
+    JSON_BACKEND = "msgspec"
+    _msgspec_encoder = msgspec.json.Encoder()
+    _msgspec_decoder = msgspec.json.Decoder()
+else:
+    JSON_BACKEND = "json"
+
+
+def json_dumps(value: Any) -> str:
+    """Compact JSON of plain lists/dicts, through the fastest backend installed."""
+    if JSON_BACKEND == "orjson":
+        return orjson.dumps(value).decode()
+    if JSON_BACKEND == "msgspec":
+        return _msgspec_encoder.encode(value).decode()
+    return json.dumps(value, separators=(",", ":"))
+
+
+def json_loads(data: str | bytes) -> Any:
+    if JSON_BACKEND == "orjson":
+        return orjson.loads(data)
+    if JSON_BACKEND == "msgspec":
+        try:
+            return _msgspec_decoder.decode(data)
+        except msgspec.DecodeError as e:
+            # callers expect what json.loads raises
+            raise ValueError(str(e)) from e
+    return json.loads(data)
+
+
 class DataclassJSONDecoder(json.JSONDecoder):
     """
     Recreates nested dataclasses automatically via object_hook.
@@ -97,8 +428,10 @@ class SystemImage:
     max_stack: int = 1
     stack_shift_x: int = 0
     stack_shift_y: int = 0
-    base_folder: str = "core/templates/system_images"
+    base_folder: str = str(Path(__file__).parent / "static" / "system_images")
     stackable: bool = True
+    # decoded RGBA layers by variation, filled once by preload()
+    _layers: dict[str, Image.Image] = dataclasses.field(default_factory=dict, repr=False, compare=False)
 
     _PNG_MIMETYPE: Final[str] = "image/png"
     _CROP_MARGIN: Final[int] = 10       # px
@@ -116,22 +449,55 @@ class SystemImage:
         --------
         ``return battery_icon.image(["off", "dark", "on"])``
         """
-        if not variations:
-            raise ValueError("`variations` must contain at least one item")
+        return Response(self.render(variations), mimetype=self._PNG_MIMETYPE)
+
+    def render(self, variations: Sequence[str], size: int | None = None, format: str = "PNG") -> bytes:
+        """
+        Compose the requested *variations* like ``image()``, scale the result
+        down to fit ``size`` x ``size`` if given, and encode it as *format*.
+        """
+        buf = BytesIO()
+        self.compose(variations, size).save(buf, format=format)
+        return buf.getvalue()
 
+    def compose(self, variations: Sequence[str], size: int | None = None) -> Image.Image:
+        """The un-encoded icon behind ``render()``."""
+        layers = self.layers(variations)
         # Normal single‑frame response when stacking isn't needed / allowed
-        if (
-            len(variations) == 1
-            or not self.stackable
-            or self.max_stack <= 1
-        ):
-            pil_img = self._load(variations[0])
+        if len(layers) == 1:
+            pil_img = self._load(layers[0])
         else:
-            pil_img = self._compose_layers(list(variations)[: self.max_stack])
+            pil_img = self._compose_layers(layers)
 
-        buf = BytesIO()
-        pil_img.save(buf, format="PNG")
-        return Response(buf.getvalue(), mimetype=self._PNG_MIMETYPE)
+        if size is not None:
+            pil_img = pil_img.copy()  # never scale the cached layer itself
+            pil_img.thumbnail((size, size), Image.LANCZOS)
+        return pil_img
+
+    def layers(self, variations: Sequence[str]) -> tuple[str, ...]:
+        """The *variations* that end up in the icon: the first one, or up to ``max_stack`` if stackable."""
+        if not variations:
+            raise ValueError("`variations` must contain at least one item")
+        if not self.stackable or self.max_stack <= 1:
+            return (variations[0],)
+        return tuple(variations[: self.max_stack])
+
+    def preload(self) -> None:
+        """Decode every '<base_name>_<variation>.png' once."""
+        for path in Path(self.base_folder).glob(f"{self.base_name}_*.png"):
+            variation = path.stem[len(self.base_name) + 1:]
+            if variation not in self._layers:
+                self._layers[variation] = Image.open(path).convert("RGBA")
+
+    def variations(self) -> list[str]:
+        if not self._layers:
+            self.preload()
+        return sorted(self._layers)
+
+    def stack_depths(self) -> range:
+        if not self.stackable or self.max_stack <= 1:
+            return range(1, 2)
+        return range(1, self.max_stack + 1)
 
     def _compose_layers(self, variations: Sequence[str]) -> Image.Image:
         """Stack the given *variations* then crop & centre the result."""
@@ -189,19 +555,81 @@ class SystemImage:
         return canvas
 
     def _load(self, variation: str) -> Image.Image:
-        """Load '<base_name>_<variation>.png' and return as RGBA PIL.Image."""
-        path = Path(self.base_folder) / f"{self.base_name}_{variation}.png"
-        return Image.open(path).convert("RGBA")
+        """Return the decoded RGBA layer for '<base_name>_<variation>.png'."""
+        if not self._layers:
+            self.preload()
+        # only known variations, so request input never becomes a path
+        layer = self._layers.get(variation)
+        if layer is None:
+            raise ValueError(f"Unknown variation '{variation}' for '{self.base_name}'.")
+        return layer
 
 
 
 class SystemImageRegistry:
-    def __init__(self):
+    SIZES: Final[tuple[int, ...]] = (64, 128, 256)
+    FORMATS: Final[dict[str, tuple[str, str]]] = {
+        "png": ("PNG", "image/png"),
+        "webp": ("WEBP", "image/webp"),
+    }
+
+    def __init__(self, cache_size: int = 256):
         self._images: dict[str, SystemImage] = {}
+        # rendered icons: (base_name, variations, size, format) -> (data, mimetype, etag)
+        self._cache: OrderedDict[tuple, tuple[bytes, str, str]] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
 
     def register(self, image: SystemImage) -> None:
         self._images[image.base_name] = image
 
+    def preload(self) -> None:
+        for image in self._images.values():
+            image.preload()
+
+    def images(self) -> list[SystemImage]:
+        return list(self._images.values())
+
+    def find(self, base_name: str) -> SystemImage | None:
+        return self._images.get(base_name)
+
+    def render(self, base_name: str, variations: Sequence[str], size: int | None = None, format: str = "png") -> tuple[bytes, str, str]:
+        """
+        Rendered icon as ``(data, mimetype, etag)``, memoized in an LRU
+        cache. Safe to call from worker threads.
+        """
+        if base_name not in self._images:
+            raise ValueError(f"SystemImage '{base_name}' not registered.")
+        if size is not None and size not in self.SIZES:
+            raise ValueError(f"Unsupported icon size {size}.")
+        if format not in self.FORMATS:
+            raise ValueError(f"Unsupported icon format '{format}'.")
+
+        # variations past the stack limit don't change the icon, keep them out of the key
+        key = (base_name, self._images[base_name].layers(variations), size, format)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        pil_format, mimetype = self.FORMATS[format]
+        data = self._images[base_name].render(key[1], size, pil_format)
+        entry = (data, mimetype, hashlib.sha1(data).hexdigest())
+
+        with self._cache_lock:
+            self.misses += 1
+            self._cache[key] = entry
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
+
+    def stats(self) -> dict:
+        return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
     # def get(self, base_name: str) -> SystemImage | None:
     #     return self._images.get(base_name)
 
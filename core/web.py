@@ -1,40 +1,123 @@
+import asyncio
 import dataclasses
 import datetime
+import hmac
 import json
+import os
+import threading
 import time
 import uuid
 from datetime import timedelta
-from collections import defaultdict
 
-from quart import Quart, websocket, session, render_template, request, redirect, url_for, abort, jsonify, flash
+from quart import Quart, Response, websocket, session, render_template, request, redirect, url_for, abort, jsonify, flash
 
-import redis
+import redis.asyncio as aioredis
 
 from models import Event, EventLevel, EventType, Provider, Site, System, SystemCPU, SystemDisk, SystemMemory, SystemNetwork, SystemOS, SystemService
+from aggregates import FleetAggregates
+from alerts import METRICS, AlertEngine
+from atlas import atlas_current, build_atlas
 from db import SystemDB
-from util import Config
+from ingest import IngestQueue
+from instrument import INSTRUMENTS, LoopLagMonitor, SamplingProfiler
+import protocol
+from limiter import LoginLimiter
+from liveness import LivenessSweeper
+import log
+from metrics import CONTENT_TYPE, MetricsExporter
+from sessions import AgentSession, SessionRegistry
+from shared import LocalState, RedisState
+from stream import DASHBOARD, Broadcaster
+from timeseries import TimeSeriesStore
+from util import SYSTEM_IMAGES, Config, intern_strings
+
+logger = log.get_logger("web")
+agent_log = log.get_logger("agent")
+cluster_log = log.get_logger("cluster")
+ingest_log = log.get_logger("ingest")
+
+
+# agent message types, anything else is counted as "other"
+MESSAGE_TYPES = frozenset({"hello", "get_watch_services", "hardware_info", "usage_info", "usage_delta"})
 
 
 class Dashboard:
     def __init__(self, config: Config):
         self.config = config
-        self.db = SystemDB()
-        self.clients = set()
-        self.client_map = {}
-        self.msg_count = defaultdict(int)
+        log.setup_logging(config)
+        self.db = SystemDB(
+            flush_interval=config.persistence_flush_interval,
+            journal_max_bytes=config.persistence_journal_max_bytes,
+            compact_interval=config.persistence_compact_interval,
+            snapshot_format=config.persistence_format,
+            event_archive_path=config.events_archive_path,
+            event_max_count=config.events_max_count,
+            event_max_age=config.events_max_age,
+        )
+        self.history = TimeSeriesStore(
+            path=config.history_path,
+            raw_samples=config.history_raw_samples,
+            minute_samples=config.history_minute_samples,
+            hour_samples=config.history_hour_samples,
+            save_interval=config.history_save_interval,
+        )
+        self.aggregates = FleetAggregates()
+        self.alerts = AlertEngine(config.alerts_rules)
+
+        # one pool for every Redis user in this process; connecting happens
+        # lazily on the loop, so an unreachable server doesn't stop startup
+        self.redis_pool = aioredis.BlockingConnectionPool.from_url(
+            config.redis_url,
+            max_connections=config.redis_max_connections,
+            socket_connect_timeout=config.redis_connect_timeout,
+            decode_responses=True,
+        )
+        self.redis = aioredis.Redis(connection_pool=self.redis_pool)
+        self.limiter = LoginLimiter(self.redis, max_failures=config.login_max_failures, window=config.login_window)
+
+        # state shared with the other worker processes, if there are any
+        if config.cluster_backend == "redis":
+            self.shared = RedisState(self.redis)
+            # until elected primary, this worker keeps a replica in memory only
+            self.db.persist = False
+            self.history.set_persist(False)
+        else:
+            self.shared = LocalState()
+        self.shared.on_records = self._apply_remote
+        self.shared.on_command = self._send_to_agent
+        self.shared.on_primary = self._set_primary
+        self.shared.on_snapshot = self.db.state_record
+        self.db.replicate = self.shared.publish
+
+        self._providers_json: tuple[int, str] = (-1, "")
+        self.broadcaster = Broadcaster(self.db)
+        self.metrics = MetricsExporter(self.db)
+        if config.metrics_enabled and not config.metrics_token:
+            logger.warning("[metrics] is enabled without a token, /metrics stays off.")
+        self.ingest = IngestQueue(
+            self._apply_batch,
+            queue_size=config.ingest_queue_size,
+            batch_size=config.ingest_batch_size,
+            batch_window_ms=config.ingest_batch_window_ms,
+            observe=self._observe_ingest,
+        )
+        self.loop_lag = LoopLagMonitor()
+        self._atlas_task: asyncio.Task | None = None
+        self.profiler: SamplingProfiler | None = None
+        self.sessions = SessionRegistry(queue_size=config.agents_send_queue_size)
+        self.liveness = LivenessSweeper(self._expire_agents, timeout=config.agents_offline_after, interval=config.agents_sweep_interval)
 
         self.USERNAME = config.dashboard_username
         self.PASSWORD = config.dashboard_password
 
         self.app = Quart("SysMon", template_folder='core/templates', static_folder='core/static')
-        self.app.secret_key = uuid.uuid4().hex
+        # workers share the key (see __main__), or sessions wouldn't carry over
+        self.app.secret_key = os.environ.get("SYSMON_SECRET_KEY") or uuid.uuid4().hex
         self.app.config.update(
             APPLICATION_ROOT=config.dashboard_application_root,
             PERMANENT_SESSION_LIFETIME=timedelta(minutes=30)
         )
 
-        self.redis = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
-
         self._setup_routes()
 
     def get_limiter_login_fail_key(self):
@@ -43,6 +126,33 @@ class Dashboard:
     def _setup_routes(self):
         app = self.app
 
+        @app.before_serving
+        async def startup():
+            await self.shared.start()
+            self.db.start()
+            self.history.start()
+            self.ingest.start()
+            self.liveness.start()
+            self.loop_lag.start()
+            self.profiler = SamplingProfiler(threading.get_ident())
+            # decode the icon layers once, off the loop
+            await asyncio.to_thread(SYSTEM_IMAGES.preload)
+            # takes seconds, so it runs in the background instead of delaying startup
+            self._atlas_task = asyncio.get_running_loop().create_task(self._ensure_atlas())
+
+        @app.after_serving
+        async def shutdown():
+            if self._atlas_task:
+                self._atlas_task.cancel()
+            await self.liveness.stop()
+            await self.loop_lag.stop()
+            await self.ingest.stop()
+            await self.db.stop()
+            await self.history.stop()
+            await self.shared.stop()
+            await self.redis.aclose()
+            await self.redis_pool.aclose()
+
         @app.errorhandler(404)
         @app.errorhandler(405)
         async def standard_error(error):
@@ -61,45 +171,175 @@ class Dashboard:
 
         @app.route('/login', methods=['GET', 'POST'])
         async def login():
-
-            # key = self.get_limiter_login_fail_key()
-            # fails = int(self.redis.get(key) or 0)
-            # if fails > 5:
-            #     return "Too many attempts. Try again later.", 429
-
-            # # On failure:
-            # self.redis.incr(key)
-            # self.redis.expire(key, 900)
-
-
             if session.get('logged_in'):
                 return redirect(url_for('index'))
 
             if request.method == 'POST':
+                key = self.get_limiter_login_fail_key()
+                if await self.limiter.blocked(key):
+                    await flash("Too many attempts. Try again later.", 'error')
+                    return await render_template("login.jinja"), 429
+
                 form = await request.form
                 username = form.get('username')
                 password = form.get('password')
                 if username == self.USERNAME and password == self.PASSWORD:
+                    await self.limiter.reset(key)
                     session.clear()
                     session.permanent = True
                     session['logged_in'] = True
                     return redirect(url_for('index'))
                 else:
-                    flash("Invalid username or password", 'error')
+                    await self.limiter.failed(key)
+                    await flash("Invalid username or password", 'error')
 
             return await render_template("login.jinja")
 
         @app.route('/logout')
         async def logout():
             session.pop('logged_in', None)
-            flash("Logged out", 'success')
+            await flash("Logged out", 'success')
             return redirect(url_for('login'))
 
         @app.route('/providers.json')
         async def providers_json():
             if not session.get('logged_in'):
                 abort(401)
-            return jsonify([dataclasses.asdict(p) for p in self.db.providers])
+
+            revision = self.db.revision
+            epoch = self.db.epoch
+            etag = f"{epoch}-{revision}"
+            headers = {"ETag": f'"{etag}"', "X-Revision": str(revision), "X-Epoch": epoch}
+            if request.if_none_match.contains(etag):
+                return "", 304, headers
+
+            since = request.args.get('since', type=int)
+            if since is not None:
+                if request.args.get('epoch') != epoch:
+                    # a revision of another worker or an earlier run
+                    since = 0
+                elif since == revision:
+                    return "", 304, headers
+                changed = self.db.changed_since(since)
+                if changed is not None:
+                    for system in changed:
+                        self.db.ensure_events(system)
+                    response = jsonify({
+                        "epoch": epoch,
+                        "revision": revision,
+                        "full": False,
+                        "systems": [dataclasses.asdict(s) for s in changed],
+                    })
+                else:
+                    self.db.ensure_all_events()
+                    response = jsonify({
+                        "epoch": epoch,
+                        "revision": revision,
+                        "full": True,
+                        "providers": [dataclasses.asdict(p) for p in self.db.providers],
+                    })
+            else:
+                # every open dashboard asks for the same revision, serialize it once
+                if self._providers_json[0] != revision:
+                    self.db.ensure_all_events()
+                    self._providers_json = (revision, json.dumps([dataclasses.asdict(p) for p in self.db.providers]))
+                    INSTRUMENTS.observe("json_encode_bytes", len(self._providers_json[1]), ("kind", "providers"))
+                response = Response(self._providers_json[1], mimetype="application/json")
+
+            response.set_etag(etag)
+            response.headers["X-Revision"] = str(revision)
+            response.headers["X-Epoch"] = epoch
+            return response
+
+        @app.route('/stats.json')
+        async def stats_json():
+            if not session.get('logged_in'):
+                abort(401)
+            return jsonify({
+                "persistence": self.db.stats(),
+                "stream": self.broadcaster.stats(),
+                "ingest": self.ingest.stats(),
+                "cluster": self.shared.stats(),
+                "agents": self.sessions.stats(),
+                "liveness": self.liveness.stats(),
+                "alerts": self.alerts.stats(),
+                "metrics": self.metrics.stats(),
+                "instruments": INSTRUMENTS.stats(),
+                "logging": log.stats(),
+                "login": self.limiter.stats(),
+                "icons": SYSTEM_IMAGES.stats(),
+            })
+
+        @app.route('/metrics')
+        async def metrics():
+            # the whole fleet inventory, never served without a token
+            token = self.config.metrics_token
+            if not self.config.metrics_enabled or not token:
+                abort(404)
+            if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+                abort(401)
+            return Response(self.metrics.render() + INSTRUMENTS.render(), content_type=CONTENT_TYPE)
+
+        @app.route('/debug/profile')
+        async def debug_profile():
+            if not session.get('logged_in'):
+                abort(401)
+            if self.profiler is None:
+                abort(503)
+            seconds = min(max(request.args.get('seconds', 10, type=float), 0.1), 60)
+            if not self.profiler.lock.acquire(blocking=False):
+                return "A profile is already being taken.", 409
+            try:
+                # sampled from a helper thread while the loop keeps serving
+                stacks, samples = await asyncio.to_thread(self.profiler.sample, seconds)
+            finally:
+                self.profiler.lock.release()
+            if request.args.get('format') == 'top':
+                return Response(SamplingProfiler.top(stacks, samples), mimetype="text/plain")
+            return Response(SamplingProfiler.folded(stacks), mimetype="text/plain")
+
+        @app.route('/aggregates')
+        async def aggregates():
+            if not session.get('logged_in'):
+                abort(401)
+
+            if self.aggregates.structure_version != self.db.structure_version:
+                self.aggregates.rebuild(self.db.providers, self.db.structure_version)
+
+            try:
+                percentiles = [float(p) for p in request.args.get('percentiles', '50,90,99').split(',') if p]
+                result = self.aggregates.compute(
+                    metric=request.args.get('metric', 'cpu'),
+                    by=request.args.get('by', 'site'),
+                    percentiles=percentiles,
+                    top=int(request.args.get('top', 10)),
+                )
+            except ValueError as e:
+                abort(400, str(e))
+            return jsonify(result)
+
+        @app.route('/icon/<base_name>')
+        async def icon(base_name):
+            image = SYSTEM_IMAGES.find(base_name)
+            if image is None:
+                abort(404)
+            variations = request.args.get('v', 'on').split(',')
+            if len(variations) > max(image.max_stack, 1):
+                abort(400, f"At most {max(image.max_stack, 1)} variations for {base_name}.")
+            size = request.args.get('size', type=int)
+            try:
+                # cache hits return right away, misses render on a worker thread
+                data, mimetype, etag = await asyncio.to_thread(
+                    SYSTEM_IMAGES.render, base_name, variations, size, request.args.get('format', 'png')
+                )
+            except ValueError:
+                abort(404)
+
+            # the layers never change while running, so neither does a URL's icon
+            headers = {"ETag": f'"{etag}"', "Cache-Control": "public, max-age=31536000, immutable"}
+            if request.if_none_match.contains(etag):
+                return "", 304, headers
+            return Response(data, mimetype=mimetype, headers=headers)
 
         @app.route('/system')
         async def system_view():
@@ -110,9 +350,10 @@ class Dashboard:
             if not system_id:
                 return redirect(url_for('index'))
 
-            system = self._find_system_by_id(system_id)
+            system = self.db.get_system(system_id)
             if not system:
                 abort(404)
+            self.db.ensure_events(system)
             return await render_template("system.jinja", system=system)
 
         @app.route('/system/json')
@@ -123,9 +364,14 @@ class Dashboard:
             if not system_id:
                 abort(400, "Missing system ID")
                 
-            system = self._find_system_by_id(system_id)
+            system = self.db.get_system(system_id)
             if not system:
                 abort(404)
+            self.db.ensure_events(system)
+            etag = f"{self.db.epoch}-{self.db.stamp(system_id)}"
+            if request.if_none_match.contains(etag):
+                return "", 304, {"ETag": f'"{etag}"'}
+
             # return jsonify({
             #     "id": system.id,
             #     "name": system.name,
@@ -133,8 +379,32 @@ class Dashboard:
             #     "memory": dataclasses.asdict(system.memory),
             #     "last_seen": system.last_seen,
             # })
-            return jsonify(dataclasses.asdict(system))
+            response = jsonify(dataclasses.asdict(system))
+            response.set_etag(etag)
+            return response
         
+        @app.route('/system/history')
+        async def system_history():
+            if not session.get('logged_in'):
+                abort(401)
+            system_id = request.args.get('id')
+            if not system_id:
+                abort(400, "Missing system ID")
+
+            metric = request.args.get('metric')
+            if not metric:
+                return jsonify({"system_id": system_id, "metrics": self.history.metrics(system_id)})
+
+            try:
+                end = float(request.args.get('to', time.time()))
+                start = float(request.args.get('from', end - 3600))
+                history = self.history.query(system_id, metric, start, end, request.args.get('resolution'))
+            except ValueError as e:
+                abort(400, str(e))
+            if history is None:
+                abort(404)
+            return jsonify(history)
+
         @app.route('/event/clear', methods=['POST'])
         async def clear_event():
             if not session.get('logged_in'):
@@ -216,66 +486,237 @@ class Dashboard:
                             critical="critical" in form,
                         )
 
-                        system_ws = next((ws for ws in self.clients if self.client_map[ws] == form["system_id"]), None)
-                        if system_ws:
-                            system_ws.send(json.dumps({
-                                "type": "set_watch_services",
-                                "services": [service.name for service in self.db.get_system(form["system_id"]).services]
-                            }))
+                        # the agent may be connected to another worker
+                        await self.shared.send_command(form["system_id"], {
+                            "type": "set_watch_services",
+                            "services": [service.name for service in self.db.get_system(form["system_id"]).services]
+                        })
 
                     elif action == "edit_system_id":
                         self.db.edit_system_id(
                             form["system_id"],
                             new_id=form["new_id"]
                         )
+                        self.history.rename(form["system_id"], form["new_id"])
+                        self.broadcaster.rename(form["system_id"], form["new_id"])
+                        self.liveness.rename(form["system_id"], form["new_id"])
+                        self.alerts.forget(form["system_id"])
 
-                        old_ws = next((ws for ws in self.clients if self.client_map[ws] == form["system_id"]), None)
-                        if old_ws:
-                            self.client_map[old_ws] = form["new_id"]
-                            print(f"Updated WebSocket mapping: {form['system_id']} -> {form['new_id']}")
+                        if self.sessions.rename(form["system_id"], form["new_id"]):
+                            await self.shared.release_agent(form["system_id"])
+                            await self.shared.claim_agent(form["new_id"])
+                            agent_log.info("Updated WebSocket mapping", extra={"system_id": form["system_id"], "new_id": form["new_id"]})
 
                     elif action == "remove_system":
                         self.db.remove_system(form["system_id"])
+                        self.liveness.forget(form["system_id"])
+                        self.alerts.forget(form["system_id"])
+                        self.history.drop(form["system_id"])
 
                 except Exception as e:
-                    print(f"Error processing action {action}: {e}")
+                    logger.error("Error processing action %s: %s", action, e)
 
                 return redirect(url_for("admin"))
 
             return await render_template("admin.jinja", providers=self.db.providers)
 
+        @app.websocket('/ws/dashboard')
+        async def ws_dashboard():
+            if not session.get('logged_in'):
+                abort(401)
+            await self._stream(DASHBOARD)
+
+        @app.websocket('/ws/system')
+        async def ws_system():
+            if not session.get('logged_in'):
+                abort(401)
+            system_id = websocket.args.get('id')
+            system = self.db.get_system(system_id) if system_id else None
+            if not system:
+                abort(404)
+            self.db.ensure_events(system)
+            await self._stream(system_id)
+
         @app.websocket('/ws')
         async def ws():
-            ws = websocket._get_current_object()
-            self.clients.add(ws)
-            self.client_map[ws] = None
-            print(f"✓ WebSocket connected (clients={len(self.clients)})")
+            agent = self.sessions.open(websocket._get_current_object())
+            agent_log.info("Agent connected", extra={"remote_addr": agent.remote_addr, "clients": len(self.sessions)})
             try:
                 while True:
                     msg = await websocket.receive()
-                    self.msg_count[ws] += 1
-                    await self._handle_ws_message(msg, ws)
+                    agent.received += 1
+                    await self._receive_ws_message(msg, agent)
             except Exception as e:
-                print(f"WebSocket error: {e}")
+                agent_log.warning("WebSocket error: %s", e, extra={"system_id": agent.system_id})
             finally:
-                self.clients.discard(ws)
-                sid = self.client_map.pop(ws, None)
+                sid = await self.sessions.close(agent)
                 if sid:
-                    self.db.update_system(sid, connected=False)
-                print(f"✗ WebSocket disconnected (clients={len(self.clients)})")
+                    self._set_offline(sid, "The agent disconnected.")
+                    await self.shared.release_agent(sid)
+                agent_log.info("Agent disconnected", extra={"system_id": sid, "clients": len(self.sessions)})
+
+    async def _stream(self, topic: str | None):
+        queue = self.broadcaster.subscribe(topic)
+        try:
+            await websocket.accept()
+            while True:
+                await websocket.send(await queue.get())
+        finally:
+            self.broadcaster.unsubscribe(queue)
+
+    async def _receive_ws_message(self, msg: str | bytes, agent: AgentSession):
+        binary = isinstance(msg, bytes)
+        if agent.binary is None:
+            agent.binary = binary
+        self.sessions.frames["msgpack" if binary else "json"] += 1
+        json_data = protocol.decode_message(msg)
 
-    def _find_system_by_id(self, system_id):
-        for prov in self.db.providers:
-            for site in prov.sites:
-                for sys in site.systems:
-                    if sys.id == system_id:
-                        return sys
-        return None
+        system_id = json_data.get("system_id")
+        system = self.db.get_system(system_id)
+        if not system:
+            raise ValueError(f"Unknown system ID: {system_id}")
 
-    async def _handle_ws_message(self, msg, ws):
-        print(f"Received message from {ws.remote_addr}: {len(msg)}")
-        json_data = json.loads(msg)
+        if self.sessions.bind(agent, system_id):
+            await self.shared.claim_agent(system_id)
 
+        type = json_data.get("type")
+        INSTRUMENTS.count("messages_total", ("type", type if type in MESSAGE_TYPES else "other"))
+        if type == "get_watch_services":
+            services = [service.name for service in system.services]
+            self.sessions.send(agent, {"type": "set_watch_services", "services": services})
+        elif type == "hello":
+            agent.protocol = protocol.negotiate(json_data.get("protocol"))
+            self.sessions.send(agent, {"type": "hello", "protocol": agent.protocol})
+        elif self.sessions.check_sequence(agent, type, json_data.get("seq")):
+            # state changes go through the ingest worker, in batches
+            await self.ingest.put((agent, json_data))
+
+    def _observe_ingest(self, item: tuple, latency: float):
+        type = item[1].get("type")
+        INSTRUMENTS.observe("ingest_latency_seconds", latency, ("type", type if type in MESSAGE_TYPES else "other"))
+
+    async def _send_to_agent(self, system_id: str, command: dict):
+        """Queue a command routed to this worker for the agent's socket."""
+        self.sessions.send_to(system_id, command)
+
+    def _apply_remote(self, lines: list[str]):
+        """Apply the mutations other workers replicated to this one."""
+        with self.db.batch():
+            for line in lines:
+                try:
+                    record = self.db.apply_remote(line)
+                except Exception as e:
+                    cluster_log.error("Error applying replicated record: %s", e)
+                    continue
+                if record is None:
+                    continue
+
+                if record["op"] == "structure":
+                    # series of systems removed on another worker
+                    for system_id in list(self.history.series):
+                        if not self.db.get_system(system_id):
+                            self.history.drop(system_id)
+                    for system_id in self.alerts.tracked():
+                        if not self.db.get_system(system_id):
+                            self.alerts.forget(system_id)
+                    continue
+
+                system = self.db.get_system(record["id"])
+                self.aggregates.update(system)
+                if record["op"] == "set" and "last_seen" in record["fields"]:
+                    # heartbeat of an agent on another worker
+                    self.liveness.touch(system.id)
+                if record["op"] == "usage":
+                    self.history.record(system.id, time.time(), {
+                        "cpu": record["cpu"],
+                        "memory": record["mem"],
+                        **{f"disk:{device}": used for device, used in record["disks"].items()},
+                    })
+
+    async def _ensure_atlas(self):
+        try:
+            if not await asyncio.to_thread(atlas_current, SYSTEM_IMAGES):
+                index = await asyncio.to_thread(build_atlas, SYSTEM_IMAGES)
+                logger.info("Built icon atlas with %d tiles", len(index["tiles"]))
+        except Exception as e:
+            logger.error("Error building icon atlas: %s", e)
+
+    def _set_primary(self, primary: bool):
+        self.db.set_persist(primary)
+        self.history.set_persist(primary)
+        if primary:
+            # systems still marked connected from before a restart, or by a
+            # worker that went away, go offline unless their agent reports
+            for system in self.db.systems():
+                if system.connected and system.id not in self.liveness:
+                    self.liveness.touch(system.id)
+
+    def _expire_agents(self, system_ids: list[str]):
+        # every worker tracks every heartbeat, only the primary acts on them
+        if not self.shared.primary:
+            return
+        with self.db.batch():
+            for system_id in system_ids:
+                self._set_offline(system_id, f"No message from the agent for {self.liveness.timeout:g} seconds.")
+
+    def _clear_active_event(self, system: System, level: EventLevel, type: EventType):
+        self.db.ensure_events(system)
+        event = self.db.events.active(system.id, level, type)
+        if event:
+            self.db.clear_event(system.id, event.id)
+
+    def _set_online(self, system: System):
+        self._clear_active_event(system, EventLevel.WARNING, EventType.OFFLINE)
+        self.db.add_event(system.id, Event.create_event(
+            level=EventLevel.INFO,
+            type=EventType.ONLINE,
+            timestamp=time.time(),
+            clearable=True,
+            description="The agent connected."
+        ))
+
+    def _set_offline(self, system_id: str, description: str):
+        self.liveness.forget(system_id)
+        system = self.db.get_system(system_id)
+        if not system or not system.connected:
+            return
+        self.db.update_system(system_id, connected=False)
+        self._clear_active_event(system, EventLevel.INFO, EventType.ONLINE)
+        self.db.add_event(system_id, Event.create_event(
+            level=EventLevel.WARNING,
+            type=EventType.OFFLINE,
+            timestamp=time.time(),
+            clearable=True,
+            description=description
+        ))
+
+    def _apply_batch(self, items: list[tuple]):
+        seen = set()
+        with self.db.batch():
+            for agent, json_data in items:
+                type = json_data.get("type")
+                if type == "usage_delta" and agent.resync_requested:
+                    continue  # queued before an earlier message failed
+                try:
+                    self._handle_ws_message(json_data)
+                except Exception as e:
+                    ingest_log.error("Error handling message: %s", e, extra={"remote_addr": agent.remote_addr})
+                    self.sessions.apply_failed(agent, type)
+                    continue
+                # the socket may have closed while its messages were queued
+                if self.sessions.get(json_data["system_id"]) is agent:
+                    seen.add(json_data["system_id"])
+
+            now = int(time.time())
+            for system_id in seen:
+                system = self.db.get_system(system_id)
+                if system:
+                    if not system.connected:
+                        self._set_online(system)
+                    self.db.update_system(system_id, connected=True, last_seen=now)
+                    self.liveness.touch(system_id)
+
+    def _handle_ws_message(self, json_data: dict):
         system_id = json_data.get("system_id")
         timestamp = json_data.get("timestamp")
         type = json_data.get("type")
@@ -284,11 +725,6 @@ class Dashboard:
         if not system:
             raise ValueError(f"Unknown system ID: {system_id}")
 
-        self.client_map[ws] = system_id
-        self.db.update_system(system_id, connected=True)
-
-        system.last_seen = int(time.time())
-
         if type == "hardware_info":
             data = json_data["hardware"]
             
@@ -298,13 +734,13 @@ class Dashboard:
                 public_ip=data["network"]["public_ip"],
                 interfaces=data["network"]["interfaces"],
             )
-            os_info = SystemOS(
+            os_info = intern_strings(SystemOS(
                 system=data["os"]["system"],
                 release=data["os"]["release"],
                 version=data["os"]["version"],
                 machine=data["os"]["machine"],
                 processor=data["os"]["processor"],
-            )
+            ))
             cpu = SystemCPU(
                 physical_cores=data["cpu"]["physical_cores"],
                 logical_cores=data["cpu"]["logical_cores"],
@@ -314,12 +750,12 @@ class Dashboard:
                 total_gib=data["mem_total_gib"],
             )
             disks = [
-                SystemDisk(
+                intern_strings(SystemDisk(
                     device=disk["device"],
                     mountpoint=disk["mountpoint"],
                     fstype=disk["fstype"],
                     total_gib=disk["total_gib"],
-                )
+                ))
                 for disk in data["disks"]
             ]
 
@@ -333,57 +769,17 @@ class Dashboard:
                 memory=memory,
                 disks=disks
             )
+            self.aggregates.update(system)
 
         elif type == "usage_info":
             data = json_data["usage"]
 
-            cpu_pct = data["cpu_pct"]
-            mem_used_gib = data["mem_used_gib"]
-
-            if cpu_pct > 90:
-                self.db.add_event(system.id, Event.create_event(
-                    level=EventLevel.CRITICAL,
-                    type=EventType.CPU,
-                    timestamp=timestamp,
-                    clearable=True,
-                    description=f"CPU usage is at {cpu_pct}%."
-                ))
-            elif cpu_pct > 75:
-                self.db.add_event(system.id, Event.create_event(
-                    level=EventLevel.WARNING,
-                    type=EventType.CPU,
-                    timestamp=timestamp,
-                    clearable=True,
-                    description=f"CPU usage is at {cpu_pct}%."
-                ))
-
-            if mem_used_gib > 0.9 * system.memory.total_gib:
-                self.db.add_event(system.id, Event.create_event(
-                    level=EventLevel.CRITICAL,
-                    type=EventType.MEMORY,
-                    timestamp=timestamp,
-                    clearable=True,
-                    description=f"Memory usage is at {mem_used_gib} GiB."
-                ))
-            elif mem_used_gib > 0.75 * system.memory.total_gib:
-                self.db.add_event(system.id, Event.create_event(
-                    level=EventLevel.WARNING,
-                    type=EventType.MEMORY,
-                    timestamp=timestamp,
-                    clearable=True,
-                    description=f"Memory usage is at {mem_used_gib} GiB."
-                ))
-
-            for disk in data["disks"]:
-                device = disk["device"]
-                used_gib = disk["used_gib"]
-                
-                for sys_disk in system.disks:
-                    if sys_disk.device == device:
-                        sys_disk.used_gib = used_gib
-                        break
-
-            system.disks.sort(key=lambda d: d.total_gib, reverse=True)
+            self._record_usage(
+                system,
+                data["cpu_pct"],
+                data["mem_used_gib"],
+                {disk["device"]: disk["used_gib"] for disk in data["disks"]},
+            )
 
             network = SystemNetwork(
                 hostname=data["network"]["hostname"],
@@ -393,32 +789,64 @@ class Dashboard:
             )
 
             services = [
-                SystemService(
+                intern_strings(SystemService(
                     name=service["name"],
                     running=service.get("running", False),
                     status=service.get("status", ""),
-                )
+                ))
                 for service in json_data["watched_services"]
             ]
 
-            if any(not service.running for service in services):
+            # only journal these when the agent reports something new
+            if network != system.network:
+                self.db.update_system(system.id, network=network)
+            if services != system.services:
+                self.db.update_system(system.id, services=services)
+
+            self._check_alerts(system, timestamp)
+
+        elif type == "usage_delta":
+            # protocol 2, see protocol.py
+            data = json_data["usage"]
+
+            self._record_usage(system, data["cpu_pct"], data["mem_used_gib"], data["disks"])
+
+            # changed in place, then journaled (and replicated) as a whole
+            if "network" in data and protocol.apply_network(system.network, data["network"]):
+                self.db.update_system(system.id, network=system.network)
+            if "services" in json_data and protocol.apply_services(system.services, json_data["services"]):
+                self.db.update_system(system.id, services=system.services)
+
+            self._check_alerts(system, timestamp)
+
+    def _record_usage(self, system: System, cpu_pct: float, mem_used_gib: float, disks: dict[str, float]):
+        self.db.record_usage(system.id, cpu_pct=cpu_pct, mem_used_gib=mem_used_gib, disks=disks)
+        self.aggregates.update(system)
+
+        system.disks.sort(key=lambda d: d.total_gib, reverse=True)
+
+        self.history.record(system.id, time.time(), {
+            "cpu": cpu_pct,
+            "memory": mem_used_gib,
+            **{f"disk:{device}": used for device, used in disks.items()},
+        })
+
+    def _check_alerts(self, system: System, timestamp: float):
+        fired = self.alerts.evaluate(system, self.db.get_system_site(system.id).name, time.monotonic())
+        if fired:
+            for rule, value in fired:
                 self.db.add_event(system.id, Event.create_event(
-                    level=EventLevel.WARNING,
-                    type=EventType.SERVICE,
+                    level=rule.level,
+                    type=METRICS[rule.metric][1],
                     timestamp=timestamp,
                     clearable=True,
-                    description="One or more services are not running."
+                    description=rule.description.format(value=value)
                 ))
 
-            system.cpu.usage_pct = cpu_pct
-            system.memory.used_gib = mem_used_gib
-            system.network = network
-            system.services = services
-
-        elif type == "get_watch_services":
-            services = [service.name for service in system.services]
-            await ws.send(json.dumps({"type": "set_watch_services", "services": services}))
-
     def run(self):
-        print(f"Starting on {self.config.dashboard_host}:{self.config.dashboard_port}")
-        self.app.run(host=self.config.dashboard_host, port=self.config.dashboard_port)
\ No newline at end of file
+        logger.info("Starting on %s:%s", self.config.dashboard_host, self.config.dashboard_port)
+        self.app.run(host=self.config.dashboard_host, port=self.config.dashboard_port)
+
+def create_app():
+    """Application factory for the Hypercorn worker processes in multi-worker mode."""
+    return Dashboard(Config.from_toml()).app
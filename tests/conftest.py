@@ -0,0 +1,70 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# the server modules import each other as top-level modules from core/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "core"))
+
+from db import SystemDB
+from snapshot import EXTENSIONS
+from models import Provider, Site, SiteType, System, SystemType
+from util import Config
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def open_db(path, **kwargs) -> SystemDB:
+    """A SystemDB with all of its files in *path*."""
+    return SystemDB(
+        structure_path=str(path / "structure.json"),
+        data_path=str(path / ("data" + EXTENSIONS[kwargs.get("snapshot_format", "json")])),
+        journal_path=str(path / "data.journal"),
+        event_archive_path=str(path / "events.archive.jsonl"),
+        **kwargs,
+    )
+
+
+def drain(db: SystemDB):
+    """Wait for the writes submitted so far."""
+    db._writer.submit(lambda: None).result()
+
+
+@pytest.fixture
+def fleet_db(tmp_path):
+    """A SystemDB holding one provider with one site of three systems."""
+    db = open_db(tmp_path)
+    db.add_provider(Provider(name="Provider", sites=[]))
+    db.add_site("Provider", Site(name="Home", type=SiteType.HOUSE, geoname="", systems=[]))
+    for i in range(3):
+        db.add_system("Home", System(id=f"s{i}", name=f"System {i}", type=SystemType.SERVER))
+    drain(db)
+    return db
+
+
+@pytest.fixture
+def make_dashboard(tmp_path, monkeypatch):
+    """
+    Builds a Dashboard with its data files in *tmp_path*, a Redis that
+    can't be reached and no background tasks, for the Quart test client.
+    """
+    from web import Dashboard
+
+    monkeypatch.chdir(tmp_path)
+    dashboards = []
+
+    def make(**kwargs) -> Dashboard:
+        kwargs.setdefault("redis_url", "redis://127.0.0.1:1/0")
+        kwargs.setdefault("redis_connect_timeout", 0.2)
+        kwargs.setdefault("persistence_flush_interval", 0)
+        dashboard = Dashboard(Config(**kwargs))
+        # templates and static files are looked up from the repository root
+        dashboard.app.root_path = str(REPO)
+        dashboards.append(dashboard)
+        return dashboard
+
+    yield make
+    # the data files are relative, written before the working directory is restored
+    for dashboard in dashboards:
+        drain(dashboard.db)
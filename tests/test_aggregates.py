@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from aggregates import FleetAggregates
+from models import Provider, Site, SiteType, System, SystemType
+
+
+def make_aggregates(usage: dict[str, list[float]]) -> FleetAggregates:
+    sites = []
+    for site_name, values in usage.items():
+        systems = []
+        for i, value in enumerate(values):
+            system = System(id=f"{site_name}-{i}", name=f"{site_name}-{i}", type=SystemType.SERVER, last_seen=1)
+            system.cpu.usage_pct = value
+            systems.append(system)
+        sites.append(Site(name=site_name, type=SiteType.DATACENTER, geoname="", systems=systems))
+    aggregates = FleetAggregates()
+    aggregates.rebuild([Provider(name="p", sites=sites)], 0)
+    return aggregates
+
+
+def test_percentiles_match_numpy():
+    usage = {"a": [10, 20, 30, 40], "b": [55, 5, 70]}
+    result = make_aggregates(usage).compute("cpu", "site", [0, 25, 50, 90, 100], top=2)
+    for group in result["groups"]:
+        for p in (0, 25, 50, 90, 100):
+            assert group[f"p{p:g}"] == pytest.approx(np.percentile(usage[group["name"]], p))
+    assert [t["value"] for t in result["top"]] == [70, 55]
+
+
+def test_percentiles_out_of_range_are_rejected():
+    aggregates = make_aggregates({"a": [10, 20], "b": [50, 60]})
+    for p in (-1, 150, float("nan")):
+        with pytest.raises(ValueError):
+            aggregates.compute("cpu", "site", [p], top=0)
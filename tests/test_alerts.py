@@ -0,0 +1,60 @@
+from alerts import AlertEngine
+from models import EventLevel, System, SystemType
+
+
+def make_system() -> System:
+    return System(id="s1", name="s1", type=SystemType.SERVER)
+
+
+def sample(engine: AlertEngine, system: System, cpu: float, now: float) -> list[tuple[str, str]]:
+    system.cpu.usage_pct = cpu
+    fired = engine.evaluate(system, "Home", now)
+    return [(rule.metric, rule.level) for rule, _ in fired or []]
+
+
+def test_lower_level_fires_after_higher_clears():
+    engine = AlertEngine()
+    system = make_system()
+    assert sample(engine, system, 95, 0) == [("cpu", EventLevel.CRITICAL)]
+    assert sample(engine, system, 80, 1) == [("cpu", EventLevel.WARNING)]
+    assert sample(engine, system, 50, 2) == []
+    assert sample(engine, system, 80, 3) == [("cpu", EventLevel.WARNING)]
+
+
+def test_fires_on_every_sample_above():
+    engine = AlertEngine()
+    system = make_system()
+    assert [sample(engine, system, 80, t) for t in range(3)] == [[("cpu", EventLevel.WARNING)]] * 3
+    assert engine.stats()["fired"] == 3
+
+
+def test_sustained_and_hysteresis():
+    engine = AlertEngine([{"metric": "cpu", "level": "warn", "above": 75, "clear_below": 60, "sustained": 10}])
+    system = make_system()
+    assert sample(engine, system, 80, 0) == []
+    assert sample(engine, system, 80, 5) == []
+    assert sample(engine, system, 80, 10) == [("cpu", EventLevel.WARNING)]
+    # inside the band the rule stays active and fires again right away
+    assert sample(engine, system, 70, 11) == []
+    assert sample(engine, system, 80, 12) == [("cpu", EventLevel.WARNING)]
+    # cleared, so it has to be sustained again
+    assert sample(engine, system, 55, 13) == []
+    assert sample(engine, system, 80, 14) == []
+    assert sample(engine, system, 80, 24) == [("cpu", EventLevel.WARNING)]
+
+
+def test_dip_resets_sustained_timer():
+    engine = AlertEngine([{"metric": "cpu", "level": "warn", "above": 75, "sustained": 10}])
+    system = make_system()
+    assert sample(engine, system, 80, 0) == []
+    assert sample(engine, system, 70, 5) == []
+    assert sample(engine, system, 80, 10) == []
+    assert sample(engine, system, 80, 20) == [("cpu", EventLevel.WARNING)]
+
+
+def test_rules_scoped_by_group_and_site():
+    engine = AlertEngine([{"metric": "cpu", "level": "warn", "above": 75, "sites": ["Office"]}])
+    system = make_system()
+    assert sample(engine, system, 80, 0) == []
+    system.cpu.usage_pct = 80
+    assert engine.evaluate(system, "Office", 1)
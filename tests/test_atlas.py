@@ -0,0 +1,27 @@
+from PIL import Image
+
+from atlas import atlas_current, build_atlas
+from util import SystemImage, SystemImageRegistry
+
+
+def make_registry(folder) -> SystemImageRegistry:
+    for variation, color in (("on", (0, 255, 0, 255)), ("off", (255, 0, 0, 255))):
+        Image.new("RGBA", (40, 40), color).save(folder / f"box_{variation}.png")
+    registry = SystemImageRegistry()
+    registry.register(SystemImage("box", max_stack=2, stack_shift_y=-10, base_folder=str(folder)))
+    return registry
+
+
+def test_atlas_is_rebuilt_when_layers_change(tmp_path):
+    registry = make_registry(tmp_path)
+    out = tmp_path / "atlas"
+    assert not atlas_current(registry, out, sizes=(64,))
+
+    index = build_atlas(registry, out, sizes=(64,))
+    assert sorted(index["tiles"]) == ["box/off/1@64", "box/off/2@64", "box/on/1@64", "box/on/2@64"]
+    assert (out / index["image"]).exists()
+    assert atlas_current(registry, out, sizes=(64,))
+    assert not atlas_current(registry, out, sizes=(64, 128))
+
+    Image.new("RGBA", (40, 40), (0, 0, 255, 255)).save(tmp_path / "box_on.png")
+    assert not atlas_current(registry, out, sizes=(64,))
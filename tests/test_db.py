@@ -0,0 +1,186 @@
+import asyncio
+import json
+
+from conftest import drain, open_db
+from models import Event, EventLevel, EventType, Provider, Site, SiteType, System, SystemType
+
+
+def journal_lines(path) -> list[dict]:
+    return [json.loads(line) for line in (path / "data.journal").read_text().splitlines()]
+
+
+def mutate(db):
+    db.update_system("s0", name="Renamed")
+    db.record_usage("s1", 42.0, 3.5, {})
+    db.add_event("s2", Event.create_event(EventLevel.WARNING, EventType.OFFLINE, 1000.0))
+    drain(db)
+
+
+def test_journal_is_replayed_on_load(fleet_db, tmp_path):
+    generation = fleet_db.generation
+    mutate(fleet_db)
+    # appended to the journal, not compacted
+    assert fleet_db.generation == generation
+    assert [line["op"] for line in journal_lines(tmp_path)][-3:] == ["set", "usage", "event"]
+
+    db = open_db(tmp_path)
+    assert db.generation == generation
+    assert db.get_system("s0").name == "Renamed"
+    assert db.get_system("s1").cpu.usage_pct == 42.0
+    assert [event.type for event in db.get_system("s2").events] == [EventType.OFFLINE]
+    assert not db._needs_compaction()
+
+
+def test_compaction_starts_a_new_journal(fleet_db, tmp_path):
+    fleet_db.journal_max_bytes = 1
+    generation = fleet_db.generation
+    count = fleet_db.compaction_count
+    mutate(fleet_db)
+
+    assert fleet_db.generation > generation
+    assert fleet_db.compaction_count > count
+    header, *records = journal_lines(tmp_path)
+    assert header == {"op": "generation", "gen": fleet_db.generation}
+    assert records == []
+
+    db = open_db(tmp_path)
+    assert db.get_system("s0").name == "Renamed"
+    assert db.get_system("s1").cpu.usage_pct == 42.0
+
+
+def test_stale_journal_is_ignored(fleet_db, tmp_path):
+    mutate(fleet_db)
+    stale = (tmp_path / "data.journal").read_text()
+    fleet_db.update_system("s0", name="Compacted")
+    fleet_db.save_to_file()
+    # a crash between the snapshot and the new journal header
+    (tmp_path / "data.journal").write_text(stale)
+
+    db = open_db(tmp_path)
+    assert db.get_system("s0").name == "Compacted"
+    assert db._needs_compaction()
+
+
+def test_torn_journal_record_is_ignored(fleet_db, tmp_path):
+    fleet_db.update_system("s0", name="Complete")
+    drain(fleet_db)
+    with open(tmp_path / "data.journal", "a", encoding="utf-8") as f:
+        f.write('{"op": "set", "id": "s0", "fields": {"name": "To')
+
+    db = open_db(tmp_path)
+    assert db.get_system("s0").name == "Complete"
+    # the next write compacts instead of appending after the torn line
+    assert db._needs_compaction()
+
+
+def test_snapshot_converts_only_changed_systems(fleet_db):
+    providers, _, _ = fleet_db.snapshot()
+    before = {s["id"]: s for s in providers[0]["sites"][0]["systems"]}
+    fleet_db.record_usage("s1", 12.0, 1.0, {})
+
+    providers, _, _ = fleet_db.snapshot()
+    after = {s["id"]: s for s in providers[0]["sites"][0]["systems"]}
+    assert after["s0"] is before["s0"] and after["s2"] is before["s2"]
+    assert after["s1"] is not before["s1"]
+    assert after["s1"]["cpu"]["usage_pct"] == 12.0
+    # the earlier snapshot, possibly still being written, is left alone
+    assert before["s1"]["cpu"]["usage_pct"] != 12.0
+
+
+def test_snapshot_follows_structural_changes(fleet_db):
+    fleet_db.snapshot()
+    fleet_db.edit_system("s2", name="A first")
+    fleet_db.remove_system("s0")
+
+    providers, structure, _ = fleet_db.snapshot()
+    systems = providers[0]["sites"][0]["systems"]
+    assert [(s["id"], s["name"]) for s in systems] == [("s2", "A first"), ("s1", "System 1")]
+    assert [s["id"] for s in structure["providers"][0]["sites"][0]["systems"]] == ["s2", "s1"]
+
+
+def test_bad_journal_record_stops_replay(fleet_db, tmp_path):
+    fleet_db.update_system("s0", name="Applied")
+    drain(fleet_db)
+    with open(tmp_path / "data.journal", "a", encoding="utf-8") as f:
+        f.write('{"op": "usage", "id": "s1", "cpu": 50.0}\n')
+        f.write('{"op": "set", "id": "s0", "fields": {"name": "After"}}\n')
+
+    db = open_db(tmp_path)
+    assert db.get_system("s0").name == "Applied"
+    assert db._needs_compaction()
+
+
+def test_unknown_journal_op_stops_replay(fleet_db, tmp_path):
+    drain(fleet_db)
+    with open(tmp_path / "data.journal", "a", encoding="utf-8") as f:
+        f.write('{"op": "rename", "id": "s0"}\n')
+        f.write('[1, 2]\n')
+
+    db = open_db(tmp_path)
+    assert db.get_system("s0").name == "System 0"
+    assert db._needs_compaction()
+
+
+def test_write_behind_coalesces_changes(tmp_path):
+    db = open_db(tmp_path, flush_interval=0.05)
+    db.add_provider(Provider(name="Provider", sites=[]))
+    db.add_site("Provider", Site(name="Home", type=SiteType.HOUSE, geoname="", systems=[]))
+    db.add_system("Home", System(id="s0", name="System 0", type=SystemType.SERVER))
+
+    async def run():
+        db.start()
+        for i in range(20):
+            db.record_usage("s0", float(i), 1.0, {})
+        # nothing is written until the flush interval passes
+        assert not (tmp_path / "data.json").exists()
+        assert db.dirty
+        await asyncio.sleep(0.2)
+        assert not db.dirty
+        flushes = db.flush_count
+
+        db.update_system("s0", name="Stopped")
+        await db.stop()
+        assert db.flush_count == flushes + 1
+
+    asyncio.run(run())
+    assert db.flush_count <= 3
+    assert db.coalesced_writes >= 19
+    reloaded = open_db(tmp_path)
+    assert reloaded.get_system("s0").cpu.usage_pct == 19.0
+    assert reloaded.get_system("s0").name == "Stopped"
+
+
+def test_batch_commits_once(fleet_db):
+    flushes = fleet_db.flush_count
+    with fleet_db.batch():
+        for system_id in ("s0", "s1", "s2"):
+            fleet_db.update_system(system_id, last_seen=7)
+    drain(fleet_db)
+    assert fleet_db.flush_count == flushes + 1
+
+
+def test_indexes_follow_structural_changes(fleet_db):
+    db = fleet_db
+    db.add_site("Provider", Site(name="Office", type=SiteType.HOUSE, geoname="", systems=[]))
+    db.add_system("Office", System(id="o0", name="Office 0", type=SystemType.DESKTOP))
+    assert db.get_system_site("o0").name == "Office"
+
+    db.edit_system_id("s0", "renamed")
+    assert db.get_system("s0") is None
+    assert db.get_system("renamed").name == "System 0"
+    assert db.get_system_site("renamed").name == "Home"
+
+    db.edit_site("Provider", "Office", name="Branch")
+    assert db.get_site("Office") is None
+    assert db.get_site("Branch").systems[0].id == "o0"
+
+    db.remove_system("s1")
+    assert db.get_system("s1") is None
+    db.remove_site("Provider", "Branch")
+    assert db.get_system("o0") is None and db.get_site("Branch") is None
+
+    db.edit_provider("Provider", name="Renamed")
+    assert db.get_provider("Provider") is None
+    assert sorted(s.id for s in db.systems()) == ["renamed", "s2"]
+    db.remove_provider("Renamed")
+    assert db.systems() == [] and db.get_site("Home") is None
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+
+from conftest import drain, open_db
+from models import Event, EventLevel, EventType, Provider, Site, SiteType, System, SystemType
+
+
+def make_db(path, **kwargs):
+    path.mkdir(exist_ok=True)
+    db = open_db(path, **kwargs)
+    db.add_provider(Provider(name="Provider", sites=[]))
+    db.add_site("Provider", Site(name="Home", type=SiteType.HOUSE, geoname="", systems=[]))
+    db.add_system("Home", System(id="s0", name="System 0", type=SystemType.SERVER))
+    return db
+
+
+def add_cleared(db, timestamp: float) -> Event:
+    event = Event.create_event(EventLevel.INFO, EventType.ONLINE, timestamp, clearable=True)
+    db.add_event("s0", event)
+    db.clear_event("s0", event.id)
+    return event
+
+
+def archived(path) -> list[str]:
+    archive = path / "events.archive.jsonl"
+    if not archive.exists():
+        return []
+    return [json.loads(line)["event"]["id"] for line in archive.read_text().splitlines()]
+
+
+def test_age_sweep_runs_without_write_behind(tmp_path, monkeypatch):
+    db = make_db(tmp_path, flush_interval=0, event_max_age=60)
+    old = add_cleared(db, time.time() - 120)
+    monkeypatch.setattr(db, "EVENT_SWEEP_INTERVAL", 0.01)
+
+    async def run():
+        db.start()
+        await asyncio.sleep(0.05)
+        await db.stop()
+
+    asyncio.run(run())
+    drain(db)
+    assert db.get_system("s0").events == []
+    assert archived(tmp_path) == [old.id]
+
+
+def test_only_the_persisting_worker_archives(tmp_path):
+    primary = make_db(tmp_path / "primary", event_max_count=1)
+    replica = make_db(tmp_path / "replica", event_max_count=1)
+    lines = []
+    primary.replicate = lines.append
+    replica.set_persist(False)
+    replica.replicate = lambda line: primary.apply_remote(line)
+
+    first = add_cleared(replica, time.time())
+    add_cleared(replica, time.time())
+    drain(primary)
+    drain(replica)
+
+    # the replica keeps both until the primary's prune record arrives
+    assert len(replica.get_system("s0").events) == 2
+    assert archived(tmp_path / "replica") == []
+    assert archived(tmp_path / "primary") == [first.id]
+
+    for line in lines:
+        replica.apply_remote(line)
+    remaining = [e.id for e in replica.get_system("s0").events]
+    assert len(remaining) == 1 and first.id not in remaining
+
+
+def test_sweep_visits_only_systems_with_aged_events(tmp_path, monkeypatch):
+    db = make_db(tmp_path)
+    db.add_system("Home", System(id="s1", name="System 1", type=SystemType.SERVER))
+    old = add_cleared(db, time.time() - 120)
+    recent = add_cleared(db, time.time())
+    db.add_event("s1", Event.create_event(EventLevel.WARNING, EventType.OFFLINE, time.time() - 120))
+    # retention tightened after the events were cleared
+    db.events.max_age = 60
+
+    visited = []
+    expire = db._expire_events
+    monkeypatch.setattr(db, "_expire_events", lambda system: (visited.append(system.id), expire(system)))
+    db.expire_events()
+    drain(db)
+    assert visited == ["s0"]
+    assert [e.id for e in db.get_system("s0").events] == [recent.id]
+    assert len(db.get_system("s1").events) == 1
+    assert archived(tmp_path) == [old.id]
+
+    db.expire_events()
+    assert visited == ["s0"]
+
+
+def test_count_retention_drops_oldest_cleared_first(tmp_path):
+    db = make_db(tmp_path, event_max_count=2, event_max_age=0)
+    now = time.time()
+    newer = add_cleared(db, now - 10)
+    older = add_cleared(db, now - 20)
+    active = Event.create_event(EventLevel.CRITICAL, EventType.OFFLINE, now - 30)
+    db.add_event("s0", active)
+    drain(db)
+
+    # the uncleared event stays even though it is the oldest
+    assert [e.id for e in db.get_system("s0").events] == [newer.id, active.id]
+    assert archived(tmp_path) == [older.id]
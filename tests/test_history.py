@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+from timeseries import TimeSeriesStore
+
+START = 1_700_000_000
+
+
+def record(store: TimeSeriesStore, system_id: str, start: int, count: int, metrics=("cpu", "memory")):
+    for i in range(start, start + count):
+        store.record(system_id, START + i * 10, {metric: float(i % 100) for metric in metrics})
+
+
+def snapshot(store: TimeSeriesStore) -> dict:
+    return {
+        (system_id, metric, resolution): series.window(resolution, 0, 2 ** 32)
+        for system_id, system_series in store.series.items()
+        for metric, series in system_series.items()
+        for resolution in ("raw", "1m", "1h")
+    }
+
+
+def test_saves_append_new_samples_and_reload(tmp_path):
+    path = str(tmp_path / "history.bin")
+    store = TimeSeriesStore(path=path, raw_samples=50)
+
+    async def run():
+        record(store, "s0", 0, 40)
+        await store.save_async()
+        full = os.path.getsize(path)
+
+        record(store, "s0", 40, 3)
+        await store.save_async()
+        appended = os.path.getsize(path) - full
+        # only the three new raw samples (plus headers) were written
+        assert 0 < appended < full / 4
+        assert store.compactions == 1
+
+        # the ring wraps between saves
+        record(store, "s0", 43, 60)
+        record(store, "s1", 0, 5)
+        await store.save_async()
+        await store.stop()
+
+    asyncio.run(run())
+    reloaded = TimeSeriesStore(path=path, raw_samples=50)
+    assert snapshot(reloaded) == snapshot(store)
+    assert len(reloaded.series["s0"]["cpu"].raw.times) == 50
+
+
+def test_rename_and_drop_compact(tmp_path):
+    path = str(tmp_path / "history.bin")
+    store = TimeSeriesStore(path=path)
+    record(store, "s0", 0, 10)
+    record(store, "s1", 0, 10)
+    store.save()
+
+    store.rename("s0", "s2")
+    store.drop("s1")
+    record(store, "s2", 10, 2)
+    store.save()
+    assert store.compactions == 2
+
+    reloaded = TimeSeriesStore(path=path)
+    assert reloaded.metrics("s0") == reloaded.metrics("s1") == []
+    assert snapshot(reloaded) == snapshot(store)
+
+
+def test_torn_record_is_ignored(tmp_path):
+    path = str(tmp_path / "history.bin")
+    store = TimeSeriesStore(path=path)
+    record(store, "s0", 0, 10, metrics=("cpu",))
+    store.save()
+    complete = snapshot(store)
+    record(store, "s0", 10, 5, metrics=("cpu",))
+    store.save()
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 3)
+
+    reloaded = TimeSeriesStore(path=path)
+    assert snapshot(reloaded) == complete
+    # the next save rewrites the file instead of appending after the torn record
+    assert reloaded._compact_requested
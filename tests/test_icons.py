@@ -0,0 +1,29 @@
+from PIL import Image
+
+from util import SystemImage, SystemImageRegistry
+
+
+def make_registry(folder) -> SystemImageRegistry:
+    for name in ("box", "flat"):
+        for variation, color in (("on", (0, 255, 0, 255)), ("off", (255, 0, 0, 255))):
+            Image.new("RGBA", (40, 40), color).save(folder / f"{name}_{variation}.png")
+    registry = SystemImageRegistry()
+    registry.register(SystemImage("box", max_stack=2, stack_shift_y=-10, base_folder=str(folder)))
+    registry.register(SystemImage("flat", max_stack=1, base_folder=str(folder)))
+    return registry
+
+
+def test_variations_past_the_stack_share_a_cache_entry(tmp_path):
+    registry = make_registry(tmp_path)
+    first = registry.render("box", ["on", "off"])
+    assert registry.render("box", ["on", "off", "on", "on"]) == first
+    assert registry.render("box", ["on", "off", "off"]) == first
+    assert registry.stats() == {"cached": 1, "hits": 2, "misses": 1}
+
+
+def test_unstackable_icons_use_the_first_variation(tmp_path):
+    registry = make_registry(tmp_path)
+    assert registry.find("flat").layers(["off", "on"]) == ("off",)
+    registry.render("flat", ["off"])
+    registry.render("flat", ["off", "on"])
+    assert registry.stats()["cached"] == 1
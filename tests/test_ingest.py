@@ -0,0 +1,40 @@
+import asyncio
+
+from ingest import IngestQueue
+
+
+def test_stop_during_batch_window_applies_the_batch():
+    handled = []
+
+    async def run():
+        queue = IngestQueue(handled.extend, batch_size=10, batch_window_ms=10_000)
+        queue.start()
+        for i in range(4):
+            await queue.put(i)
+        # the worker has taken these off the queue and waits out the window
+        await asyncio.sleep(0.01)
+        for i in range(4, 6):
+            await queue.put(i)
+        assert handled == []
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(run())
+    assert handled == [0, 1, 2, 3, 4, 5]
+    assert queue.processed == 6
+    assert queue.batches == 1
+
+
+def test_burst_is_handled_in_batches():
+    batches = []
+
+    async def run():
+        queue = IngestQueue(batches.append, batch_size=3, batch_window_ms=5)
+        queue.start()
+        for i in range(7):
+            await queue.put(i)
+        await asyncio.sleep(0.1)
+        await queue.stop()
+
+    asyncio.run(run())
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
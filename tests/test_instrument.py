@@ -0,0 +1,31 @@
+import threading
+
+from instrument import Instruments
+
+
+def test_render_while_another_thread_adds_labels():
+    instruments = Instruments()
+    done = threading.Event()
+
+    def writer():
+        for i in range(20000):
+            instruments.observe("persistence_write_seconds", 0.001, ("kind", f"k{i}"))
+        done.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while not done.is_set():
+        instruments.render()
+        instruments.stats()
+    thread.join()
+    assert len(instruments.stats()["persistence_write_seconds"]) == 20000
+
+
+def test_render_format():
+    instruments = Instruments()
+    instruments.observe("loop_lag_seconds", 0.003)
+    instruments.count("messages_total", ("type", "usage_info"), n=2)
+    text = instruments.render().decode()
+    assert 'sysmon_server_loop_lag_seconds_bucket{le="0.005"} 1' in text
+    assert 'sysmon_server_loop_lag_seconds_bucket{le="+Inf"} 1' in text
+    assert 'sysmon_server_messages_total{type="usage_info"} 2' in text
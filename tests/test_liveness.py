@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+from liveness import LivenessSweeper
+
+
+def test_sweep_expires_silent_systems():
+    sweeper = LivenessSweeper(on_expired=lambda ids: None, timeout=10)
+    start = time.monotonic()
+    for system_id in ("s0", "s1", "s2", "s3"):
+        sweeper.touch(system_id)
+    sweeper.forget("s2")
+    sweeper.rename("s3", "s4")
+
+    assert sweeper.sweep(start + 5) == []
+    # s0 talked again, its heap entry is pushed back when it comes due
+    sweeper.timeout = 20
+    sweeper.touch("s0")
+    assert sorted(sweeper.sweep(start + 11)) == ["s1", "s4"]
+    assert sweeper.rescheduled == 1
+    assert "s0" in sweeper and "s1" not in sweeper and "s2" not in sweeper
+
+    assert sweeper.sweep(start + 26) == ["s0"]
+    assert sweeper.stats() == {"tracked": 0, "heap": 0, "expired": 3, "rescheduled": 1}
+
+
+def test_touch_postpones_expiry():
+    sweeper = LivenessSweeper(on_expired=lambda ids: None, timeout=0.2)
+    sweeper.touch("s0")
+    time.sleep(0.12)
+    sweeper.touch("s0")
+    time.sleep(0.12)
+    assert sweeper.sweep() == []
+    time.sleep(0.12)
+    assert sweeper.sweep() == ["s0"]
+
+
+def test_running_sweeper_reports_expired_systems():
+    expired = []
+    sweeper = LivenessSweeper(on_expired=expired.extend, timeout=0.02, interval=0.01)
+
+    async def run():
+        sweeper.start()
+        sweeper.touch("s0")
+        await asyncio.sleep(0.1)
+        await sweeper.stop()
+
+    asyncio.run(run())
+    assert expired == ["s0"]
@@ -0,0 +1,40 @@
+import logging
+
+import log
+import util
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_missing_config_is_logged(tmp_path):
+    handler = ListHandler()
+    util.logger.addHandler(handler)
+    try:
+        config = util.Config.from_toml(str(tmp_path / "config.toml"))
+    finally:
+        util.logger.removeHandler(handler)
+    assert config.dashboard_port == util.Config().dashboard_port
+    assert [r.levelno for r in handler.records] == [logging.WARNING]
+    assert "not found" in handler.records[0].getMessage()
+
+
+def test_limiter_samples_info_and_reports_suppressed():
+    limiter = log.CategoryLimiter(sample={"agent": 0.0}, rate={"db": 2})
+
+    def record(category, level=logging.INFO):
+        return logging.LogRecord(f"sysmon.{category}", level, "", 0, "message", (), None)
+
+    assert not limiter.filter(record("agent"))
+    # warnings are never sampled away
+    assert limiter.filter(record("agent", logging.WARNING))
+
+    results = [limiter.filter(record("db")) for _ in range(5)]
+    assert results == [True, True, False, False, False]
+    assert limiter.suppressed_total == 4
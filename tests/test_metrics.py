@@ -0,0 +1,49 @@
+from metrics import MetricsExporter
+from models import SystemDisk
+
+
+def samples(output: bytes, name: str) -> dict[str, str]:
+    """label set: value of the samples of *name*"""
+    result = {}
+    for line in output.decode().splitlines():
+        if line.startswith(name + "{"):
+            labels, value = line[len(name):].rsplit(" ", 1)
+            result[labels] = value
+    return result
+
+
+def test_render_follows_changes(fleet_db):
+    exporter = MetricsExporter(fleet_db)
+    fleet_db.update_system("s0", connected=True)
+    output = exporter.render()
+    assert b"# TYPE sysmon_system_up gauge" in output
+    up = samples(output, "sysmon_system_up")
+    assert up['{system="s0",name="System 0",provider="Provider",site="Home",group=""}'] == "1"
+    assert len(up) == 3
+    assert exporter.rendered == 3
+
+    # nothing changed, the previous output is served
+    assert exporter.render() is output
+    fleet_db.record_usage("s1", 25.0, 2.0, {})
+    output = exporter.render()
+    assert exporter.rendered == 4
+    assert samples(output, "sysmon_system_cpu_usage_percent")['{system="s1",name="System 1",provider="Provider",site="Home",group=""}'] == "25.0"
+    assert exporter.stats() == {"systems": 3, "stale": 0, "scrapes": 3, "rendered": 4}
+
+
+def test_render_relabels_after_structural_changes(fleet_db):
+    exporter = MetricsExporter(fleet_db)
+    exporter.render()
+    fleet_db.edit_system("s0", name='Quoted "name"')
+    fleet_db.remove_system("s2")
+    fleet_db.get_system("s1").disks.append(SystemDisk(device="/dev/sda1", mountpoint="/", fstype="ext4", total_gib=1.0))
+    fleet_db.update_system("s1", last_seen=1)
+
+    output = exporter.render()
+    up = samples(output, "sysmon_system_up")
+    assert sorted(up) == [
+        '{system="s0",name="Quoted \\"name\\"",provider="Provider",site="Home",group=""}',
+        '{system="s1",name="System 1",provider="Provider",site="Home",group=""}',
+    ]
+    disks = samples(output, "sysmon_system_disk_total_bytes")
+    assert disks == {'{system="s1",name="System 1",provider="Provider",site="Home",group="",device="/dev/sda1",mountpoint="/"}': str(1024 ** 3)}
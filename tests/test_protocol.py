@@ -0,0 +1,189 @@
+import asyncio
+import json
+
+import msgpack
+import pytest
+
+import protocol
+from models import SystemNetwork, SystemService
+from sessions import AgentSession, SessionRegistry
+
+
+class FakeSocket:
+    remote_addr = "127.0.0.1"
+    headers = {}
+
+
+def test_session_reports_deflate():
+    class DeflateSocket(FakeSocket):
+        headers = {"Sec-WebSocket-Extensions": "permessage-deflate; client_max_window_bits"}
+
+    assert AgentSession(DeflateSocket(), 1).deflate
+    assert not AgentSession(FakeSocket(), 1).deflate
+
+
+class RecordingSocket(FakeSocket):
+    def __init__(self):
+        self.messages = []
+        self.blocked = asyncio.Event()
+        self.blocked.set()
+
+    async def send(self, message):
+        await self.blocked.wait()
+        self.messages.append(json.loads(message))
+
+
+def sent(session: AgentSession) -> list[dict]:
+    messages = []
+    while not session._queue.empty():
+        messages.append(json.loads(session._queue.get_nowait()))
+    return messages
+
+
+def test_negotiate():
+    assert protocol.negotiate([1, 2]) == 2
+    assert protocol.negotiate([1, 2, 7]) == 2
+    assert protocol.negotiate([1]) == 1
+    assert protocol.negotiate([9]) == 1
+    assert protocol.negotiate(None) == 1
+
+
+def test_message_framing():
+    message = {"type": "usage_info", "system_id": "s0", "usage": {"cpu_pct": 1.5, "disks": {"/dev/sda1": 2.0}}}
+    assert protocol.decode_message(protocol.encode_message(message, False)) == message
+    frame = protocol.encode_message(message, True)
+    assert isinstance(frame, bytes) and msgpack.unpackb(frame) == message
+    assert protocol.decode_message(frame) == message
+
+    with pytest.raises(ValueError):
+        protocol.decode_message("{not json")
+
+
+def test_apply_network():
+    network = SystemNetwork(hostname="a", fqdn="a.lan", public_ip="1.2.3.4", interfaces={"eth0": ["10.0.0.1"]})
+    assert not protocol.apply_network(network, {"hostname": "a", "interfaces": {"eth0": ["10.0.0.1"]}})
+    assert protocol.apply_network(network, {"public_ip": "5.6.7.8", "interfaces": {"eth0": None, "wg0": ["10.8.0.1"]}})
+    assert network.public_ip == "5.6.7.8"
+    assert network.interfaces == {"wg0": ["10.8.0.1"]}
+    assert not protocol.apply_network(network, {"interfaces": {"eth1": None}})
+
+
+def test_apply_services():
+    services = [SystemService(name="nginx", running=True, status="active")]
+    assert not protocol.apply_services(services, {"nginx": {"running": True}})
+    assert protocol.apply_services(services, {"nginx": {"running": False, "status": "failed"}, "sshd": {"running": True}})
+    assert [(s.name, s.running, s.status) for s in services] == [("nginx", False, "failed"), ("sshd", True, "")]
+    assert protocol.apply_services(services, {"nginx": None, "redis": None})
+    assert [s.name for s in services] == ["sshd"]
+
+
+def test_sequence_gap_requests_one_resync():
+    registry = SessionRegistry()
+    session = AgentSession(FakeSocket(), registry.queue_size)
+    session.binary = False
+    session.protocol = 2
+
+    # a delta before any baseline can't be applied
+    assert not registry.check_sequence(session, "usage_delta", 1)
+    assert registry.check_sequence(session, "usage_info", 5)
+    assert registry.check_sequence(session, "usage_delta", 6)
+    assert session.seq == 6
+
+    # a gap drops every delta until the next full usage_info
+    assert not registry.check_sequence(session, "usage_delta", 8)
+    assert not registry.check_sequence(session, "usage_delta", 9)
+    assert session.seq == 6
+    assert registry.check_sequence(session, "usage_info", 10)
+    assert registry.check_sequence(session, "usage_delta", 11)
+
+    assert sent(session) == [{"type": "resync", "seq": None}, {"type": "resync", "seq": 6}]
+    assert registry.resyncs == 2
+
+
+def test_version_1_agents_get_no_deltas():
+    registry = SessionRegistry()
+    session = AgentSession(FakeSocket(), registry.queue_size)
+    session.binary = False
+    assert registry.check_sequence(session, "usage_info", None)
+    assert registry.check_sequence(session, "hardware_info", None)
+    assert not registry.check_sequence(session, "usage_delta", 1)
+
+
+def test_failed_apply_drops_deltas_until_full_usage():
+    registry = SessionRegistry()
+    session = AgentSession(FakeSocket(), registry.queue_size)
+    session.binary = False
+    session.protocol = 2
+
+    assert registry.check_sequence(session, "usage_info", 1)
+    assert registry.check_sequence(session, "usage_delta", 2)
+    # applying seq 2 failed after it was accepted
+    registry.apply_failed(session, "usage_delta")
+    assert not registry.check_sequence(session, "usage_delta", 3)
+    assert registry.check_sequence(session, "usage_info", 4)
+    assert registry.check_sequence(session, "usage_delta", 5)
+
+    assert sent(session) == [{"type": "resync", "seq": 2}]
+    # failures of other messages don't touch the sequence
+    registry.apply_failed(session, "hardware_info")
+    assert sent(session) == []
+
+
+def test_registry_binds_replaces_and_renames():
+    async def run():
+        registry = SessionRegistry()
+        first = registry.open(RecordingSocket())
+        assert registry.bind(first, "s0")
+        assert not registry.bind(first, "s0")
+        assert registry.get("s0") is first
+
+        # the agent reconnects before its old socket closed
+        second = registry.open(RecordingSocket())
+        assert registry.bind(second, "s0")
+        assert registry.get("s0") is second and first.system_id is None
+        assert registry.replaced == 1
+        assert await registry.close(first) is None
+
+        assert registry.rename("s0", "s1")
+        assert not registry.rename("s0", "s2")
+        assert registry.get("s0") is None and second.system_id == "s1"
+        assert registry.send_to("s1", {"type": "ping"})
+        assert not registry.send_to("s0", {"type": "ping"})
+        await asyncio.sleep(0)
+        assert second.ws.messages == [{"type": "ping"}]
+
+        assert await registry.close(second) == "s1"
+        assert registry.get("s1") is None and len(registry) == 0
+        assert not registry.send(second, {"type": "ping"})
+
+    asyncio.run(run())
+
+
+def test_registry_drops_what_a_slow_agent_cant_take():
+    async def run():
+        registry = SessionRegistry(queue_size=2)
+        ws = RecordingSocket()
+        ws.blocked.clear()
+        session = registry.open(ws)
+        registry.bind(session, "s0")
+        # the sender task takes the first message and waits on the socket
+        assert registry.send_to("s0", {"n": 0})
+        await asyncio.sleep(0)
+        assert registry.send_to("s0", {"n": 1}) and registry.send_to("s0", {"n": 2})
+        assert not registry.send_to("s0", {"n": 3})
+        assert registry.dropped == 1
+
+        ws.blocked.set()
+        await asyncio.sleep(0.01)
+        assert [m["n"] for m in ws.messages] == [0, 1, 2]
+        assert registry.stats()["sent"] == 3
+
+        ws.blocked.clear()
+        registry.send_to("s0", {"n": 4})
+        await asyncio.sleep(0)
+        registry.send_to("s0", {"n": 5})
+        # still queued when the socket closes
+        await registry.close(session)
+        assert registry.dropped == 2
+
+    asyncio.run(run())
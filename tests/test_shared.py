@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from shared import LocalHub, LocalState, RedisState, SharedState
+
+
+def test_incomplete_backend_fails_on_creation():
+    class Partial(SharedState):
+        def _send(self, lines):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_late_worker_syncs_from_primary():
+    async def run():
+        hub = LocalHub()
+        primary, late = LocalState(hub), LocalState(hub)
+        primary.on_snapshot = lambda: '{"op": "structure", "providers": []}\n'
+        received = []
+        late.on_records = received.extend
+
+        await primary.start()
+        await late.start()
+        assert primary.primary and not late.primary
+        assert received == ['{"op": "structure", "providers": []}\n']
+
+        primary.publish("record\n")
+        await asyncio.sleep(0.01)
+        assert received[-1] == "record\n"
+        assert primary.stats()["syncs"] == 1
+
+    asyncio.run(run())
+
+
+class FakeRedis:
+    """Keys with expiry times, enough of Redis for the lease scripts."""
+
+    def __init__(self):
+        self.keys: dict[str, tuple[str, float]] = {}
+        self.now = 0.0
+
+    def get(self, key):
+        value = self.keys.get(key)
+        return value[0] if value and value[1] > self.now else None
+
+    def eval(self, script, numkeys, key, *args):
+        assert script == RedisState._CLAIM
+        worker_id, lease = args
+        owner = self.get(key)
+        if owner is None or owner == worker_id:
+            self.keys[key] = (worker_id, self.now + lease)
+            return worker_id
+        return owner
+
+    def set(self, key, value, ex):
+        self.keys[key] = (value, self.now + ex)
+
+    def pipeline(self, transaction):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    async def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+def test_expired_lease_is_not_extended_for_another_worker():
+    async def run():
+        redis = FakeRedis()
+        first, second = RedisState(redis, lease=15), RedisState(redis, lease=15)
+        await first._renew()
+        assert first.primary
+
+        # the first worker stalls past its lease and the second takes over
+        redis.now = 20
+        await second._renew()
+        await first._renew()
+        assert second.primary and not first.primary
+        assert redis.keys[first._primary_key] == (second.worker_id, 35)
+
+    asyncio.run(run())
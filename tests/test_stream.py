@@ -0,0 +1,35 @@
+import asyncio
+import json
+
+from stream import Broadcaster
+
+
+def messages(queue: asyncio.Queue) -> list[dict]:
+    result = []
+    while not queue.empty():
+        result.append(json.loads(queue.get_nowait()))
+    return result
+
+
+def test_system_subscribers_hear_about_edits_renames_and_removals(fleet_db):
+    async def run():
+        broadcaster = Broadcaster(fleet_db)
+        queue = broadcaster.subscribe("s1")
+
+        fleet_db.edit_system("s1", name="Renamed")
+        await asyncio.sleep(0)
+        assert [(m["type"], m["system"]["name"]) for m in messages(queue)] == [("system", "Renamed")]
+
+        fleet_db.edit_system_id("s1", "s9")
+        broadcaster.rename("s1", "s9")
+        await asyncio.sleep(0)
+        assert [m["type"] for m in messages(queue)] == ["renamed", "system"]
+
+        fleet_db.remove_system("s9")
+        await asyncio.sleep(0)
+        assert messages(queue) == [{"type": "removed"}]
+
+        broadcaster.unsubscribe(queue)
+        assert broadcaster.stats()["subscribers"] == 0
+
+    asyncio.run(run())
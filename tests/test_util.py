@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from models import Event, EventLevel, EventType, Provider, Site, SiteType, System, SystemDisk, SystemService, SystemType
+from util import DataclassJSONDecoder, DataclassJSONEncoder, dataclass_to_primitive, json_dumps, json_loads, primitive_to_dataclass
+
+
+def make_provider() -> Provider:
+    system = System(id="s0", name="System 0", type=SystemType.SERVER, group="web")
+    system.cpu.usage_pct = 12.5
+    system.network.interfaces = {"eth0": ["10.0.0.1"]}
+    system.disks.append(SystemDisk(device="/dev/sda1", mountpoint="/", fstype="ext4", total_gib=100.0))
+    system.services.append(SystemService(name="nginx", running=True, status="active"))
+    system.events.append(Event.create_event(EventLevel.WARNING, EventType.CPU, 1000.0, clearable=True))
+    return Provider(name="Provider", sites=[Site(name="Home", type=SiteType.HOUSE, geoname="", systems=[system])])
+
+
+def test_codecs_match_the_json_encoder():
+    provider = make_provider()
+    primitive = dataclass_to_primitive([provider])
+    # the compiled encoders emit exactly what the reflective encoder does
+    assert primitive == json.loads(json.dumps([provider], cls=DataclassJSONEncoder))
+
+    assert primitive_to_dataclass(json_loads(json_dumps(primitive))) == [provider]
+    assert json.loads(json_dumps(primitive), cls=DataclassJSONDecoder) == [provider]
+
+
+def test_primitives_share_no_state_with_the_tree():
+    provider = make_provider()
+    primitive = dataclass_to_primitive(provider)
+    system = provider.sites[0].systems[0]
+    system.network.interfaces["eth1"] = ["10.0.0.2"]
+    system.events.clear()
+
+    encoded = primitive["sites"][0]["systems"][0]
+    assert encoded["network"]["interfaces"] == {"eth0": ["10.0.0.1"]}
+    assert len(encoded["events"]) == 1
+
+
+def test_decoding_fills_defaults_and_rejects_unknown_types():
+    system = primitive_to_dataclass({"__type__": "System", "id": "s0", "name": "System 0", "type": "server"})
+    assert system.last_seen == 0 and system.events == [] and system.cpu.usage_pct == 0.0
+    # factories run per object
+    other = primitive_to_dataclass({"__type__": "System", "id": "s1", "name": "System 1", "type": "server"})
+    assert other.events is not system.events and other.auth_key != system.auth_key
+
+    with pytest.raises(ValueError):
+        primitive_to_dataclass({"__type__": "Unknown"})
+
+
+def test_models_are_slotted():
+    provider = make_provider()
+    system = provider.sites[0].systems[0]
+    for obj in (provider, provider.sites[0], system, system.cpu, system.disks[0], system.events[0]):
+        assert not hasattr(obj, "__dict__")
+    with pytest.raises(AttributeError):
+        system.typo = 1
+
+
+def test_decoding_interns_low_cardinality_strings():
+    primitive = dataclass_to_primitive(make_provider())
+    # two separate parses, so every string is a separate object before decoding
+    first = primitive_to_dataclass(json_loads(json_dumps(primitive))).sites[0].systems[0]
+    second = primitive_to_dataclass(json_loads(json_dumps(primitive))).sites[0].systems[0]
+    assert first.disks[0].fstype is second.disks[0].fstype
+    assert first.services[0].status is second.services[0].status
+    assert first.events[0].level is second.events[0].level
+    assert first.group is second.group
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import warnings
+
+
+async def logged_in(dashboard):
+    client = dashboard.app.test_client()
+    response = await client.post("/login", form={"username": "admin", "password": "admin"})
+    assert response.status_code == 302
+    return client
+
+
+def test_failed_login_flashes_a_message(make_dashboard):
+    dashboard = make_dashboard(login_max_failures=2)
+
+    async def run():
+        client = dashboard.app.test_client()
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", RuntimeWarning)
+            response = await client.post("/login", form={"username": "admin", "password": "wrong"})
+        assert response.status_code == 200
+        assert "Invalid username or password" in await response.get_data(as_text=True)
+
+        await client.post("/login", form={"username": "admin", "password": "wrong"})
+        # throttled now, even with the right password
+        response = await client.post("/login", form={"username": "admin", "password": "admin"})
+        assert response.status_code == 429
+        assert "Too many attempts" in await response.get_data(as_text=True)
+
+    asyncio.run(run())
+
+
+def test_logout_flashes_on_the_login_page(make_dashboard):
+    dashboard = make_dashboard()
+
+    async def run():
+        client = dashboard.app.test_client()
+        response = await client.post("/login", form={"username": "admin", "password": "admin"})
+        assert response.status_code == 302
+        await client.get("/logout")
+        response = await client.get("/login")
+        assert "Logged out" in await response.get_data(as_text=True)
+
+    asyncio.run(run())
+
+
+def add_system(dashboard, system_id="s0"):
+    from models import Provider, Site, SiteType, System, SystemType
+
+    dashboard.db.add_provider(Provider(name="Provider", sites=[]))
+    dashboard.db.add_site("Provider", Site(name="Home", type=SiteType.HOUSE, geoname="", systems=[]))
+    dashboard.db.add_system("Home", System(id=system_id, name="System 0", type=SystemType.SERVER))
+
+
+def test_failed_delta_requests_resync(make_dashboard):
+    from sessions import AgentSession
+    from test_protocol import FakeSocket, sent
+
+    dashboard = make_dashboard()
+    usage = {"cpu_pct": 10.0, "mem_used_gib": 1.0, "disks": {}}
+
+    async def run():
+        add_system(dashboard)
+        agent = AgentSession(FakeSocket(), 8)
+        agent.binary = False
+        agent.protocol = 2
+        dashboard.sessions.bind(agent, "s0")
+
+        assert dashboard.sessions.check_sequence(agent, "usage_info", 1)
+        assert dashboard.sessions.check_sequence(agent, "usage_delta", 2)
+        assert dashboard.sessions.check_sequence(agent, "usage_delta", 3)
+        dashboard._apply_batch([
+            # no usage block, fails half way
+            (agent, {"type": "usage_delta", "system_id": "s0", "timestamp": 1, "seq": 2}),
+            (agent, {"type": "usage_delta", "system_id": "s0", "timestamp": 2, "seq": 3, "usage": usage}),
+        ])
+        return agent
+
+    agent = asyncio.run(run())
+    assert sent(agent) == [{"type": "resync", "seq": 3}]
+    # the delta queued behind the failed one wasn't applied on the broken base
+    assert dashboard.db.get_system("s0").cpu.usage_pct != 10.0
+
+
+def test_agent_replies_follow_the_first_frame(make_dashboard):
+    import msgpack
+    from sessions import AgentSession
+    from test_protocol import FakeSocket
+
+    dashboard = make_dashboard()
+
+    async def run():
+        add_system(dashboard)
+        agent = AgentSession(FakeSocket(), 8)
+        await dashboard._receive_ws_message(msgpack.packb({"type": "hello", "system_id": "s0", "protocol": [1, 2]}), agent)
+        # later text frames are still answered in MessagePack
+        await dashboard._receive_ws_message(json.dumps({"type": "get_watch_services", "system_id": "s0"}), agent)
+        return agent
+
+    agent = asyncio.run(run())
+    assert agent.binary is True and agent.protocol == 2
+    assert dashboard.sessions.get("s0") is agent
+    replies = [msgpack.unpackb(agent._queue.get_nowait()) for _ in range(agent._queue.qsize())]
+    assert replies == [{"type": "hello", "protocol": 2}, {"type": "set_watch_services", "services": []}]
+    assert dashboard.sessions.frames == {"json": 1, "msgpack": 1}
+
+
+def test_providers_json_revisions(make_dashboard):
+    from models import System, SystemType
+
+    dashboard = make_dashboard()
+
+    async def run():
+        add_system(dashboard)
+        dashboard.db.add_system("Home", System(id="s1", name="System 1", type=SystemType.SERVER))
+        client = await logged_in(dashboard)
+
+        response = await client.get("/providers.json")
+        tree = await response.get_json()
+        assert [s["id"] for s in tree[0]["sites"][0]["systems"]] == ["s0", "s1"]
+        revision, epoch = response.headers["X-Revision"], response.headers["X-Epoch"]
+        etag = response.headers["ETag"]
+
+        response = await client.get("/providers.json", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        response = await client.get(f"/providers.json?since={revision}&epoch={epoch}")
+        assert response.status_code == 304
+
+        dashboard.db.update_system("s1", last_seen=42)
+        response = await client.get(f"/providers.json?since={revision}&epoch={epoch}")
+        delta = await response.get_json()
+        assert delta["full"] is False
+        assert [(s["id"], s["last_seen"]) for s in delta["systems"]] == [("s1", 42)]
+        assert str(delta["revision"]) == response.headers["X-Revision"] != revision
+
+        # revisions of another epoch, or from before a structural change, get the whole tree
+        response = await client.get(f"/providers.json?since={revision}&epoch=other")
+        assert (await response.get_json())["full"] is True
+        dashboard.db.remove_system("s0")
+        response = await client.get(f"/providers.json?since={delta['revision']}&epoch={epoch}")
+        full = await response.get_json()
+        assert full["full"] is True
+        assert [s["id"] for s in full["providers"][0]["sites"][0]["systems"]] == ["s1"]
+
+    asyncio.run(run())
+
+
+def test_metrics_needs_a_token(make_dashboard):
+    async def scrape(dashboard, headers=None):
+        response = await dashboard.app.test_client().get("/metrics", headers=headers or {})
+        return response.status_code, await response.get_data(as_text=True)
+
+    assert asyncio.run(scrape(make_dashboard()))[0] == 404
+    assert asyncio.run(scrape(make_dashboard(metrics_enabled=True)))[0] == 404
+
+    dashboard = make_dashboard(metrics_enabled=True, metrics_token="secret")
+    assert asyncio.run(scrape(dashboard))[0] == 401
+    assert asyncio.run(scrape(dashboard, {"Authorization": "Bearer wrong"}))[0] == 401
+
+    async def run():
+        add_system(dashboard)
+        return await scrape(dashboard, {"Authorization": "Bearer secret"})
+
+    status, body = asyncio.run(run())
+    assert status == 200
+    assert 'sysmon_system_up{system="s0",name="System 0",provider="Provider",site="Home",group=""} 0' in body